@@ -0,0 +1,92 @@
+"""Measures how long the scheduler takes to parse each DAG file and what the parse imports.
+
+Every file is imported in a fresh interpreter that has already imported Airflow, as the scheduler
+has, so only the cost of the DAG file itself is measured: wall time, resident memory added and the
+heavy task dependencies it pulled in. The run fails when the median parse time of a file is over
+--max-ms or when parsing it imports any of HEAVY_MODULES.
+
+Usage:
+    python -m benchmarks.bench_dag_parse --repeat 5 --max-ms 100
+"""
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+DAGS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dags')
+
+# Dependencies of the task functions that a DAG file must not import at parse time
+HEAVY_MODULES = ('pandas', 'pyarrow', 'pdfplumber', 'pypdfium2', 'gspread', 'google.oauth2', 'googleapiclient',
+                 'oauth2client', 'sqlalchemy', 'psycopg2', 'dotenv')
+
+PARSE_SCRIPT = """
+import importlib.util, json, sys, time
+import psutil
+import airflow
+from airflow.operators.python import PythonOperator
+
+path, heavy_modules = sys.argv[1], sys.argv[2].split(',')
+loaded_before = set(sys.modules)
+process = psutil.Process()
+rss_before = process.memory_info().rss
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('parsed_dag', path)
+spec.loader.exec_module(importlib.util.module_from_spec(spec))
+seconds = time.perf_counter() - start
+print(json.dumps({
+    'seconds': seconds,
+    'rss_mib': (process.memory_info().rss - rss_before) / 2**20,
+    'heavy_imports': [name for name in heavy_modules if name in sys.modules and name not in loaded_before],
+}))
+"""
+
+
+def parse_dag_file(path: str) -> dict:
+    """Imports a DAG file in a new interpreter, after Airflow, and measures it
+
+    Args:
+        path (str): Path of the DAG file
+
+    Returns:
+        dict: `seconds` and `rss_mib` taken by the import and the `heavy_imports` it added
+    """
+    result = subprocess.run([sys.executable, '-c', PARSE_SCRIPT, path, ','.join(HEAVY_MODULES)],
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help='fresh interpreters per DAG file')
+    parser.add_argument('--max-ms', type=float, default=100, help='allowed median parse time per DAG file')
+    args = parser.parse_args()
+    if importlib.util.find_spec('airflow') is None:
+        sys.exit('Airflow is not installed, install it to parse the DAG files')
+
+    failures = []
+    for path in sorted(glob.glob(os.path.join(DAGS_DIR, '*.py'))):
+        runs = [parse_dag_file(path) for _ in range(args.repeat)]
+        milliseconds = statistics.median(run['seconds'] for run in runs) * 1000
+        rss_mib = statistics.median(run['rss_mib'] for run in runs)
+        heavy_imports = sorted({name for run in runs for name in run['heavy_imports']})
+        name = os.path.basename(path)
+        print(f"{name:<24} parse {milliseconds:7.1f} ms  rss +{rss_mib:6.1f} MiB  "
+              f"heavy imports: {', '.join(heavy_imports) or 'none'}")
+
+        if milliseconds > args.max_ms:
+            failures.append(f"{name} parses in {milliseconds:.1f} ms, over {args.max_ms:.0f} ms")
+        if heavy_imports:
+            failures.append(f"{name} imports {', '.join(heavy_imports)} at parse time")
+
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
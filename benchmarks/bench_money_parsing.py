@@ -0,0 +1,81 @@
+"""Compares the chained str.replace cleanup of the amount columns against the Arrow based parsers.
+
+Usage:
+    python -m benchmarks.bench_money_parsing --rows 1000000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+
+import pandas as pd
+import pyarrow as pa
+
+from functions.transform_data import parse_money, parse_quantity
+
+
+def make_raw_tables(rows: int, seed: int = 0) -> pd.DataFrame:
+    """Builds synthetic `pvp`, `total_amount` and `quantity` columns as read from the PDFs
+
+    Args:
+        rows (int): Number of line items
+        seed (int, optional): Seed for the random values
+
+    Returns:
+        pd.DataFrame: Raw string columns in the supplier format ("$1.234,56", "1,5")
+    """
+    rng = random.Random(seed)
+
+    def amount():
+        value = f'{rng.randint(100, 99999999) / 100:,.2f}'
+        return '$' + value.replace(',', ' ').replace('.', ',').replace(' ', '.')
+
+    return pd.DataFrame({
+        'pvp': [amount() for _ in range(rows)],
+        'total_amount': [amount() if rng.random() > 0.01 else None for _ in range(rows)],
+        'quantity': [rng.choice(['1', '2', '6', '12', '1,5', '0,25']) for _ in range(rows)],
+    })
+
+
+def legacy_parse(df: pd.DataFrame) -> pd.DataFrame:
+    """The cleanup convert_table_types did before the Arrow parsers, including the final cast to float
+    """
+    df['quantity'] = df['quantity'].str.replace(',', '.').str.extract(r'(\d+\.?\d*)').astype(float)
+    for column in ('pvp', 'total_amount'):
+        df[column] = df[column].str.replace('$', '', regex=False)\
+            .str.replace('.', '', regex=False).str.replace(',', '.', regex=False).astype(float)
+    return df
+
+
+def arrow_parse(df: pd.DataFrame) -> pd.DataFrame:
+    df['quantity'] = parse_quantity(df['quantity'])
+    for column in ('pvp', 'total_amount'):
+        df[column] = parse_money(df[column])
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000, help='number of line items to parse')
+    args = parser.parse_args()
+
+    raw = make_raw_tables(args.rows)
+    results = {}
+    for name, parse in (('legacy', legacy_parse), ('arrow', arrow_parse)):
+        df = raw.copy()
+        tracemalloc.start()
+        start = time.perf_counter()
+        results[name] = parse(df)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        arrow_peak = pa.default_memory_pool().max_memory()
+        print(f"{name:<7} {args.rows} rows in {elapsed:6.2f}s  {args.rows / elapsed:10.0f} rows/s  "
+              f"python peak {peak / 2**20:7.1f} MiB  arrow pool peak {arrow_peak / 2**20:7.1f} MiB")
+
+    pd.testing.assert_frame_equal(results['legacy'], results['arrow'])
+    print('Both parsers return the same values')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Compares the PDF table extraction backends on a corpus of delivery notes.
+
+For every backend it reports pages/sec, the peak resident memory of the process running it and
+the share of pdfplumber cells it reproduces exactly. Each backend runs in a fresh process, so
+memory and caches do not leak from one backend to the next.
+
+Usage:
+    python -m benchmarks.bench_pdf_backends --notes 32 --items 90
+    python -m benchmarks.bench_pdf_backends --corpus /path/to/pdfs --backends pdfplumber text_layout
+"""
+import argparse
+import glob
+import io
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pdfplumber
+
+from benchmarks.sample_pdfs import write_corpus
+from utils.pdf_extraction import PDF_BACKENDS, extract_raw_tables
+
+REFERENCE_BACKEND = 'pdfplumber'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--corpus', help='directory of PDFs, generated notes are used when missing')
+    parser.add_argument('--notes', type=int, default=32, help='number of generated PDFs')
+    parser.add_argument('--items', type=int, default=90, help='line items per generated PDF')
+    parser.add_argument('--rows-per-page', type=int, default=30, help='line items per generated page')
+    parser.add_argument('--backends', nargs='+', default=list(PDF_BACKENDS), help='backends to compare')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.corpus:
+            paths = sorted(glob.glob(os.path.join(args.corpus, '*.pdf')))
+        else:
+            paths = write_corpus(tmp_dir, notes=args.notes, items=args.items, rows_per_page=args.rows_per_page)
+        pages = sum(__count_pages(path) for path in paths)
+        print(f"Corpus: {len(paths)} PDFs, {pages} pages")
+
+        backends = [REFERENCE_BACKEND] + [backend for backend in args.backends if backend != REFERENCE_BACKEND]
+        results = {}
+        for backend in backends:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                results[backend] = executor.submit(run_backend, backend, paths).result()
+
+    reference = results[REFERENCE_BACKEND]['tables']
+    for backend in backends:
+        result = results[backend]
+        matching, total = __cell_agreement(reference, result['tables'])
+        print(f"{backend:<12} {pages / result['elapsed']:8.1f} pages/s  "
+              f"peak rss +{result['peak_rss'] / 2**20:6.1f} MiB  "
+              f"cells {matching}/{total} ({matching / max(total, 1):6.1%}) agree with {REFERENCE_BACKEND}  "
+              f"failed={result['failed']}")
+
+
+def run_backend(backend: str, paths: list) -> dict:
+    """Extracts the tables of every PDF with one backend, meant to run in a fresh process
+
+    Args:
+        backend (str): Name of the backend
+        paths (List[str]): PDF files
+
+    Returns:
+        dict: `elapsed` seconds, `peak_rss` bytes over the starting one, `failed` PDFs and the
+            `tables` of each PDF (None for the ones that failed)
+    """
+    contents = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            contents.append(f.read())
+
+    start_rss = __max_rss()
+    start = time.perf_counter()
+    tables = []
+    for content in contents:
+        try:
+            tables.append(extract_raw_tables(io.BytesIO(content), backend=backend))
+        except Exception as e:
+            print(f"{backend} failed: {e}")
+            tables.append(None)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'elapsed': elapsed,
+        'peak_rss': __max_rss() - start_rss,
+        'failed': sum(result is None for result in tables),
+        'tables': tables,
+    }
+
+
+def __cell_agreement(reference: list, candidate: list) -> tuple:
+    """
+    Counts the reference cells found with the same text at the same table, row and column.
+    """
+    matching = total = 0
+    for reference_tables, candidate_tables in zip(reference, candidate):
+        for table_index, table in enumerate(reference_tables or []):
+            for row_index, row in enumerate(table):
+                for column_index, cell in enumerate(row):
+                    total += 1
+                    try:
+                        matching += candidate_tables[table_index][row_index][column_index] == cell
+                    except (IndexError, TypeError):
+                        pass
+    return matching, total
+
+
+def __max_rss() -> int:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def __count_pages(path: str) -> int:
+    with pdfplumber.open(path) as document:
+        return len(document.pages)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Measures how PDF table extraction throughput scales with the number of worker processes.
+
+Usage:
+    python -m benchmarks.bench_pdf_extraction --notes 64 --items 60 --max-processes 8
+"""
+import argparse
+import io
+import os
+import time
+
+from benchmarks.sample_pdfs import make_delivery_note_pdf
+from utils.pdf_extraction import extract_tables_from_pdfs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=64, help='number of generated PDFs')
+    parser.add_argument('--items', type=int, default=60, help='line items per PDF')
+    parser.add_argument('--max-processes', type=int, default=os.cpu_count(), help='largest pool size to try')
+    parser.add_argument('--time-limit', type=float, default=120, help='seconds allowed per PDF')
+    args = parser.parse_args()
+
+    corpus = [make_delivery_note_pdf(100000 + index, items=args.items) for index in range(args.notes)]
+    print(f"Corpus: {len(corpus)} PDFs, {sum(len(pdf) for pdf in corpus) / 1024:.0f} KiB")
+
+    baseline = None
+    for processes in __pool_sizes(args.max_processes):
+        pdf_files = [io.BytesIO(pdf) for pdf in corpus]
+        start = time.perf_counter()
+        results = extract_tables_from_pdfs(pdf_files, processes=processes, time_limit=args.time_limit)
+        elapsed = time.perf_counter() - start
+
+        failed = sum(result is None for result in results)
+        throughput = len(corpus) / elapsed
+        baseline = baseline or throughput
+        print(f"processes={processes:<3} {elapsed:7.2f}s {throughput:7.1f} pdf/s "
+              f"speedup={throughput / baseline:4.2f}x failed={failed}")
+
+
+def __pool_sizes(max_processes: int) -> list:
+    sizes = [1]
+    while sizes[-1] * 2 <= max_processes:
+        sizes.append(sizes[-1] * 2)
+    if sizes[-1] != max_processes:
+        sizes.append(max_processes)
+    return sizes
+
+
+if __name__ == '__main__':
+    main()
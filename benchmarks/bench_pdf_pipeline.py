@@ -0,0 +1,70 @@
+"""Compares the batch PDF extraction of make_df_from_pdfs with the download/parse/write pipeline.
+
+Drive is simulated with a fixed download latency, so the overlap between network waits and
+parsing shows up without network access.
+
+Usage:
+    python -m benchmarks.bench_pdf_pipeline --notes 48 --items 60 --latency 0.3 --processes 2
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+import utils.google_drive as google_drive
+from benchmarks.sample_pdfs import make_delivery_note_pdf
+from utils.google_drive import make_df_from_pdfs, stream_df_from_pdfs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=48, help='number of generated PDFs')
+    parser.add_argument('--items', type=int, default=60, help='line items per PDF')
+    parser.add_argument('--latency', type=float, default=0.3, help='simulated seconds per download')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent downloads')
+    parser.add_argument('--processes', type=int, default=1, help='parse worker processes')
+    parser.add_argument('--queue-size', type=int, default=16, help='capacity of the pipeline queues')
+    args = parser.parse_args()
+
+    pdfs = {f'file{index}': make_delivery_note_pdf(100000 + index, items=args.items, seed=index)
+            for index in range(args.notes)}
+    data = pd.DataFrame({
+        'pdf_url': [f'https://drive.google.com/open?id={file_id}' for file_id in pdfs],
+        'note_number': [100000 + index for index in range(args.notes)],
+    })
+
+    def fake_download(file_id, cache=None, timeout=None, max_retries=None):
+        time.sleep(args.latency)
+        return io.BytesIO(pdfs[file_id])
+
+    google_drive.download_pdf_cached = fake_download
+    google_drive.get_pdf_cache = lambda: None
+    google_drive.get_table_cache = lambda: None
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_path = os.path.join(tmp_dir, 'df_tables.feather')
+
+        def run_batch():
+            make_df_from_pdfs(data, max_workers=args.workers, processes=args.processes).to_parquet(
+                os.path.join(tmp_dir, 'df_tables.parquet'))
+
+        def run_pipeline():
+            stream_df_from_pdfs(data, output_path, max_workers=args.workers, processes=args.processes,
+                                queue_size=args.queue_size)
+
+        for name, run in (('batch', run_batch), ('pipeline', run_pipeline)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{name:<9} {elapsed:7.2f}s {args.notes / elapsed:7.1f} pdf/s  python peak {peak / 2**20:7.1f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Compares filtering a worksheet grid through per-row dicts against the columnar Arrow path.
+
+The legacy path is what get_google_sheet_data did with get_all_records: numericise every row,
+build one dict per row, filter them in Python and build the DataFrame from the dicts.
+
+Usage:
+    python -m benchmarks.bench_sheet_ingestion --rows 500000 --dates 3
+"""
+import argparse
+import datetime
+import random
+import time
+import tracemalloc
+
+import gspread
+import pandas as pd
+import pyarrow as pa
+
+from utils.google_drive import SHEET_COLUMN_MAPPING, rows_from_grid
+
+
+def make_grid(rows: int, days: int = 730, seed: int = 0) -> list:
+    """Builds a synthetic worksheet as returned by get_all_values
+
+    Args:
+        rows (int): Number of form responses, below the header
+        days (int, optional): Number of distinct note dates
+        seed (int, optional): Seed for the random values
+
+    Returns:
+        List[List[str]]: The header and the rows, every cell a string
+    """
+    rng = random.Random(seed)
+    first_day = datetime.date(2023, 1, 1)
+    dates = [(first_day + datetime.timedelta(days=day)).strftime('%d/%m/%Y') for day in range(days)]
+    header = list(SHEET_COLUMN_MAPPING)
+
+    grid = [header]
+    for row in range(rows):
+        date = rng.choice(dates)
+        grid.append([
+            f'{date} {rng.randint(8, 20):02d}:{rng.randint(0, 59):02d}:00', rng.choice(['REFRIGERADO', 'SECO']),
+            date, str(100000 + row), str(rng.randint(1000, 900000)), rng.choice(['SI', 'NO']),
+            rng.choice(['CANDELA', 'MARIO']), f'https://drive.google.com/open?id={row}', '', '', '', '',
+            rng.choice(['SI', 'NO']), date[3:5], date[6:], '',
+        ])
+    return grid
+
+
+def legacy_rows(grid: list, filter_values: list, filter_column: str = 'FECHA NOTA') -> pd.DataFrame:
+    header = grid[0]
+    data = [dict(zip(header, gspread.utils.numericise_all(list(row)))) for row in grid[1:]]
+    wanted = set(filter_values)
+    return pd.DataFrame([row for row in data if row.get(filter_column) in wanted], columns=header)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000, help='number of worksheet rows')
+    parser.add_argument('--dates', type=int, default=3, help='number of dates to filter')
+    args = parser.parse_args()
+
+    grid = make_grid(args.rows)
+    filter_values = sorted({row[2] for row in grid[1:args.dates * 50:50]})
+
+    results = {}
+    for name, ingest in (('dicts', legacy_rows), ('columnar', rows_from_grid)):
+        start = time.perf_counter()
+        results[name] = ingest(grid, filter_values)
+        elapsed = time.perf_counter() - start
+
+        # Traced again, tracemalloc slows allocations down too much to time them
+        arrow_start = pa.total_allocated_bytes()
+        tracemalloc.start()
+        ingest(grid, filter_values)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        arrow_peak = pa.default_memory_pool().max_memory() - arrow_start
+        print(f"{name:<9} {args.rows} rows in {elapsed:6.2f}s  {len(results[name])} matching  "
+              f"python peak {peak / 2**20:7.1f} MiB  arrow pool peak {max(arrow_peak, 0) / 2**20:7.1f} MiB")
+
+    pd.testing.assert_frame_equal(results['dicts'], results['columnar'])
+    print('Both paths return the same rows')
+
+
+if __name__ == '__main__':
+    main()
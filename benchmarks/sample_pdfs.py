@@ -0,0 +1,157 @@
+"""Generates synthetic delivery note PDFs in the supplier layout, with no third party dependencies.
+
+The notes reproduce what the real ones look like to pdfplumber: a ruled table with the
+Código / Descripción / PVP / Cantidad / Total / Causa de devolución columns repeated on every
+page, and an optional trailing page with no table.
+"""
+import os
+import random
+
+HEADER = ['Código', 'Descripción', 'PVP', 'Cantidad', 'Total', 'Causa de\ndevolucion']
+COLUMN_WIDTHS = [60, 200, 60, 55, 65, 90]
+PAGE_WIDTH = 595
+PAGE_HEIGHT = 842
+MARGIN = 30
+ROW_HEIGHT = 16
+HEADER_HEIGHT = 24
+FONT_SIZE = 7
+
+DESCRIPTIONS = ['YOGUR BEBIBLE FRUTILLA', 'LECHE ENTERA SACHET', 'QUESO CREMOSO', 'MANTECA',
+                'DULCE DE LECHE', 'CREMA DE LECHE', 'POSTRE DE VAINILLA', 'QUESO RALLADO']
+CAUSES = ['VENCIDO', 'ROTO', 'MAL ESTADO', 'FALTANTE']
+
+
+def make_delivery_note_pdf(note_number: int, items: int = 25, rows_per_page: int = 30,
+                           trailer_page: bool = True, seed: int = None) -> bytes:
+    """Builds a delivery note PDF
+
+    Args:
+        note_number (int): Number printed on the note
+        items (int, optional): Number of line items in the table
+        rows_per_page (int, optional): Line items per page, the header is repeated on each page
+        trailer_page (bool, optional): Add a last page with text but no table
+        seed (int, optional): Seed for the random line item values
+
+    Returns:
+        bytes: Content of the PDF
+    """
+    rng = random.Random(note_number if seed is None else seed)
+    rows = [__make_row(rng) for _ in range(items)]
+
+    pages = []
+    for start in range(0, max(items, 1), rows_per_page):
+        pages.append(__table_page(note_number, rows[start:start + rows_per_page]))
+    if trailer_page:
+        pages.append(__text_page([f'Nota de devolucion {note_number}',
+                                  'Las devoluciones se acreditan en la proxima factura.',
+                                  'Firma y aclaracion del receptor: ____________________']))
+
+    return __build_pdf(pages)
+
+
+def write_corpus(directory: str, notes: int = 50, items: int = 25, rows_per_page: int = 30) -> list:
+    """Writes a corpus of delivery note PDFs to a directory
+
+    Args:
+        directory (str): Directory where the PDFs are written
+        notes (int, optional): Number of PDFs
+        items (int, optional): Line items per PDF
+        rows_per_page (int, optional): Line items per page
+
+    Returns:
+        List[str]: Paths of the written PDFs
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for index in range(notes):
+        note_number = 100000 + index
+        path = os.path.join(directory, f'note_{note_number}.pdf')
+        with open(path, 'wb') as f:
+            f.write(make_delivery_note_pdf(note_number, items=items, rows_per_page=rows_per_page))
+        paths.append(path)
+    return paths
+
+
+def __make_row(rng: random.Random) -> list:
+    pvp = rng.randint(100, 999999) / 100
+    quantity = rng.choice([1, 2, 3, 6, 12, 1.5, 0.5])
+    return [
+        str(rng.randint(100, 999999)),
+        rng.choice(DESCRIPTIONS),
+        '$' + __format_amount(pvp),
+        str(quantity).replace('.', ','),
+        '$' + __format_amount(pvp * quantity),
+        rng.choice(CAUSES),
+    ]
+
+
+def __format_amount(value: float) -> str:
+    """Formats an amount the Spanish way, e.g. 1.234,56"""
+    return f'{value:,.2f}'.replace(',', '_').replace('.', ',').replace('_', '.')
+
+
+def __table_page(note_number: int, rows: list) -> bytes:
+    ops = [__text(MARGIN, PAGE_HEIGHT - MARGIN, f'Nota de devolucion N {note_number}', size=12)]
+
+    top = PAGE_HEIGHT - MARGIN - 30
+    heights = [HEADER_HEIGHT] + [ROW_HEIGHT] * len(rows)
+    xs = [MARGIN]
+    for width in COLUMN_WIDTHS:
+        xs.append(xs[-1] + width)
+
+    y = top
+    for height, cells in zip(heights, [HEADER] + rows):
+        for x, width, cell in zip(xs, COLUMN_WIDTHS, cells):
+            ops.append(f'{x} {y - height} {width} {height} re S'.encode())
+            lines = cell.split('\n')
+            for line_index, line in enumerate(lines):
+                ops.append(__text(x + 2, y - 4 - FONT_SIZE * (line_index + 1), line))
+        y -= height
+
+    return b'\n'.join(ops)
+
+
+def __text_page(lines: list) -> bytes:
+    y = PAGE_HEIGHT - MARGIN
+    ops = []
+    for line in lines:
+        ops.append(__text(MARGIN, y, line, size=10))
+        y -= 14
+    return b'\n'.join(ops)
+
+
+def __text(x: float, y: float, text: str, size: int = FONT_SIZE) -> bytes:
+    escaped = text.encode('cp1252').replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+    return b'BT /F1 %d Tf %.2f %.2f Td (' % (size, x, y) + escaped + b') Tj ET'
+
+
+def __build_pdf(page_streams: list) -> bytes:
+    """Assembles a PDF file from one content stream per page"""
+    page_count = len(page_streams)
+    # Objects: 1 catalog, 2 pages, 3 font, then a page and a content stream per page
+    page_ids = [4 + 2 * index for index in range(page_count)]
+
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [' + b' '.join(b'%d 0 R' % page_id for page_id in page_ids)
+        + b'] /Count %d >>' % page_count,
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+    ]
+    for page_id, stream in zip(page_ids, page_streams):
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] '
+                       b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>'
+                       % (PAGE_WIDTH, PAGE_HEIGHT, page_id + 1))
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+
+    xref_offset = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        out += b'%010d 00000 n \n' % offset
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref_offset)
+    return bytes(out)
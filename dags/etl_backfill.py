@@ -0,0 +1,59 @@
+import sys
+import os
+
+# Add the parent directory of 'dags' to the Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from airflow import DAG  # noqa: E402
+from airflow.operators.python import PythonOperator  # noqa: E402
+from airflow.utils.dates import days_ago  # noqa: E402
+from utils.deferred import deferred_callable  # noqa: E402
+
+
+with DAG(
+    'etl_backfill_dag',
+    default_args={
+        'depends_on_past': False,
+        'email_on_failure': False,
+        'email_on_retry': False,
+        'retries': 1,
+    },
+    description='Extract, transform and load a range of dates, resuming from the dates already extracted',
+    schedule_interval=None,  # Triggered manually with the range in the params
+    start_date=days_ago(1),
+    catchup=False,
+    params={
+        'start_date': '01/08/2024',
+        'end_date': '31/08/2024',
+        'reset': False,  # Extract every date again, even the ones a previous run finished (first try only)
+    },
+    render_template_as_native_obj=True,  # So `reset` reaches the task as a bool
+) as dag:
+
+    # Finished dates are checkpointed, so every retry only extracts the ones that failed
+    extract_task = PythonOperator(
+        task_id='extract_data',
+        python_callable=deferred_callable('functions.extract_data:backfill_extract'),
+        retries=3,
+        op_kwargs={
+            "start_date": "{{ params.start_date }}",
+            "end_date": "{{ params.end_date }}",
+            "reset": "{{ params.reset }}",
+        },
+    )
+
+    transform_task = PythonOperator(
+        task_id='transform_data',
+        python_callable=deferred_callable('functions.transform_data:transform_data'),
+    )
+
+    load_task = PythonOperator(
+        task_id='load_data',
+        python_callable=deferred_callable('functions.load_data:load_data'),
+        op_kwargs={
+            "table_name_devolutions": "devolutions",
+            "table_name_pdf": "pdf_devolutions",
+        },
+    )
+
+    extract_task >> transform_task >> load_task
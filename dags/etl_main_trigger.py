@@ -4,27 +4,47 @@ import os
 # Add the parent directory of 'dags' to the Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from functions.transform_data import transform_data  # noqa: E402
-from functions.extract_data import extract_data  # noqa: E402
-from functions.load_data import load_data  # noqa: E402
 from airflow import DAG  # noqa: E402
-from airflow.operators.python import PythonOperator, BranchPythonOperator  # noqa: E402
-from airflow.operators.dummy import DummyOperator  # noqa: E402
+from airflow.exceptions import AirflowSkipException  # noqa: E402
+from airflow.operators.python import PythonOperator  # noqa: E402
 from airflow.utils.dates import days_ago  # noqa: E402
-from utils.constants import DEFAULT_DATES  # noqa: E402
+# The scheduler parses this file every few seconds, so the task modules, and pandas, gspread or
+# SQLAlchemy with them, are only imported when a task runs
+from utils.deferred import deferred_callable  # noqa: E402
 
 
-def check_dataframes(**context):
-    ti = context['ti']
-    file_paths = ti.xcom_pull(task_ids='extract_data')
+def check_dataframes(file_paths) -> bool:
+    """
+    Tells whether an extract shard produced any rows to transform and load.
+    """
+    from utils.intermediate_store import read_manifest
 
     df_path, df_tables_path = file_paths
+
+    # The manifest has the row counts, so the data files do not need to be opened
+    manifest = read_manifest(os.path.dirname(df_path), 'extract')
+    if manifest is not None:
+        return any(file['rows'] > 0 for file in manifest['files'].values())
+
     if not (os.path.exists(df_path) and os.path.exists(df_tables_path)):
-        return 'skip_transform_load'
+        return False
+
+    return os.path.getsize(df_path) > 0 or os.path.getsize(df_tables_path) > 0
+
 
-    if os.path.getsize(df_path) == 0 and os.path.getsize(df_tables_path) == 0:
-        return 'skip_transform_load'
-    return 'transform_data'
+def transform_shard(file_paths, **context):
+    """
+    Transform one extract shard, skipping it when it has no rows so the load step ignores it.
+    """
+    if not check_dataframes(file_paths):
+        raise AirflowSkipException(f"Extract shard {os.path.dirname(file_paths[0])} has no rows")
+
+    from functions.transform_data import transform_data
+    return transform_data(file_paths=file_paths, **context)
+
+
+def as_transform_kwargs(file_paths) -> dict:
+    return {"file_paths": file_paths}
 
 
 with DAG(
@@ -41,41 +61,35 @@ with DAG(
     catchup=False,
 ) as dag:
 
-    extract_task = PythonOperator(
-        task_id='extract_data',
-        python_callable=extract_data,
-        provide_context=True,
-        op_kwargs={
-            "processing_dates": DEFAULT_DATES,
-        },
+    # Reads the sheet once and splits the rows in shards, one per date or per EXTRACT_SHARD_SIZE PDFs,
+    # of DEFAULT_DATES or, with INCREMENTAL_EXTRACT, of the rows appended since the last load
+    plan_task = PythonOperator(
+        task_id='plan_shards',
+        python_callable=deferred_callable('functions.extract_data:plan_shards'),
     )
 
-    check_task = BranchPythonOperator(
-        task_id='check_dataframes',
-        python_callable=check_dataframes,
-        provide_context=True,
-    )
+    # One mapped task instance per shard, each one retried on its own
+    extract_task = PythonOperator.partial(
+        task_id='extract_data',
+        python_callable=deferred_callable('functions.extract_data:extract_shard'),
+    ).expand(op_kwargs=plan_task.output)
 
-    transform_task = PythonOperator(
+    transform_task = PythonOperator.partial(
         task_id='transform_data',
-        python_callable=transform_data,
-        provide_context=True,
-    )
+        python_callable=transform_shard,
+    ).expand(op_kwargs=extract_task.output.map(as_transform_kwargs))
 
+    # Loads every transformed shard, skipped shards are left out
     load_task = PythonOperator(
         task_id='load_data',
-        python_callable=load_data,
-        provide_context=True,
+        python_callable=deferred_callable('functions.load_data:load_data'),
+        trigger_rule='none_failed_min_one_success',
         op_kwargs={
+            "shard_file_paths": transform_task.output,
+            "watermark_task_id": "plan_shards",
             "table_name_devolutions": "devolutions",
             "table_name_pdf": "pdf_devolutions",
         },
     )
 
-    skip_task = DummyOperator(
-        task_id='skip_transform_load'
-    )
-
-    extract_task >> check_task
-    check_task >> transform_task >> load_task
-    check_task >> skip_task
+    plan_task >> extract_task >> transform_task >> load_task
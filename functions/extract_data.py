@@ -1,25 +1,59 @@
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-from utils.google_drive import get_google_sheet_data, make_df_from_pdfs
-from utils.constants import SHEET_NAME, WORKSHEET_NAME, PDF_COLUMN, NOTE_COLUMN, TEMP_DIR
+from utils.google_drive import get_google_sheet_data, get_google_sheet_data_by_dates, get_google_sheet_rows_since, \
+    make_df_from_pdfs, stream_df_from_pdfs
+from utils.state import delete_state, read_state, read_watermark, stale_states, write_state
+from utils.pdf_cache import get_pdf_cache
+from utils.table_cache import get_table_cache
+from utils.loaded_notes import get_loaded_notes_index
+from utils.db import get_engine
+from utils.metrics import instrumented, metrics
+from utils.dtypes import compact_dtypes
+from utils.intermediate_store import clean_run, read_frame, run_directory, stage_file_path, write_frame, \
+    write_manifest, write_stage
+from utils.constants import SHEET_NAME, WORKSHEET_NAME, PDF_COLUMN, NOTE_COLUMN, COMPACT_DTYPES, EXTRACT_SHARD_SIZE, \
+    PIPELINED_EXTRACT, BACKFILL_CHUNK_DAYS, BACKFILL_WORKERS, BACKFILL_STATE_TTL_DAYS, FORCE_REPROCESS, DEFAULT_DATES, \
+    INCREMENTAL_EXTRACT
 import pandas as pd
 
 
-def extract_data(processing_dates: str, **context) -> tuple[str, str]:
+@instrumented('extract')
+def extract_data(processing_dates: str = None, single_fetch: bool = True, incremental: bool = False,
+                 compact: bool = COMPACT_DTYPES, force: bool = FORCE_REPROCESS, **context) -> tuple[str, str]:
     """
     Extract data for multiple dates
 
     Args:
         processing_dates (List[str]): List of dates to process in DD/MM/YYYY format
+        single_fetch (bool): Download the worksheet once and partition it by date in memory,
+            instead of downloading it again for every date
+        incremental (bool): Ignore `processing_dates` and extract only the rows appended since the
+            last successful load
+        compact (bool): Write the parquet files with categorical, Arrow backed string and downcast
+            integer columns, printing the memory saved
+        force (bool): Download and parse the PDFs of notes already loaded too, see skip_loaded_notes
     """
+    if incremental:
+        return __extract_incremental(context, compact, force)
+
     dates_list = processing_dates.split(',')
     dates_list = [date.strip() for date in dates_list]
     dfs = []
     dfs_tables = []
 
+    if single_fetch:
+        frames_by_date, rows_per_date = get_google_sheet_data_by_dates(SHEET_NAME, WORKSHEET_NAME, dates_list)
+        __report_rows_per_date(rows_per_date, context)
+
     for date in dates_list:
         try:
-            df, df_tables = __extract_single_date(date)
+            if single_fetch:
+                df, df_tables = __extract_date_from_frame(frames_by_date[date], force)
+            else:
+                df, df_tables = __extract_single_date(date, force)
             dfs.append(df)
             dfs_tables.append(df_tables)
         except Exception as e:
@@ -32,55 +66,369 @@ def extract_data(processing_dates: str, **context) -> tuple[str, str]:
     final_df = pd.concat(dfs, ignore_index=True)
     final_df_tables = pd.concat(dfs_tables, ignore_index=True)
 
-    return __make_parquet_files(final_df, final_df_tables)
+    for cache in (get_pdf_cache(), get_table_cache()):
+        if cache:
+            cache.report()
+
+    metrics.incr('extract_rows', len(final_df))
+    metrics.incr('extract_table_rows', len(final_df_tables))
+    return __make_parquet_files(final_df, final_df_tables, context.get('run_id'), compact)
+
+
+@instrumented('plan')
+def plan_shards(processing_dates: str = DEFAULT_DATES, incremental: bool = INCREMENTAL_EXTRACT,
+                shard_size: int = EXTRACT_SHARD_SIZE, **context) -> list[dict]:
+    """
+    Read the sheet once and split the rows to process in shards, one mapped extract task each.
+
+    Every date is a shard of its own, split again in chunks of `shard_size` rows (one PDF per row)
+    when `shard_size` is set. The rows of each shard are saved in the intermediate store, so the
+    extract tasks do not read the sheet again.
+
+    Args:
+        processing_dates (str): Comma separated dates in DD/MM/YYYY format, DEFAULT_DATES by default
+        incremental (bool): Ignore `processing_dates` and plan only the rows appended since the
+            last successful load, the new watermark is pushed to XCom as in extract_data.
+            INCREMENTAL_EXTRACT by default
+        shard_size (int): Maximum number of rows per shard, 0 for one shard per date
+        **context: Airflow context dictionary
+
+    Returns:
+        List[dict]: Keyword arguments of extract_shard for every shard, empty if there are no rows
+    """
+    ti = context.get('ti')
+    if incremental:
+        df, new_watermark = get_google_sheet_rows_since(SHEET_NAME, WORKSHEET_NAME, read_watermark())
+        frames_by_key = {'incremental': df}
+        if ti:
+            ti.xcom_push(key='pending_watermark', value=new_watermark)
+    else:
+        dates_list = [date.strip() for date in processing_dates.split(',')]
+        frames_by_key, rows_per_date = get_google_sheet_data_by_dates(SHEET_NAME, WORKSHEET_NAME, dates_list)
+        __report_rows_per_date(rows_per_date, context)
+
+    shards = []
+    for key, df in frames_by_key.items():
+        if df.empty:
+            continue
+        step = shard_size or len(df)
+        for start in range(0, len(df), step):
+            shard = f'{len(shards):04d}_{key}'
+            sheet_rows = df.iloc[start:start + step].reset_index(drop=True)
+            sheet_rows_path, = write_stage('plan', {'sheet_rows': sheet_rows}, context.get('run_id'), shard=shard)
+            shards.append({'shard': shard, 'sheet_rows_path': sheet_rows_path})
+
+    print(f"Planned {len(shards)} extract shards")
+    return shards
+
+
+@instrumented('extract')
+def extract_shard(shard: str, sheet_rows_path: str, compact: bool = COMPACT_DTYPES, pipelined: bool = PIPELINED_EXTRACT,
+                  force: bool = FORCE_REPROCESS, **context) -> tuple[str, str]:
+    """
+    Extract the PDF tables for the sheet rows of one shard planned by plan_shards.
+
+    Args:
+        shard (str): Name of the shard, its files are saved in a directory of their own
+        sheet_rows_path (str): File with the sheet rows of the shard
+        compact (bool): Save the files with compact dtypes, see extract_data
+        pipelined (bool): Write the PDF tables as they are parsed, see stream_df_from_pdfs
+        force (bool): Extract the PDFs of notes already loaded too, see extract_data
+
+    Returns:
+        tuple[str, str]: Paths of the devolutions and PDF tables files of the shard
+    """
+    if pipelined:
+        return __extract_pipelined(read_frame(sheet_rows_path), context.get('run_id'), compact, force, shard=shard)
+
+    df, df_tables = __extract_date_from_frame(read_frame(sheet_rows_path), force)
+    metrics.incr('extract_rows', len(df))
+    metrics.incr('extract_table_rows', len(df_tables))
+
+    for cache in (get_pdf_cache(), get_table_cache()):
+        if cache:
+            cache.report()
 
+    return __make_parquet_files(df, df_tables, context.get('run_id'), compact, shard=shard)
 
-def __extract_single_date(date: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+
+@instrumented('extract')
+def backfill_extract(start_date: str, end_date: str, chunk_days: int = BACKFILL_CHUNK_DAYS,
+                     max_workers: int = BACKFILL_WORKERS, allow_failures: bool = False,
+                     compact: bool = COMPACT_DTYPES, force: bool = FORCE_REPROCESS, reset: bool = False,
+                     **context) -> tuple[str, str]:
+    """
+    Extract every date of a range, checkpointing each date so retries resume where they stopped.
+
+    The dates are processed in chunks of `chunk_days`, `max_workers` chunks at a time, each chunk
+    reading the sheet once. Every finished date is recorded in a state document together with the
+    files it produced, and dates already done (with their files still on disk) are skipped, so a
+    retry or a new run of the same range only extracts the dates that failed or were never reached.
+
+    Once every date is done, their files are combined into the files of the run and the state and
+    per date files are removed, so a later run of the range extracts it again. Backfills left
+    unfinished are removed after BACKFILL_STATE_TTL_DAYS without progress.
+
+    Args:
+        start_date (str): First date of the range, in DD/MM/YYYY format
+        end_date (str): Last date of the range, included, in DD/MM/YYYY format
+        chunk_days (int): Number of dates per chunk
+        max_workers (int): Number of chunks extracted concurrently
+        allow_failures (bool): Return the dates that succeeded even if some failed, instead of
+            failing the task so it is retried
+        compact (bool): Save the files with compact dtypes, see extract_data
+        force (bool): Extract the PDFs of notes already loaded too, see extract_data
+        reset (bool): Discard the checkpoints of the range and extract every date again. Only
+            applied on the first try, so the retries of a reset run still resume from its checkpoints
+        **context: Airflow context dictionary
+
+    Returns:
+        tuple[str, str]: Paths of the devolutions and PDF tables files of the whole range
+    """
+    dates = __date_range(start_date, end_date)
+    # Names both the state document and the directory of the files of every date
+    backfill_id = 'backfill_' + '_'.join(date.replace('/', '-') for date in (dates[0], dates[-1]))
+    for stale_id in stale_states('backfill_', BACKFILL_STATE_TTL_DAYS * 24 * 3600):
+        print(f"Removing backfill {stale_id}, unfinished for over {BACKFILL_STATE_TTL_DAYS:g} days")
+        __discard_backfill(stale_id)
+    ti = context.get('ti')
+    if reset and (ti is None or ti.try_number <= 1):
+        __discard_backfill(backfill_id)
+    state = read_state(backfill_id, default={'start_date': start_date, 'end_date': end_date, 'dates': {}})
+    lock = threading.Lock()
+
+    pending = [date for date in dates if not __is_checkpointed(state['dates'].get(date))]
+    print(f"Backfill {start_date} - {end_date}: {len(dates) - len(pending)} of {len(dates)} dates already done")
+
+    def checkpoint(date, **entry):
+        with lock:
+            state['dates'][date] = dict(entry, updated_at=datetime.now().isoformat())
+            write_state(backfill_id, state)
+
+    def extract_chunk(chunk):
+        try:
+            frames_by_date, _ = get_google_sheet_data_by_dates(SHEET_NAME, WORKSHEET_NAME, chunk)
+        except Exception as e:
+            for date in chunk:
+                checkpoint(date, status='failed', error=str(e))
+            return
+
+        for date in chunk:
+            try:
+                df, df_tables = __extract_date_from_frame(frames_by_date[date], force)
+                artifacts = None
+                if len(df):
+                    artifacts = __make_parquet_files(df, df_tables, backfill_id, compact,
+                                                     shard=date.replace('/', '-'))
+                checkpoint(date, status='done', rows=len(df), artifacts=artifacts)
+            except Exception as e:
+                print(f"Error processing date {date}: {e}")
+                checkpoint(date, status='failed', error=str(e))
+
+    chunks = [pending[start:start + chunk_days] for start in range(0, len(pending), chunk_days)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(extract_chunk, chunks))
+
+    failed = [date for date in dates if state['dates'][date]['status'] == 'failed']
+    print(f"Backfill {start_date} - {end_date}: {len(dates) - len(failed)} dates done, {len(failed)} failed")
+    for date in failed:
+        print(f"  {date}: {state['dates'][date]['error']}")
+
+    if ti:
+        ti.xcom_push(key='backfill_failed_dates', value=failed)
+    if failed and not allow_failures:
+        raise RuntimeError(f"Backfill failed for {len(failed)} dates: {', '.join(failed)}")
+
+    artifacts = [state['dates'][date]['artifacts'] for date in dates
+                 if state['dates'][date]['status'] == 'done' and state['dates'][date]['artifacts']]
+    if not artifacts:
+        raise ValueError("No data was extracted for any of the provided dates")
+
+    final_df = pd.concat([read_frame(df_path) for df_path, _ in artifacts], ignore_index=True)
+    final_df_tables = pd.concat([read_frame(df_tables_path) for _, df_tables_path in artifacts], ignore_index=True)
+    metrics.incr('extract_rows', len(final_df))
+    metrics.incr('extract_table_rows', len(final_df_tables))
+    file_paths = __make_parquet_files(final_df, final_df_tables, context.get('run_id'), compact)
+
+    # The files of the run now hold every date, the checkpoints are only needed to resume failures
+    if not failed:
+        __discard_backfill(backfill_id)
+    return file_paths
+
+
+def __discard_backfill(backfill_id: str) -> None:
+    """
+    Remove the state document of a backfill and the files of its dates.
+    """
+    clean_run(backfill_id)
+    delete_state(backfill_id)
+
+
+def __date_range(start_date: str, end_date: str) -> list[str]:
+    """
+    Every date between two DD/MM/YYYY dates, both included.
+    """
+    start = datetime.strptime(start_date.strip(), '%d/%m/%Y')
+    end = datetime.strptime(end_date.strip(), '%d/%m/%Y')
+    if end < start:
+        raise ValueError(f"Backfill end date {end_date} is before its start date {start_date}")
+    return [(start + timedelta(days=day)).strftime('%d/%m/%Y') for day in range((end - start).days + 1)]
+
+
+def __is_checkpointed(entry: dict) -> bool:
+    """
+    Tells whether a date of a backfill is done and the files it produced are still on disk.
+    """
+    if not entry or entry['status'] != 'done':
+        return False
+    return all(os.path.exists(path) for path in entry['artifacts'] or [])
+
+
+def __extract_incremental(context: dict, compact: bool, force: bool) -> tuple[str, str]:
+    """
+    Extract the sheet rows past the watermark. The new watermark is pushed to XCom and only
+    committed by load_data once the rows are loaded.
+    """
+    watermark = read_watermark()
+    df, new_watermark = get_google_sheet_rows_since(SHEET_NAME, WORKSHEET_NAME, watermark)
+
+    df, df_tables = __extract_date_from_frame(df, force)
+    metrics.incr('extract_rows', len(df))
+    metrics.incr('extract_table_rows', len(df_tables))
+
+    ti = context.get('ti')
+    if ti:
+        ti.xcom_push(key='pending_watermark', value=new_watermark)
+
+    return __make_parquet_files(df, df_tables, context.get('run_id'), compact)
+
+
+def __extract_pipelined(df: pd.DataFrame, run_id: str, compact: bool, force: bool,
+                        shard: str = None) -> tuple[str, str]:
+    """
+    Extract the PDF tables of the sheet rows with the download, parse and write pipeline, the
+    tables go straight to their file instead of being collected in memory first.
+    """
+    directory = run_directory(run_id, shard)
+    os.makedirs(directory, exist_ok=True)
+    df_path = stage_file_path(directory, 'df_devolutions')
+    df_tables_path = stage_file_path(directory, 'df_tables')
+
+    rows = stream_df_from_pdfs(skip_loaded_notes(df[[PDF_COLUMN, NOTE_COLUMN]], force), df_tables_path)
+    metrics.incr('extract_table_rows', rows)
+
+    for cache in (get_pdf_cache(), get_table_cache()):
+        if cache:
+            cache.report()
+
+    df = __to_numeric_columns(df)
+    metrics.incr('extract_rows', len(df))
+    write_frame(compact_dtypes(df, 'extract devolutions') if compact else df, df_path)
+    write_manifest('extract', {'df_devolutions': df_path, 'df_tables': df_tables_path})
+    return df_path, df_tables_path
+
+
+def __extract_single_date(date: str, force: bool = False) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     Extract data for a single date
     """
     df: pd.DataFrame = get_google_sheet_data(SHEET_NAME, WORKSHEET_NAME, date)
 
-    new_df = df[[PDF_COLUMN, NOTE_COLUMN]]
+    return __extract_date_from_frame(df, force)
+
+
+def __extract_date_from_frame(df: pd.DataFrame, force: bool = False) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Extract the PDF tables for the sheet rows of a single date
+    """
+    new_df = skip_loaded_notes(df[[PDF_COLUMN, NOTE_COLUMN]], force)
 
     df_tables = make_df_from_pdfs(new_df)
 
     return df, df_tables
 
 
-def __create_temp_dir():
+def skip_loaded_notes(df: pd.DataFrame, force: bool = False) -> pd.DataFrame:
     """
-    Create a temporary directory for storing parquet files.
+    Leave out the sheet rows of notes whose PDF tables are already loaded, so their PDF is
+    neither downloaded nor parsed again. The sheet rows themselves are still extracted.
+
+    Args:
+        df (pd.DataFrame): Sheet rows with the PDF_COLUMN and NOTE_COLUMN columns
+        force (bool): Keep every row, to reprocess the PDFs of loaded notes
 
     Returns:
-        str: Path to the created temporary directory
+        pd.DataFrame: Rows whose PDF still has to be extracted
+    """
+    index = get_loaded_notes_index()
+    if force or index is None or df.empty:
+        return df
+
+    try:
+        index.refresh(get_engine())
+    except Exception as e:
+        print(f"Could not refresh the loaded notes index, no PDF is skipped: {e}")
+        return df
+
+    note_numbers = pd.to_numeric(df[NOTE_COLUMN], errors='coerce')
+    loaded = note_numbers.isin(index.loaded(note_numbers.dropna()))
+    print(f"Skipped {loaded.sum()} of {len(df)} PDFs of notes already loaded")
+    metrics.incr('pdfs_skipped_loaded', int(loaded.sum()))
+    return df[~loaded]
+
+
+def __report_rows_per_date(rows_per_date: dict, context: dict) -> None:
     """
-    os.makedirs(TEMP_DIR, exist_ok=True)
-    return TEMP_DIR
+    Print the number of sheet rows found for each date and push them to XCom.
 
+    Args:
+        rows_per_date (dict[str, int]): Number of rows keyed by date
+        context (dict): Airflow context dictionary
+    """
+    for date, rows in rows_per_date.items():
+        print(f"Rows found for date {date}: {rows}")
+
+    empty_dates = [date for date, rows in rows_per_date.items() if rows == 0]
+    if empty_dates:
+        print(f"Dates without data: {', '.join(empty_dates)}")
 
-def __make_parquet_files(df: pd.DataFrame, df_tables: pd.DataFrame) -> tuple[str, str]:
+    ti = context.get('ti')
+    if ti:
+        ti.xcom_push(key='rows_per_date', value=rows_per_date)
+
+
+def __make_parquet_files(df: pd.DataFrame, df_tables: pd.DataFrame, run_id: str,
+                         compact: bool = False, shard: str = None) -> tuple[str, str]:
     """
-    Save DataFrames as parquet files in the temporary directory.
+    Save DataFrames in the intermediate store, in a directory of their own for the DAG run.
 
     Args:
         df (pd.DataFrame): Main DataFrame to save
         df_tables (pd.DataFrame): PDF tables DataFrame to save
+        run_id (str): Airflow run id
+        compact (bool): Convert the DataFrames to compact dtypes before saving them
+        shard (str, optional): Shard of the run the DataFrames belong to
 
     Returns:
-        tuple[str, str]: Tuple containing paths to the saved parquet files:
-            - Path to main DataFrame parquet file
-            - Path to PDF tables DataFrame parquet file
+        tuple[str, str]: Tuple containing paths to the saved files (Feather or parquet, see INTERMEDIATE_FORMAT):
+            - Path to main DataFrame file
+            - Path to PDF tables DataFrame file
+    """
+    df = __to_numeric_columns(df)
+    if compact:
+        df = compact_dtypes(df, 'extract devolutions')
+        df_tables = compact_dtypes(df_tables, 'extract tables')
+
+    return write_stage('extract', {'df_devolutions': df, 'df_tables': df_tables}, run_id, shard=shard)
+
+
+def __to_numeric_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert the year and month columns to integers.
     """
     # This is to avoid errors when converting to parquet
     numeric_columns = ['year', 'month']
     for col in numeric_columns:
         if col in df.columns:
             df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0).astype('int64')
-
-    __create_temp_dir()
-    df_path = f'{TEMP_DIR}/df_devolutions.parquet'
-    df_tables_path = f'{TEMP_DIR}/df_tables.parquet'
-    df.to_parquet(df_path)
-    df_tables.to_parquet(df_tables_path)
-    return df_path, df_tables_path
+    return df
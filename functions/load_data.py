@@ -1,20 +1,39 @@
-import pandas as pd
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.engine import Engine
-import os
 
-from utils.db import create_postgres_connection
-from utils.constants import DB_USER, TEMP_DIR
+from utils.db import copy_parquet_to_table, get_engine, upsert_parquet_to_table
+from utils.intermediate_store import clean_run, read_frame
+from utils.constants import DB_USER, LOAD_METHOD
+from utils.metrics import instrumented, merge_summaries, metrics
+from utils.state import commit_watermark
 
+# Columns identifying a row of each table, used by the upsert load
+MERGE_KEYS = {
+    'devolutions': ['note_number'],
+    'pdf_devolutions': ['devolution_id', 'code'],
+}
 
-def load_data(**context) -> None:
+
+# Tasks whose metrics are gathered in the run summary pushed by load_data
+UPSTREAM_TASKS = ('plan_shards', 'extract_data', 'transform_data')
+
+
+@instrumented('load')
+def load_data(load_method: str = LOAD_METHOD, shard_file_paths: list = None, watermark_task_id: str = 'extract_data',
+              **context) -> None:
     """
-    Load transformed data from parquet files into PostgreSQL database tables.
+    Load transformed data from the intermediate files into PostgreSQL database tables.
 
-    This function reads the transformed DataFrames from parquet files, establishes a database connection,
-    and loads the data into two tables: 'devolutions' and 'pdfs'. After loading, it cleans up temporary files.
+    This function reads the transformed DataFrames from the files written by transform_data, establishes
+    a database connection, and loads the data into two tables: 'devolutions' and 'pdfs'. After loading,
+    it deletes the intermediate files of the DAG run.
 
     Args:
+        load_method (str): 'copy' streams the files with COPY FROM STDIN, 'upsert' merges them through
+            staging tables so retries do not duplicate rows, 'insert' uses DataFrame.to_sql
+        shard_file_paths (List[tuple[str, str]], optional): Files of every transformed shard, by default
+            the ones returned by the transform_data task
+        watermark_task_id (str): Task that pushed the pending watermark of incremental runs
         **context: Airflow context dictionary containing task instance and other execution info
 
     Raises:
@@ -22,36 +41,22 @@ def load_data(**context) -> None:
         Exception: If any other error occurs during execution
     """
     ti = context['ti']
-    file_paths = ti.xcom_pull(task_ids='transform_data')
-    transformed_df_path, transformed_tables_path = file_paths
-
-    df = pd.read_parquet(transformed_df_path)
-    df_tables = pd.read_parquet(transformed_tables_path)
+    if shard_file_paths is None:
+        shard_file_paths = [ti.xcom_pull(task_ids='transform_data')]
 
-    engine = None
     try:
-        engine: Engine = create_postgres_connection()
-
-        with engine.connect() as connection:
-            print('Connection created')
-
-            df.to_sql(
-                'devolutions',
-                connection,
-                schema=f"{DB_USER}_schema",
-                if_exists="append",
-                index=False,
-            )
-            print('Devolutions data loaded')
-
-            df_tables.to_sql(
-                'pdf_devolutions',
-                connection,
-                schema=f"{DB_USER}_schema",
-                if_exists="append",
-                index=False,
-            )
-            print('PDFs data loaded')
+        engine: Engine = get_engine()
+
+        rows = 0
+        with metrics.timer('db_write'):
+            for transformed_df_path, transformed_tables_path in shard_file_paths:
+                if load_method == 'copy':
+                    rows += __copy_files(engine, transformed_df_path, transformed_tables_path)
+                elif load_method == 'upsert':
+                    rows += __upsert_files(engine, transformed_df_path, transformed_tables_path)
+                else:
+                    rows += __insert_files(engine, transformed_df_path, transformed_tables_path)
+        __report_load_rate(rows)
 
     except SQLAlchemyError as e:
         print(f"Database error: {e}")
@@ -59,24 +64,99 @@ def load_data(**context) -> None:
     except Exception as e:
         print(f"An error occurred: {e}")
         raise
-    finally:
-        if engine:
-            engine.dispose()
 
-    __clean_temp_files()
+    # Incremental runs only move the watermark once their rows are safely loaded
+    pending_watermark = ti.xcom_pull(task_ids=watermark_task_id, key='pending_watermark')
+    if pending_watermark:
+        commit_watermark(pending_watermark)
+
+    clean_run(context.get('run_id'))
+    __push_run_summary(ti)
+
+
+def __report_load_rate(rows: int) -> None:
+    """
+    Record the rows written and the load throughput.
+    """
+    metrics.incr('load_rows', rows)
+    seconds = metrics.summary()['stages'].get('db_write', 0)
+    if seconds:
+        metrics.gauge('load_rows_per_second', round(rows / seconds, 1))
+        print(f"Loaded {rows} rows at {rows / seconds:.0f} rows/s")
+
+
+def __push_run_summary(ti) -> None:
+    """
+    Add up the metrics pushed by the upstream tasks, mapped ones included, and push the run summary.
+    """
+    summaries = []
+    for task_id in UPSTREAM_TASKS:
+        pulled = ti.xcom_pull(task_ids=task_id, key='metrics')
+        if isinstance(pulled, dict):
+            summaries.append(pulled)
+        elif pulled is not None:
+            summaries.extend(summary for summary in pulled if summary)
 
+    run_summary = merge_summaries(summaries)
+    print(f"Run summary: slowest stage {run_summary['slowest_stage']}, stages {run_summary['stages']}")
+    ti.xcom_push(key='run_metrics', value=run_summary)
 
-def __clean_temp_files() -> None:
+
+def __copy_files(engine: Engine, transformed_df_path: str, transformed_tables_path: str) -> int:
     """
-    Clean all files from the temporary directory.
+    Bulk load the files with COPY, one transaction per table. Returns the rows loaded.
     """
-    if os.path.exists(TEMP_DIR):
-        files = os.listdir(TEMP_DIR)
-        for file_name in files:
-            file_path = os.path.join(TEMP_DIR, file_name)
-            try:
-                if os.path.isfile(file_path):
-                    os.remove(file_path)
-                    print(f"Removed file: {file_path}")
-            except Exception as e:
-                print(f"Error removing {file_path}: {e}")
+    schema = f"{DB_USER}_schema"
+
+    rows = copy_parquet_to_table(engine, transformed_df_path, 'devolutions', schema)
+    print(f'Devolutions data loaded: {rows} rows')
+
+    table_rows = copy_parquet_to_table(engine, transformed_tables_path, 'pdf_devolutions', schema)
+    print(f'PDFs data loaded: {table_rows} rows')
+    return rows + table_rows
+
+
+def __upsert_files(engine: Engine, transformed_df_path: str, transformed_tables_path: str) -> int:
+    """
+    Merge the files through staging tables, updating the rows that are already loaded. Returns the rows merged.
+    """
+    schema = f"{DB_USER}_schema"
+
+    rows = upsert_parquet_to_table(engine, transformed_df_path, 'devolutions', schema, MERGE_KEYS['devolutions'])
+    print(f'Devolutions data loaded: {rows} rows merged')
+
+    table_rows = upsert_parquet_to_table(engine, transformed_tables_path, 'pdf_devolutions', schema,
+                                         MERGE_KEYS['pdf_devolutions'])
+    print(f'PDFs data loaded: {table_rows} rows merged')
+    return rows + table_rows
+
+
+def __insert_files(engine: Engine, transformed_df_path: str, transformed_tables_path: str) -> int:
+    """
+    Load the files with DataFrame.to_sql. Returns the rows loaded.
+    """
+    df = read_frame(transformed_df_path)
+    df_tables = read_frame(transformed_tables_path)
+
+    with engine.connect() as connection:
+        print('Connection created')
+
+        df.to_sql(
+            'devolutions',
+            connection,
+            schema=f"{DB_USER}_schema",
+            if_exists="append",
+            index=False,
+        )
+        print('Devolutions data loaded')
+
+        df_tables.to_sql(
+            'pdf_devolutions',
+            connection,
+            schema=f"{DB_USER}_schema",
+            if_exists="append",
+            index=False,
+        )
+        print('PDFs data loaded')
+
+    return len(df) + len(df_tables)
@@ -1,43 +1,133 @@
 from datetime import datetime
+import os
 import pandas as pd
-from utils.constants import PDF_COLUMN, TEMP_DIR
-
-
-def transform_data(**context) -> tuple[str, str]:
+import pyarrow as pa
+import pyarrow.compute as pc
+from utils.constants import PDF_COLUMN, INTERMEDIATE_FORMAT, STREAMING_TRANSFORM, TRANSFORM_BATCH_ROWS, COMPACT_DTYPES
+from utils.dtypes import compact_dtypes
+from utils.intermediate_store import iter_batches, open_writer, read_frame, read_manifest, read_schema, \
+    stage_file_path, write_frame, write_manifest
+from utils.metrics import instrumented, metrics
+
+
+@instrumented('transform')
+def transform_data(streaming: bool = STREAMING_TRANSFORM, batch_rows: int = TRANSFORM_BATCH_ROWS,
+                   compact: bool = COMPACT_DTYPES, file_paths: tuple = None, **context) -> tuple[str, str]:
     """
     Transform extracted data by mapping columns, removing unused ones, and converting data types.
 
-    This function takes the parquet files created by extract_data, performs several transformations
-    on both the main DataFrame and PDF tables DataFrame, and saves the transformed data back to
-    parquet files.
+    This function takes the files created by extract_data, performs several transformations
+    on both the main DataFrame and PDF tables DataFrame, and saves the transformed data next to
+    them in the intermediate store, along with a manifest.
 
     Args:
+        streaming (bool): Transform the files in batches of `batch_rows` rows, appending each one to
+            the output file, so peak memory depends on the batch size and not on the dataset size
+        batch_rows (int): Number of rows per batch in streaming mode
+        compact (bool): Write the transformed files with categorical, Arrow backed string and downcast
+            integer columns, printing the memory saved
+        file_paths (tuple[str, str], optional): Files to transform, by default the ones returned by
+            the extract_data task. Mapped transform tasks get the files of their shard
         **context: Airflow context dictionary containing task instance and other execution info
 
     Returns:
-        tuple[str, str]: A tuple containing the file paths of the transformed parquet files
+        tuple[str, str]: A tuple containing the file paths of the transformed files
             (transformed_df_path, transformed_tables_path)
     """
-    ti = context['ti']
-    df_path, df_tables_path = ti.xcom_pull(task_ids='extract_data')
+    if file_paths is None:
+        file_paths = context['ti'].xcom_pull(task_ids='extract_data')
+    df_path, df_tables_path = file_paths
+
+    directory = os.path.dirname(df_path)
+    transformed_df_path = stage_file_path(directory, 'transformed_df', INTERMEDIATE_FORMAT)
+    transformed_tables_path = stage_file_path(directory, 'transformed_tables', INTERMEDIATE_FORMAT)
+
+    extracted_date = datetime.today()
+
+    def transform_devolutions(df: pd.DataFrame) -> pd.DataFrame:
+        df = map_devolution_columns(df, extracted_date)
+        df = remove_unused_devolution_columns(df)
+        df = convert_devolution_types(df)
+        return compact_dtypes(df, 'transform devolutions') if compact else df
+
+    def transform_tables(df_tables: pd.DataFrame) -> pd.DataFrame:
+        df_tables = map_table_columns(df_tables, extracted_date)
+        df_tables = remove_unused_table_columns(df_tables)
+        df_tables = convert_table_types(df_tables)
+        return compact_dtypes(df_tables, 'transform tables') if compact else df_tables
+
+    if streaming:
+        transform_parquet_in_batches(df_path, transformed_df_path, transform_devolutions, batch_rows)
+        transform_parquet_in_batches(df_tables_path, transformed_tables_path, transform_tables, batch_rows)
+    else:
+        write_frame(transform_devolutions(read_frame(df_path)), transformed_df_path)
+        write_frame(transform_tables(read_frame(df_tables_path)), transformed_tables_path)
+
+    manifest = write_manifest('transform', {'transformed_df': transformed_df_path,
+                                            'transformed_tables': transformed_tables_path})
+    extract_manifest = read_manifest(directory, 'extract')
+    if extract_manifest:
+        metrics.incr('transform_rows_in', sum(file['rows'] for file in extract_manifest['files'].values()))
+    metrics.incr('transform_rows_out', sum(file['rows'] for file in manifest['files'].values()))
+    return transformed_df_path, transformed_tables_path
 
-    df = pd.read_parquet(df_path)
-    df_tables = pd.read_parquet(df_tables_path)
 
-    df, df_tables = map_custom_columns(df, df_tables)
+def transform_parquet_in_batches(source_path: str, output_path: str, transform, batch_rows: int) -> int:
+    """
+    Apply a DataFrame transformation to a parquet or Feather file one record batch at a time.
 
-    df, df_tables = remove_unused_columns(df, df_tables)
+    Each transformed batch is appended to the output file right away, so only one batch is held
+    in memory. Reading the output back gives the same DataFrame as transforming the whole file at once.
 
-    df, df_tables = convert_data_types(df, df_tables)
+    Args:
+        source_path (str): File to read
+        output_path (str): File to write, its extension gives the format
+        transform (Callable[[pd.DataFrame], pd.DataFrame]): Transformation applied to every batch
+        batch_rows (int): Number of rows per batch
 
-    # Save transformed DataFrames to parquet files in same dir
-    transformed_df_path = f'{TEMP_DIR}/transformed_df.parquet'
-    transformed_tables_path = f'{TEMP_DIR}/transformed_tables.parquet'
+    Returns:
+        int: Number of rows written
+    """
+    writer = None
+    schema = None
+    rows = 0
+    try:
+        for df in (batch.to_pandas() for batch in iter_batches(source_path, batch_rows)):
+            table = pa.Table.from_pandas(transform(df), preserve_index=False)
+            if writer is None:
+                writer, schema = open_writer(output_path, __writable_schema(table.schema))
+            writer.write_table(table.cast(schema))
+            rows += table.num_rows
+
+        # Empty input, still write a file with the transformed schema
+        if writer is None:
+            empty_df = transform(read_schema(source_path).empty_table().to_pandas())
+            write_frame(empty_df.reset_index(drop=True), output_path)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return rows
+
+
+def __writable_schema(schema: pa.Schema) -> pa.Schema:
+    """
+    Replace the null type of columns that are empty in the first batch by string, so the
+    following batches can be cast to the schema of the first one. Integers and dictionary
+    indices narrowed by compact dtypes are widened, as later batches may need more room.
+    """
+    fields = [field.with_type(__writable_type(field.type)) for field in schema]
+    return pa.schema(fields, metadata=schema.metadata)
 
-    df.to_parquet(transformed_df_path)
-    df_tables.to_parquet(transformed_tables_path)
 
-    return transformed_df_path, transformed_tables_path
+def __writable_type(data_type: pa.DataType) -> pa.DataType:
+    if pa.types.is_null(data_type):
+        return pa.string()
+    if pa.types.is_integer(data_type):
+        return pa.int64()
+    if pa.types.is_dictionary(data_type):
+        return pa.dictionary(pa.int32(), __writable_type(data_type.value_type))
+    return data_type
 
 
 def convert_data_types(df: pd.DataFrame, df_tables: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
@@ -51,6 +141,19 @@ def convert_data_types(df: pd.DataFrame, df_tables: pd.DataFrame) -> tuple[pd.Da
     Returns:
         tuple[pd.DataFrame, pd.DataFrame]: A tuple containing the DataFrames with converted data types.
     """
+    return convert_devolution_types(df), convert_table_types(df_tables)
+
+
+def convert_devolution_types(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert data types of the columns of the main DataFrame.
+
+    Args:
+        df (pd.DataFrame): The main DataFrame.
+
+    Returns:
+        pd.DataFrame: The DataFrame with converted data types.
+    """
     # First map original dataset keys
     df['original_timestamp'] = pd.to_datetime(df['original_timestamp'])
     df['note_date'] = pd.to_datetime(df['note_date'], format='%d/%m/%Y')
@@ -59,24 +162,90 @@ def convert_data_types(df: pd.DataFrame, df_tables: pd.DataFrame) -> tuple[pd.Da
     df['should_be_paid'] = df['should_be_paid'].map({'SI': True, 'TEST': True, 'NO': False, '': False})
     df['was_uploaded'] = df['was_uploaded'].map({'SI': True, 'TEST': True, 'NO': False, '': False})
     df['month'] = df['month'].astype(int)
-    df['year'] = df['year'].fillna(2024).replace('', 2024).astype(int)
+    df['year'] = df['year'].astype(object).fillna(2024).replace('', 2024).astype(int)
+
+    return df
+
+
+def convert_table_types(df_tables: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert data types of the columns of the PDF tables DataFrame.
 
+    Args:
+        df_tables (pd.DataFrame): The PDF tables DataFrame.
+
+    Returns:
+        pd.DataFrame: The DataFrame with converted data types.
+    """
     # clean data from pdf tables
     df_tables['description'] = df_tables['description'].str.replace('\n', ' ').str.strip()
-    df_tables['quantity'] = df_tables['quantity'].str.replace(',', '.')\
-        .str.extract('(\d+\.?\d*)').astype(float)  # noqa: W605
-    if 'total_amount' in df_tables.columns and df_tables['total_amount'].notna().any():
-        df_tables['total_amount'] = df_tables['total_amount']\
-            .str.replace('$', '', regex=False)\
-            .str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    df_tables['quantity'] = parse_quantity(df_tables['quantity'])
+    if 'total_amount' in df_tables.columns:
+        df_tables['total_amount'] = parse_money(df_tables['total_amount'])
     if 'devolution_type' in df_tables.columns and df_tables['devolution_type'].notna().any():
         df_tables['devolution_type'] = df_tables['devolution_type'].str.replace('\n', ' ').str.strip()
 
-    if 'pvp' in df_tables.columns and df_tables['pvp'].notna().any():
-        df_tables['pvp'] = df_tables['pvp'].str.replace('$', '', regex=False)\
-            .str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    if 'pvp' in df_tables.columns:
+        df_tables['pvp'] = parse_money(df_tables['pvp'])
+
+    return df_tables
+
+
+def parse_money(series: pd.Series) -> pd.Series:
+    """
+    Parse Spanish formatted amounts such as "$1.234,56" into floats.
+
+    The parsing runs on Arrow compute kernels over the whole column, without creating an
+    intermediate Python string per row and step. Values that are not amounts become NaN.
+
+    Args:
+        series (pd.Series): Column of amounts as strings.
+
+    Returns:
+        pd.Series: Column of float amounts.
+    """
+    values = __to_arrow_strings(series)
+    # Drop the currency sign, spaces and thousands separators, then use a dot as decimal separator
+    values = pc.replace_substring_regex(values, pattern=r'[$.\s]', replacement='')
+    values = pc.replace_substring(values, pattern=',', replacement='.')
+    return __to_float_series(values, series.index)
+
 
-    return df, df_tables
+def parse_quantity(series: pd.Series) -> pd.Series:
+    """
+    Parse quantities such as "1,5" or "2 UN" into floats, keeping the first number of each value.
+
+    Args:
+        series (pd.Series): Column of quantities as strings.
+
+    Returns:
+        pd.Series: Column of float quantities, NaN where no number is found.
+    """
+    values = __to_arrow_strings(series)
+    values = pc.struct_field(pc.extract_regex(values, pattern=r'(?P<value>\d+(?:[.,]\d+)?)'), [0])
+    values = pc.replace_substring(values, pattern=',', replacement='.')
+    return __to_float_series(values, series.index)
+
+
+def __to_arrow_strings(series: pd.Series) -> pa.Array:
+    """
+    Convert a pandas column to an Arrow string array, nulls included.
+    """
+    if pd.api.types.infer_dtype(series, skipna=True) not in ('string', 'empty'):
+        series = series.where(series.isna(), series.astype(str))
+    return pa.array(series, type=pa.string(), from_pandas=True)
+
+
+def __to_float_series(values: pa.Array, index: pd.Index) -> pd.Series:
+    """
+    Cast an Arrow string array of plain numbers to a float column, invalid numbers becoming NaN.
+    """
+    try:
+        floats = pc.cast(values, pa.float64())
+    except pa.ArrowInvalid:
+        valid = pc.match_substring_regex(values, pattern=r'^-?\d+(\.\d+)?$')
+        floats = pc.cast(pc.if_else(valid, values, pa.scalar(None, pa.string())), pa.float64())
+    return pd.Series(floats.to_numpy(zero_copy_only=False), index=index, dtype='float64')
 
 
 def remove_unused_columns(df: pd.DataFrame, df_tables: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
@@ -89,26 +258,67 @@ def remove_unused_columns(df: pd.DataFrame, df_tables: pd.DataFrame) -> tuple[pd
     Returns:
         pd.DataFrame: The DataFrame with unused columns removed.
     """
-    df = df.drop(columns=['not_used_date', 'not_used_column'])
+    return remove_unused_devolution_columns(df), remove_unused_table_columns(df_tables)
+
+
+def remove_unused_devolution_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Remove unused columns from the main DataFrame.
+
+    Args:
+        df (pd.DataFrame): The main DataFrame.
+
+    Returns:
+        pd.DataFrame: The DataFrame with unused columns removed.
+    """
+    return df.drop(columns=['not_used_date', 'not_used_column'])
+
+
+def remove_unused_table_columns(df_tables: pd.DataFrame) -> pd.DataFrame:
+    """
+    Remove unused columns and line items without quantity from the PDF tables DataFrame.
+
+    Args:
+        df_tables (pd.DataFrame): The PDF tables DataFrame.
+
+    Returns:
+        pd.DataFrame: The DataFrame with unused columns and rows removed.
+    """
     df_tables = df_tables[(df_tables['quantity'].notna()) & (df_tables['quantity'] != 0)].reset_index(drop=True)
     if 'not_used_column' in df_tables.columns:
         df_tables = df_tables.drop(columns=['not_used_column'])
 
-    return df, df_tables
+    return df_tables
 
 
-def map_custom_columns(df: pd.DataFrame, df_tables: pd.DataFrame) -> tuple[pd.DataFrame, pd.DataFrame]:
+def map_custom_columns(df: pd.DataFrame, df_tables: pd.DataFrame,
+                       extracted_date: datetime = None) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     Map custom column names for both main DataFrame and PDF tables DataFrame.
 
     Args:
         df (pd.DataFrame): The main DataFrame.
         df_tables (pd.DataFrame): The PDF tables DataFrame.
+        extracted_date (datetime, optional): Value of the `extracted_date` column, defaults to now.
 
     Returns:
         tuple[pd.DataFrame, pd.DataFrame]: A tuple containing the DataFrames with mapped column names.
     """
+    extracted_date = extracted_date or datetime.today()
+    return map_devolution_columns(df, extracted_date), map_table_columns(df_tables, extracted_date)
+
+
+def map_table_columns(df_tables: pd.DataFrame, extracted_date: datetime = None) -> pd.DataFrame:
+    """
+    Map custom column names for the PDF tables DataFrame.
+
+    Args:
+        df_tables (pd.DataFrame): The PDF tables DataFrame.
+        extracted_date (datetime, optional): Value of the `extracted_date` column, defaults to now.
 
+    Returns:
+        pd.DataFrame: The DataFrame with mapped column names.
+    """
     column_mapping_pdf = {
         'Código': 'code',
         'Descripción': 'description',
@@ -122,8 +332,22 @@ def map_custom_columns(df: pd.DataFrame, df_tables: pd.DataFrame) -> tuple[pd.Da
         'ComCalid': 'not_used_column'
     }
     df_tables = __map_columns_to_tables(df=df_tables, column_mapping=column_mapping_pdf)
-    df_tables['extracted_date'] = datetime.today()
+    df_tables['extracted_date'] = extracted_date or datetime.today()
+
+    return df_tables
+
+
+def map_devolution_columns(df: pd.DataFrame, extracted_date: datetime = None) -> pd.DataFrame:
+    """
+    Map custom column names for the main DataFrame.
 
+    Args:
+        df (pd.DataFrame): The main DataFrame.
+        extracted_date (datetime, optional): Value of the `extracted_date` column, defaults to now.
+
+    Returns:
+        pd.DataFrame: The DataFrame with mapped column names.
+    """
     column_mapping_devolution = {
         'Marca temporal': 'original_timestamp',
         'FAMILIA PRODUCTOS': 'product_family',
@@ -143,9 +367,9 @@ def map_custom_columns(df: pd.DataFrame, df_tables: pd.DataFrame) -> tuple[pd.Da
         'MES CONFIRMADA': 'confirmed_month'
     }
     df = __map_columns_to_tables(df, column_mapping=column_mapping_devolution)
-    df['extracted_date'] = datetime.today()
+    df['extracted_date'] = extracted_date or datetime.today()
 
-    return df, df_tables
+    return df
 
 
 def __map_columns_to_tables(df: pd.DataFrame, column_mapping: dict) -> pd.DataFrame:
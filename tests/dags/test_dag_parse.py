@@ -0,0 +1,13 @@
+import glob
+import os
+
+import pytest
+
+from benchmarks.bench_dag_parse import DAGS_DIR, parse_dag_file
+
+pytest.importorskip('airflow')
+
+
+@pytest.mark.parametrize('path', sorted(glob.glob(os.path.join(DAGS_DIR, '*.py'))), ids=os.path.basename)
+def test_dag_parse_does_not_import_task_dependencies(path):
+    assert parse_dag_file(path)['heavy_imports'] == []
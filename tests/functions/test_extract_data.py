@@ -0,0 +1,189 @@
+import os
+
+import pandas as pd
+import pytest
+
+import functions.extract_data as extract_module
+import utils.intermediate_store as intermediate_store
+import utils.state as state
+from functions.extract_data import backfill_extract, extract_shard, plan_shards
+from functions.transform_data import convert_table_types, map_table_columns, remove_unused_table_columns
+from utils.intermediate_store import read_frame, read_manifest
+
+
+def test_plan_shards_splits_dates_in_chunks(mock_sheet):
+    shards = plan_shards('25/08/2024, 26/08/2024, 27/08/2024', shard_size=2, run_id='manual')
+
+    assert [shard['shard'] for shard in shards] == ['0000_25/08/2024', '0001_25/08/2024', '0002_26/08/2024']
+    assert [len(read_frame(shard['sheet_rows_path'])) for shard in shards] == [2, 1, 1]
+
+
+def test_plan_shards_skips_dates_without_rows(mock_sheet):
+    shards = plan_shards('25/08/2024, 24/08/2024', shard_size=0, run_id='manual')
+
+    assert [shard['shard'] for shard in shards] == ['0000_25/08/2024']
+    assert len(read_frame(shards[0]['sheet_rows_path'])) == 3
+
+
+def test_plan_shards_without_new_rows(mock_sheet, monkeypatch):
+    monkeypatch.setattr(extract_module, 'read_watermark', lambda: {'row': 5})
+    monkeypatch.setattr(extract_module, 'get_google_sheet_rows_since',
+                        lambda sheet_name, worksheet_name, watermark: (mock_sheet.iloc[0:0], watermark))
+
+    assert plan_shards(incremental=True, shard_size=0, run_id='manual') == []
+
+
+def test_extract_shard_writes_its_own_directory(mock_sheet, monkeypatch):
+    monkeypatch.setattr(extract_module, 'make_df_from_pdfs',
+                        lambda df: pd.DataFrame({'code': ['608'] * len(df), 'devolution_id': df['note_number']}))
+    shard = plan_shards('26/08/2024', run_id='manual')[0]
+
+    df_path, df_tables_path = extract_shard(**shard, run_id='manual')
+
+    assert shard['shard'].replace('/', '_') in df_path
+    manifest = read_manifest(os.path.dirname(df_path), 'extract')
+    assert manifest['files']['df_devolutions']['rows'] == 1
+    assert read_frame(df_tables_path)['devolution_id'].tolist() == [101410]
+
+
+@pytest.mark.parametrize('force', [False, True])
+def test_extract_shard_skips_pdfs_of_loaded_notes(mock_sheet, monkeypatch, force):
+    extracted = []
+
+    class LoadedIndex:
+        def refresh(self, engine):
+            return 1
+
+        def loaded(self, note_numbers):
+            return {101408} & set(note_numbers)
+
+    monkeypatch.setattr(extract_module, 'get_loaded_notes_index', LoadedIndex)
+    monkeypatch.setattr(extract_module, 'get_engine', lambda: None)
+    monkeypatch.setattr(extract_module, 'make_df_from_pdfs',
+                        lambda df: extracted.extend(df['note_number']) or pd.DataFrame())
+    shard = plan_shards('25/08/2024', run_id='manual')[0]
+
+    df_path, _ = extract_shard(**shard, force=force, run_id='manual')
+
+    assert extracted == ([101407, 101408, 101409] if force else [101407, 101409])
+    assert len(read_frame(df_path)) == 3
+
+
+def test_transform_handles_shards_whose_notes_are_all_loaded(mock_sheet, monkeypatch):
+    class LoadedIndex:
+        def refresh(self, engine):
+            return 3
+
+        def loaded(self, note_numbers):
+            return set(note_numbers)
+
+    monkeypatch.setattr(extract_module, 'get_loaded_notes_index', LoadedIndex)
+    monkeypatch.setattr(extract_module, 'get_engine', lambda: None)
+    shard = plan_shards('25/08/2024', run_id='manual')[0]
+
+    _, df_tables_path = extract_shard(**shard, run_id='manual')
+    transformed_tables = convert_table_types(remove_unused_table_columns(map_table_columns(read_frame(df_tables_path))))
+
+    assert transformed_tables.empty
+    assert {'quantity', 'devolution_id', 'extracted_date'} <= set(transformed_tables.columns)
+
+
+def test_backfill_resumes_from_checkpoints(mock_sheet, tmp_path, monkeypatch):
+    monkeypatch.setattr(state, 'STATE_DIR', str(tmp_path / 'state'))
+    extracted = []
+
+    def make_df_from_pdfs(df):
+        extracted.extend(df['note_number'])
+        if 101410 in extracted and len(extracted) < 5:
+            raise ConnectionError('Drive unavailable')
+        return pd.DataFrame({'code': ['608'] * len(df), 'devolution_id': df['note_number']})
+
+    monkeypatch.setattr(extract_module, 'make_df_from_pdfs', make_df_from_pdfs)
+
+    with pytest.raises(RuntimeError, match='26/08/2024'):
+        backfill_extract('24/08/2024', '26/08/2024', chunk_days=2, max_workers=1, run_id='manual')
+    assert extracted == [101407, 101408, 101409, 101410]
+    checkpoints = state.read_state('backfill_24-08-2024_26-08-2024')['dates']
+    assert {date: entry['status'] for date, entry in checkpoints.items()} == \
+        {'24/08/2024': 'done', '25/08/2024': 'done', '26/08/2024': 'failed'}
+    assert checkpoints['24/08/2024']['rows'] == 0
+
+    df_path, df_tables_path = backfill_extract('24/08/2024', '26/08/2024', chunk_days=2, max_workers=1, run_id='manual')
+
+    # Only the failed date is extracted again
+    assert extracted == [101407, 101408, 101409, 101410, 101410]
+    assert read_frame(df_tables_path)['devolution_id'].tolist() == [101407, 101408, 101409, 101410]
+    # Once complete, the checkpoints and per date files are removed
+    assert state.read_state('backfill_24-08-2024_26-08-2024') == {}
+    assert not os.path.exists(intermediate_store.run_directory('backfill_24-08-2024_26-08-2024'))
+
+
+def test_backfill_reset_and_expiry(mock_sheet, tmp_path, monkeypatch):
+    monkeypatch.setattr(state, 'STATE_DIR', str(tmp_path / 'state'))
+    monkeypatch.setattr(extract_module, 'make_df_from_pdfs',
+                        lambda df: pd.DataFrame({'code': ['608'] * len(df), 'devolution_id': df['note_number']}))
+    checkpoint = {'status': 'done', 'rows': 1, 'artifacts': None}
+    state.write_state('backfill_25-08-2024_25-08-2024', {'dates': {'25/08/2024': checkpoint}})
+    state.write_state('backfill_01-01-2024_02-01-2024', {'dates': {}})
+    os.utime(tmp_path / 'state' / 'backfill_01-01-2024_02-01-2024.json', (0, 0))
+
+    df_path, _ = backfill_extract('25/08/2024', '25/08/2024', reset=True, run_id='manual')
+
+    # The date checkpointed as done is extracted again, the abandoned backfill is removed
+    assert len(read_frame(df_path)) == 3
+    assert os.listdir(tmp_path / 'state') == []
+
+
+def test_backfill_retry_after_reset_resumes_from_checkpoints(mock_sheet, tmp_path, monkeypatch):
+    monkeypatch.setattr(state, 'STATE_DIR', str(tmp_path / 'state'))
+    extracted = []
+
+    def make_df_from_pdfs(df):
+        extracted.extend(df['note_number'])
+        if 101410 in extracted and len(extracted) < 5:
+            raise ConnectionError('Drive unavailable')
+        return pd.DataFrame({'code': ['608'] * len(df), 'devolution_id': df['note_number']})
+
+    monkeypatch.setattr(extract_module, 'make_df_from_pdfs', make_df_from_pdfs)
+
+    with pytest.raises(RuntimeError, match='26/08/2024'):
+        backfill_extract('25/08/2024', '26/08/2024', chunk_days=1, max_workers=1, reset=True,
+                         ti=MockTaskInstance(try_number=1), run_id='manual')
+    backfill_extract('25/08/2024', '26/08/2024', chunk_days=1, max_workers=1, reset=True,
+                     ti=MockTaskInstance(try_number=2), run_id='manual')
+
+    # The retry keeps the checkpoints of the first try and only extracts the failed date
+    assert extracted == [101407, 101408, 101409, 101410, 101410]
+
+
+''' FIXTURES '''
+
+
+class MockTaskInstance:
+    def __init__(self, try_number):
+        self.try_number = try_number
+
+    def xcom_push(self, key, value):
+        pass
+
+
+@pytest.fixture
+def mock_sheet(tmp_path, monkeypatch):
+    monkeypatch.setattr(intermediate_store, 'TEMP_DIR', str(tmp_path))
+    monkeypatch.setattr(extract_module, 'get_table_cache', lambda: None)
+    monkeypatch.setattr(extract_module, 'get_pdf_cache', lambda: None)
+    monkeypatch.setattr(extract_module, 'get_loaded_notes_index', lambda: None)
+
+    df = pd.DataFrame({
+        'FECHA NOTA': ['25/08/2024', '25/08/2024', '25/08/2024', '26/08/2024'],
+        'NOTA': [101407, 101408, 101409, 101410],
+        'pdf_url': ['https://drive.google.com/file/d/abc/view'] * 4,
+    })
+
+    def get_google_sheet_data_by_dates(sheet_name, worksheet_name, filter_values):
+        frames = {date: df[df['FECHA NOTA'] == date].rename(columns={'NOTA': 'note_number'})
+                  for date in filter_values}
+        return frames, {date: len(frame) for date, frame in frames.items()}
+
+    monkeypatch.setattr(extract_module, 'get_google_sheet_data_by_dates', get_google_sheet_data_by_dates)
+    return df
@@ -1,7 +1,13 @@
+import os
+
 import pandas as pd
 import pytest
 
-from functions.transform_data import convert_data_types, map_custom_columns, remove_unused_columns
+import utils.intermediate_store as intermediate_store
+from functions.transform_data import convert_data_types, map_custom_columns, parse_money, parse_quantity, \
+    remove_unused_columns, transform_data
+from utils.dtypes import compact_dtypes
+from utils.intermediate_store import read_frame, read_manifest, write_stage
 
 
 def test_convert_data_types(mock_transform_data_payload):
@@ -13,8 +19,22 @@ def test_convert_data_types(mock_transform_data_payload):
     assert converted_df['note_number'].iloc[0] == 101407
 
     assert isinstance(converted_df_tables['quantity'].iloc[0], float)
-    assert isinstance(converted_df_tables['total_amount'].iloc[0], str)
-    assert isinstance(converted_df_tables['pvp'].iloc[0], str)
+    assert isinstance(converted_df_tables['total_amount'].iloc[0], float)
+    assert isinstance(converted_df_tables['pvp'].iloc[0], float)
+    assert converted_df_tables['quantity'].iloc[0] == 1.5
+    assert converted_df_tables['total_amount'].iloc[0] == 37120.0
+    assert converted_df_tables['pvp'].iloc[0] == 1234.56
+
+
+def test_parse_money_and_quantity():
+    money = pd.Series(['$1.234,56', '37120', ' $ 12,5 ', None, '', 'N/A'], index=[5, 6, 7, 8, 9, 10])
+    quantity = pd.Series(['1,5', '2 UN', '12', None, 'x'])
+
+    pd.testing.assert_series_equal(
+        parse_money(money),
+        pd.Series([1234.56, 37120.0, 12.5, None, None, None], index=[5, 6, 7, 8, 9, 10], dtype='float64'),
+    )
+    pd.testing.assert_series_equal(parse_quantity(quantity), pd.Series([1.5, 2.0, 12.0, None, None], dtype='float64'))
 
 
 def test_remove_unused_columns(mock_transform_data_payload):
@@ -39,9 +59,49 @@ def test_remove_unused_columns(mock_transform_data_payload):
     assert 'pvp' in converted_df_tables.columns
 
 
+@pytest.mark.parametrize('compact', [False, True])
+def test_streaming_transform_matches_in_memory(mock_transform_data_payload, tmp_path, monkeypatch, compact):
+    df, df_tables = mock_transform_data_payload
+    if compact:
+        df, df_tables = compact_dtypes(df, 'extract devolutions'), compact_dtypes(df_tables, 'extract tables')
+    monkeypatch.setattr(intermediate_store, 'TEMP_DIR', str(tmp_path))
+
+    outputs = {}
+    for streaming in (False, True):
+        file_paths = write_stage('extract', {'df_devolutions': df, 'df_tables': df_tables}, f'streaming_{streaming}')
+        outputs[streaming] = transform_data(streaming=streaming, batch_rows=1, compact=compact, file_paths=file_paths)
+
+    for in_memory_path, streaming_path in zip(outputs[False], outputs[True]):
+        expected = read_frame(in_memory_path).drop(columns=['extracted_date'])
+        result = read_frame(streaming_path).drop(columns=['extracted_date'])
+        pd.testing.assert_frame_equal(result, expected, check_dtype=not compact, check_categorical=not compact)
+
+
+def test_transform_reads_files_from_xcom(mock_transform_data_payload, tmp_path, monkeypatch):
+    df, df_tables = mock_transform_data_payload
+    monkeypatch.setattr(intermediate_store, 'TEMP_DIR', str(tmp_path))
+    file_paths = write_stage('extract', {'df_devolutions': df, 'df_tables': df_tables}, 'manual')
+
+    transformed_df_path, _ = transform_data(ti=MockTaskInstance(file_paths))
+
+    assert os.path.dirname(transformed_df_path) == os.path.dirname(file_paths[0])
+    assert read_manifest(os.path.dirname(transformed_df_path), 'transform')['files']['transformed_df']['rows'] == 2
+
+
 ''' FIXTURES '''
 
 
+class MockTaskInstance:
+    def __init__(self, xcom_value):
+        self.xcom_value = xcom_value
+
+    def xcom_pull(self, task_ids=None, key=None):
+        return self.xcom_value
+
+    def xcom_push(self, key, value):
+        pass
+
+
 @pytest.fixture
 def mock_transform_data_payload():
     # DataFrame for the main data
@@ -0,0 +1,25 @@
+import importlib
+
+import pytest
+
+import utils.constants
+
+
+@pytest.mark.parametrize('value', ['', '12'])
+def test_blank_settings_fall_back_to_defaults(monkeypatch, value):
+    monkeypatch.setenv('DRIVE_MAX_WORKERS', value)
+    monkeypatch.setenv('TABLE_CACHE_ENABLED', '')
+    constants = importlib.reload(utils.constants)
+
+    assert constants.DRIVE_MAX_WORKERS == (int(value) if value else 8)
+    assert constants.TABLE_CACHE_ENABLED is True
+
+
+''' FIXTURES '''
+
+
+@pytest.fixture(autouse=True)
+def restore_constants(monkeypatch):
+    yield
+    monkeypatch.undo()
+    importlib.reload(utils.constants)
@@ -0,0 +1,111 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.dialects import postgresql
+
+import utils.db as db
+from utils.db import batch_to_csv, create_postgres_connection, merge_sql, unique_index_sql, upsert_parquet_to_table
+from utils.intermediate_store import write_frame
+
+quote = postgresql.dialect().identifier_preparer.quote
+
+
+def test_batch_to_csv_keeps_nulls_and_empty_strings_apart():
+    batch = pa.RecordBatch.from_pydict({
+        'code': ['608', '', None],
+        'quantity': [1.5, None, 2.0],
+        'devolution_type': pa.array(['ROTO', 'ROTO', None]).dictionary_encode(),
+    })
+
+    assert batch_to_csv(batch).decode().splitlines() == [
+        '"608",1.5,"ROTO"',
+        '"",,"ROTO"',
+        ',2,',
+    ]
+
+
+def test_merge_sql_updates_rows_already_loaded():
+    sql = merge_sql('"bench_schema".pdf_devolutions', 'stage_pdf_devolutions',
+                    ['devolution_id', 'code', 'quantity'], ['devolution_id', 'code'], quote)
+
+    assert sql == (
+        'INSERT INTO "bench_schema".pdf_devolutions AS loaded (devolution_id, code, quantity) '
+        'SELECT DISTINCT ON (devolution_id, code) devolution_id, code, quantity FROM stage_pdf_devolutions '
+        'ORDER BY devolution_id, code, ctid DESC '
+        'ON CONFLICT (devolution_id, code) DO UPDATE SET quantity = EXCLUDED.quantity '
+        'WHERE (loaded.quantity) IS DISTINCT FROM (EXCLUDED.quantity)'
+    )
+    assert merge_sql('t', 's', ['note_number'], ['note_number'], quote).endswith('ON CONFLICT (note_number) DO NOTHING')
+    assert merge_sql('t', 's', ['note_number', 'extracted_date'], ['note_number'], quote).endswith('DO NOTHING')
+
+
+def test_unique_index_sql():
+    assert unique_index_sql('s.devolutions', 'devolutions_merge_key', ['note_number'], quote) == \
+        'CREATE UNIQUE INDEX IF NOT EXISTS devolutions_merge_key ON s.devolutions (note_number)'
+    assert unique_index_sql('s.t', 'i', ['a', 'b'], quote, nulls_not_distinct=True) == \
+        'CREATE UNIQUE INDEX IF NOT EXISTS i ON s.t (a, b) NULLS NOT DISTINCT'
+
+
+@pytest.mark.skipif(not os.getenv('TEST_DATABASE_URL'), reason='needs a PostgreSQL at TEST_DATABASE_URL')
+def test_upsert_inserts_new_rows_and_updates_loaded_ones(pg_engine, tmp_path):
+    path = str(tmp_path / 'tables.feather')
+    write_frame(pd.DataFrame({'devolution_id': [1, 1, 2], 'code': ['608', '609', '608'],
+                              'quantity': [1.0, 2.0, 3.0], 'extracted_date': ['2024-08-25'] * 3}), path)
+    assert upsert_parquet_to_table(pg_engine, path, 'pdf_devolutions', 'test_upsert', ['devolution_id', 'code']) == 3
+
+    # A retry extracting the same rows again on another day rewrites none of them
+    write_frame(pd.DataFrame({'devolution_id': [1, 1, 2], 'code': ['608', '609', '608'],
+                              'quantity': [1.0, 2.0, 3.0], 'extracted_date': ['2024-08-26'] * 3}), path)
+    assert upsert_parquet_to_table(pg_engine, path, 'pdf_devolutions', 'test_upsert', ['devolution_id', 'code']) == 0
+
+    # A re-parsed note with a corrected quantity and a new line, plus a duplicate key in the file
+    write_frame(pd.DataFrame({'devolution_id': [1, 3, 3], 'code': ['609', '608', '608'],
+                              'quantity': [5.0, 6.0, 7.0], 'extracted_date': ['2024-08-27'] * 3}), path)
+    assert upsert_parquet_to_table(pg_engine, path, 'pdf_devolutions', 'test_upsert', ['devolution_id', 'code']) == 2
+
+    with pg_engine.connect() as connection:
+        rows = connection.execute(text('SELECT devolution_id, code, quantity FROM test_upsert.pdf_devolutions '
+                                       'ORDER BY devolution_id, code')).fetchall()
+    assert [tuple(row) for row in rows] == [(1, '608', 1.0), (1, '609', 5.0), (2, '608', 3.0), (3, '608', 7.0)]
+
+
+def test_create_postgres_connection_pool_and_connect_args(monkeypatch):
+    created = {}
+    monkeypatch.setattr(db, 'create_engine', lambda url, **kwargs: created.update(kwargs, url=url) or 'engine')
+    for name, value in {'DB_HOST': 'db', 'DB_PORT': '5432', 'DB_USER': 'etl', 'DB_PASSWORD': 'secret',
+                        'DB_NAME': 'returns'}.items():
+        monkeypatch.setattr(db, name, value)
+    monkeypatch.setattr(db, 'DB_POOL_RECYCLE', 600)
+    monkeypatch.setattr(db, 'DB_CONNECT_TIMEOUT', 7)
+
+    assert create_postgres_connection(pool_size=3, max_overflow=2, statement_timeout_ms=30000) == 'engine'
+
+    assert created['pool_size'] == 3
+    assert created['max_overflow'] == 2
+    assert created['pool_pre_ping'] is True
+    assert created['pool_recycle'] == 600
+    assert created['connect_args'] == {
+        'connect_timeout': 7, 'keepalives': 1, 'keepalives_idle': 30, 'keepalives_interval': 10,
+        'keepalives_count': 5, 'options': '-c statement_timeout=30000',
+    }
+
+    create_postgres_connection(statement_timeout_ms=0)
+    assert 'options' not in created['connect_args']
+
+
+''' FIXTURES '''
+
+
+@pytest.fixture
+def pg_engine():
+    engine = create_engine(os.environ['TEST_DATABASE_URL'])
+    with engine.begin() as connection:
+        connection.execute(text('DROP SCHEMA IF EXISTS test_upsert CASCADE'))
+        connection.execute(text('CREATE SCHEMA test_upsert'))
+    yield engine
+    with engine.begin() as connection:
+        connection.execute(text('DROP SCHEMA test_upsert CASCADE'))
+    engine.dispose()
@@ -0,0 +1,17 @@
+import pytest
+
+from utils.deferred import deferred_callable
+
+
+def test_deferred_callable_imports_when_called():
+    dumps = deferred_callable('json:dumps')
+
+    assert dumps.__name__ == 'dumps'
+    assert dumps({'rows': 1}, sort_keys=True) == '{"rows": 1}'
+
+
+def test_deferred_callable_does_not_import_when_created():
+    missing = deferred_callable('functions.missing_module:run')
+
+    with pytest.raises(ModuleNotFoundError):
+        missing(ti=None)
@@ -0,0 +1,25 @@
+import pandas as pd
+
+from utils.dtypes import compact_dtypes, memory_usage
+
+
+def test_compact_dtypes_round_trips_through_parquet(tmp_path):
+    df = pd.DataFrame({
+        'product_family': ['REFRIGERADO', 'SECO', 'REFRIGERADO', None] * 250,
+        'description': [f'Product {index}' for index in range(1000)],
+        'month': [8] * 1000,
+        'pvp': [1234.56] * 1000,
+    })
+
+    compact_df = compact_dtypes(df, 'test')
+
+    assert isinstance(compact_df['product_family'].dtype, pd.CategoricalDtype)
+    assert compact_df['description'].dtype == 'string[pyarrow]'
+    assert compact_df['month'].dtype == 'int8'
+    assert compact_df['pvp'].dtype == 'float64'
+    assert memory_usage(compact_df) < memory_usage(df) / 2
+
+    compact_df.to_parquet(tmp_path / 'compact.parquet')
+    read_df = pd.read_parquet(tmp_path / 'compact.parquet')
+    assert isinstance(read_df['product_family'].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(read_df, compact_df, check_dtype=False)
@@ -0,0 +1,305 @@
+import io
+import random
+import time
+
+from datetime import datetime, timedelta
+
+import gspread
+import httplib2
+import pandas as pd
+import pytest
+import requests
+from googleapiclient.errors import HttpError
+
+import utils.google_drive as google_drive
+from benchmarks.sample_pdfs import make_delivery_note_pdf
+from utils.google_drive import download_pdfs_from_drive, get_google_sheet_rows_since, make_df_from_pdfs, \
+    partition_by_dates, read_matching_rows, rows_from_grid, stream_df_from_pdfs
+from utils.intermediate_store import read_frame
+from utils.metrics import metrics
+
+
+def test_partition_by_dates(mock_worksheet_rows):
+    frames_by_date, rows_per_date = partition_by_dates(mock_worksheet_rows, ['26/06/2024', '27/06/2024', '28/06/2024'])
+
+    assert rows_per_date == {'26/06/2024': 2, '27/06/2024': 1, '28/06/2024': 0}
+    assert list(frames_by_date['26/06/2024']['note_number']) == [101407, 101409]
+    assert list(frames_by_date['27/06/2024']['note_number']) == [101408]
+
+    # Empty dates keep the renamed columns so the PDF columns can still be selected
+    empty_df = frames_by_date['28/06/2024']
+    assert empty_df.empty
+    assert 'pdf_url' in empty_df.columns
+    assert 'note_number' in empty_df.columns
+
+
+def test_download_pdfs_from_drive_keeps_order(monkeypatch):
+    def fake_download(file_id, timeout):
+        # Later files finish first
+        time.sleep(0.01 * (5 - int(file_id)))
+        return file_id
+
+    monkeypatch.setattr(google_drive, 'download_pdf_from_drive', fake_download)
+
+    assert download_pdfs_from_drive(['1', '2', '3', '4'], max_workers=4) == ['1', '2', '3', '4']
+
+
+def test_download_pdfs_from_drive_retries_transient_errors(monkeypatch):
+    attempts = []
+
+    def fake_download(file_id, timeout):
+        attempts.append(file_id)
+        if len(attempts) < 3:
+            raise HttpError(httplib2.Response({'status': 429}), b'Rate limit exceeded')
+        return file_id
+
+    monkeypatch.setattr(google_drive, 'download_pdf_from_drive', fake_download)
+    monkeypatch.setattr(google_drive.time, 'sleep', lambda seconds: None)
+
+    assert download_pdfs_from_drive(['1'], max_retries=3) == ['1']
+    assert len(attempts) == 3
+
+
+def test_download_pdfs_from_drive_does_not_retry_client_errors(monkeypatch):
+    attempts = []
+
+    def fake_download(file_id, timeout):
+        attempts.append(file_id)
+        raise HttpError(httplib2.Response({'status': 404}), b'File not found')
+
+    monkeypatch.setattr(google_drive, 'download_pdf_from_drive', fake_download)
+
+    with pytest.raises(HttpError):
+        download_pdfs_from_drive(['1'], max_retries=3)
+    assert len(attempts) == 1
+
+
+def test_download_pdfs_from_drive_retries_dropped_connections(monkeypatch):
+    errors = [requests.ConnectionError('Connection reset'), requests.HTTPError(response=mock_response(503))]
+
+    def fake_download(file_id, timeout):
+        if errors:
+            raise errors.pop(0)
+        return file_id
+
+    monkeypatch.setattr(google_drive, 'download_pdf_from_drive', fake_download)
+    monkeypatch.setattr(google_drive.time, 'sleep', lambda seconds: None)
+
+    assert download_pdfs_from_drive(['1'], max_retries=3) == ['1']
+    assert not google_drive.is_retryable_error(requests.HTTPError(response=mock_response(403)))
+
+
+def test_credentials_are_loaded_once_and_refreshed_before_expiry(monkeypatch):
+    credentials = MockCredentials()
+    loads = []
+    monkeypatch.setattr(google_drive, '_credentials', None)
+    monkeypatch.setattr(google_drive.Credentials, 'from_service_account_file',
+                        lambda path, scopes: loads.append(path) or credentials)
+
+    for _ in range(3):
+        assert google_drive.get_credentials() is credentials
+    assert len(loads) == 1 and credentials.refreshes == 1
+
+    # Within the refresh margin the token is replaced before it is used again
+    credentials.expiry = datetime.utcnow() + timedelta(minutes=2)
+    google_drive.get_credentials()
+    assert credentials.refreshes == 2
+
+
+def test_read_matching_rows(mock_worksheet):
+    mock_worksheet.grid += [
+        ['26/06/2024 18:20:05', '26/06/2024', '101409', 'https://drive.google.com/open?id=3'],
+        ['26/06/2024 19:00:00', '26/06/2024', '101410', ''],
+        ['28/06/2024 09:00:00', '28/06/2024', '101411', 'https://drive.google.com/open?id=4'],
+    ]
+
+    df = read_matching_rows(mock_worksheet, ['26/06/2024'], max_ranges=1)
+
+    assert mock_worksheet.ranges_read == [['A2:D2'], ['A4:D5']]
+    assert df['NOTA'].tolist() == [101407, 101409, 101410]
+    assert df['PDF NOTA'].tolist()[-1] == ''
+    expected = pd.DataFrame(mock_worksheet.get_all_records())
+    pd.testing.assert_frame_equal(df, expected[expected['FECHA NOTA'] == '26/06/2024'].reset_index(drop=True))
+
+
+def test_rows_from_grid_matches_get_all_records(mock_worksheet):
+    mock_worksheet.grid.append(['28/06/2024 09:00:00', '26/06/2024', '101411'])
+
+    df = rows_from_grid(mock_worksheet.grid, ['26/06/2024', '01/01/2025'])
+
+    records = pd.DataFrame(mock_worksheet.get_all_records())
+    expected = records[records['FECHA NOTA'] == '26/06/2024'].reset_index(drop=True)
+    pd.testing.assert_frame_equal(df, expected)
+    assert rows_from_grid(mock_worksheet.grid, ['26/06/2024'], 'MISSING').empty
+
+
+def test_get_google_sheet_rows_since(monkeypatch, mock_worksheet):
+    monkeypatch.setattr(google_drive, '__open_worksheet', lambda sheet_name, worksheet_name: mock_worksheet)
+
+    df, watermark = get_google_sheet_rows_since('sheet', 'worksheet', {'row': 1, 'timestamp': None})
+    assert list(df['note_number']) == [101407, 101408]
+    assert watermark == {'row': 3, 'timestamp': '27/06/2024 10:01:12'}
+
+    mock_worksheet.grid.append(['28/06/2024 09:00:00', '28/06/2024', '101409', ''])
+    df, watermark = get_google_sheet_rows_since('sheet', 'worksheet', watermark)
+    assert list(df['note_number']) == [101409]
+    assert list(df['pdf_url']) == ['']
+    assert watermark == {'row': 4, 'timestamp': '28/06/2024 09:00:00'}
+    assert mock_worksheet.ranges_read == ['A1:D', 'A3:D']
+
+
+def test_open_worksheet_waits_for_the_rate_limiter(monkeypatch, mock_worksheet):
+    calls = []
+
+    class Limiter:
+        def acquire(self):
+            calls.append('acquire')
+
+    class Spreadsheet:
+        def worksheet(self, name):
+            calls.append('worksheet')
+            return mock_worksheet
+
+    class Client:
+        def open(self, name):
+            calls.append('open')
+            return Spreadsheet()
+
+    monkeypatch.setattr(google_drive, 'get_sheets_rate_limiter', Limiter)
+    monkeypatch.setattr(google_drive, 'get_sheets_client', Client)
+
+    assert getattr(google_drive, '__open_worksheet')('sheet', 'worksheet') is mock_worksheet
+    assert calls == ['acquire', 'open', 'acquire', 'worksheet']
+
+
+def test_get_google_sheet_rows_since_rejects_edited_sheet(monkeypatch, mock_worksheet):
+    monkeypatch.setattr(google_drive, '__open_worksheet', lambda sheet_name, worksheet_name: mock_worksheet)
+
+    with pytest.raises(ValueError):
+        get_google_sheet_rows_since('sheet', 'worksheet', {'row': 2, 'timestamp': '01/01/2024 00:00:00'})
+
+
+@pytest.mark.parametrize('output_name', ['df_tables.feather', 'df_tables.parquet'])
+def test_stream_df_from_pdfs_matches_make_df_from_pdfs(monkeypatch, tmp_path, output_name):
+    pdfs = {f'id{index}': make_delivery_note_pdf(101400 + index, items=3 + index, seed=index) for index in range(6)}
+    pdfs['empty'] = make_delivery_note_pdf(101499, items=0, trailer_page=False)
+    data = pd.DataFrame({
+        'pdf_url': [f'https://drive.google.com/open?id={file_id}' for file_id in pdfs],
+        'note_number': [101400 + index for index in range(len(pdfs))],
+    })
+
+    def fake_download(file_id, cache=None, timeout=None, max_retries=None):
+        # Finish out of order, the output must still follow the sheet rows
+        time.sleep(random.uniform(0, 0.02))
+        return io.BytesIO(pdfs[file_id])
+
+    monkeypatch.setattr(google_drive, 'download_pdf_cached', fake_download)
+    monkeypatch.setattr(google_drive, 'get_pdf_cache', lambda: None)
+    monkeypatch.setattr(google_drive, 'get_table_cache', lambda: None)
+    metrics.reset()
+
+    rows = stream_df_from_pdfs(data, str(tmp_path / output_name), max_workers=4, queue_size=2)
+
+    assert len(metrics.latencies['pdf_parse_seconds']) == len(pdfs)
+    expected = make_df_from_pdfs(data, max_workers=1)
+    result = read_frame(str(tmp_path / output_name))
+    assert rows == len(expected)
+    pd.testing.assert_frame_equal(result[expected.columns], expected, check_dtype=False)
+
+
+def test_stream_df_from_pdfs_raises_download_errors(monkeypatch, tmp_path):
+    def fake_download(file_id, cache=None, timeout=None, max_retries=None):
+        raise ValueError(f'cannot download {file_id}')
+
+    monkeypatch.setattr(google_drive, 'download_pdf_cached', fake_download)
+    monkeypatch.setattr(google_drive, 'get_pdf_cache', lambda: None)
+    monkeypatch.setattr(google_drive, 'get_table_cache', lambda: None)
+    data = pd.DataFrame({'pdf_url': ['https://drive.google.com/open?id=abc'] * 3, 'note_number': [1, 2, 3]})
+
+    with pytest.raises(ValueError, match='cannot download abc'):
+        stream_df_from_pdfs(data, str(tmp_path / 'df_tables.feather'), queue_size=1)
+
+
+''' FIXTURES '''
+
+
+@pytest.fixture
+def mock_worksheet_rows():
+    return pd.DataFrame({
+        'Marca temporal': ['26/06/2024 13:53:43', '27/06/2024 10:01:12', '26/06/2024 18:20:05'],
+        'FECHA NOTA': ['26/06/2024', '27/06/2024', '26/06/2024'],
+        'NOTA': [101407, 101408, 101409],
+        'PDF NOTA': ['https://drive.google.com/open?id=1', 'https://drive.google.com/open?id=2',
+                     'https://drive.google.com/open?id=3'],
+    })
+
+
+def mock_response(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return response
+
+
+class MockCredentials:
+    def __init__(self):
+        self.token = None
+        self.expiry = None
+        self.refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = f'token-{self.refreshes}'
+        self.expiry = datetime.utcnow() + timedelta(hours=1)
+
+
+class MockWorksheet:
+    def __init__(self, grid):
+        self.grid = grid
+        self.ranges_read = []
+
+    def row_values(self, row):
+        return self.grid[row - 1]
+
+    def get(self, range_name):
+        self.ranges_read.append(range_name)
+        start = int(range_name.split(':')[0][1:])
+        rows = []
+        for row in self.grid[start - 1:]:
+            row = list(row)
+            # The API drops trailing empty cells
+            while row and row[-1] == '':
+                row.pop()
+            rows.append(row)
+        return rows
+
+    def col_values(self, col):
+        return [row[col - 1] for row in self.grid]
+
+    def batch_get(self, ranges):
+        self.ranges_read.append(ranges)
+        value_ranges = []
+        for range_name in ranges:
+            first, last = (int(cell.lstrip('ABCD')) for cell in range_name.split(':'))
+            value_ranges.append([self.__trim(row) for row in self.grid[first - 1:last]])
+        return value_ranges
+
+    def get_all_records(self):
+        header = self.grid[0]
+        return [dict(zip(header, gspread.utils.numericise_all(list(row) + [''] * (len(header) - len(row)))))
+                for row in self.grid[1:]]
+
+    @staticmethod
+    def __trim(row):
+        row = list(row)
+        while row and row[-1] == '':
+            row.pop()
+        return row
+
+
+@pytest.fixture
+def mock_worksheet():
+    return MockWorksheet([
+        ['Marca temporal', 'FECHA NOTA', 'NOTA', 'PDF NOTA'],
+        ['26/06/2024 13:53:43', '26/06/2024', '101407', 'https://drive.google.com/open?id=1'],
+        ['27/06/2024 10:01:12', '27/06/2024', '101408', 'https://drive.google.com/open?id=2'],
+    ])
@@ -0,0 +1,45 @@
+import os
+
+import pandas as pd
+import pytest
+
+import utils.intermediate_store as intermediate_store
+from utils.intermediate_store import clean_run, iter_batches, read_frame, read_manifest, write_stage
+
+
+@pytest.mark.parametrize('file_format', ['feather', 'parquet'])
+def test_write_stage_round_trip_and_manifest(store_dir, file_format):
+    df = pd.DataFrame({'note_number': [101407, 101408, 101409], 'user': ['CANDELA', 'MARIO', None]})
+    df_tables = pd.DataFrame({'code': pd.Series([], dtype=object)})
+
+    df_path, df_tables_path = write_stage('extract', {'df_devolutions': df, 'df_tables': df_tables},
+                                          run_id='manual__2024-06-26T13:53:43+00:00', file_format=file_format)
+
+    assert df_path.endswith(f'.{file_format}')
+    pd.testing.assert_frame_equal(read_frame(df_path), df)
+    assert [batch.num_rows for batch in iter_batches(df_path, 2)] == [2, 1]
+
+    manifest = read_manifest(os.path.dirname(df_path), 'extract')
+    assert manifest['files']['df_devolutions']['rows'] == 3
+    assert manifest['files']['df_tables']['rows'] == 0
+    assert manifest['files']['df_devolutions']['schema_hash'] != manifest['files']['df_tables']['schema_hash']
+
+
+def test_clean_run_only_removes_its_own_files(store_dir):
+    df = pd.DataFrame({'note_number': [101407]})
+    first_path, = write_stage('extract', {'df_devolutions': df}, run_id='first')
+    second_path, = write_stage('extract', {'df_devolutions': df}, run_id='second')
+
+    clean_run('first')
+
+    assert not os.path.exists(first_path)
+    assert os.path.exists(second_path)
+
+
+''' FIXTURES '''
+
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(intermediate_store, 'TEMP_DIR', str(tmp_path))
+    return tmp_path
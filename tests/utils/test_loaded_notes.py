@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from utils.loaded_notes import LoadedNotesIndex
+
+
+def test_refresh_picks_up_notes_loaded_in_any_order(index, engine):
+    assert index.refresh(engine, schema=None) == 2
+    assert index.loaded([101407, 101408, 101409]) == {101407, 101408}
+
+    # Loaded after the newer note, with an older extracted_date
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO pdf_devolutions VALUES (101409, '2024-08-20 04:00:00')"))
+
+    # A recent refresh is reused, an expired one reads the table again
+    assert index.refresh(engine, schema=None) == 2
+    assert index.refresh(engine, schema=None, max_age=0) == 3
+    assert index.loaded(['101409', 101410]) == {101409}
+
+
+''' FIXTURES '''
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}")
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE pdf_devolutions (devolution_id INTEGER, extracted_date TEXT)'))
+        connection.execute(text("INSERT INTO pdf_devolutions VALUES "
+                                "(101407, '2024-08-25 04:00:00'), (101407, '2024-08-25 04:00:00'), "
+                                "(101408, '2024-08-26 04:00:00')"))
+    return engine
+
+
+@pytest.fixture
+def index(tmp_path):
+    return LoadedNotesIndex(str(tmp_path / 'cache' / 'loaded_notes.sqlite'))
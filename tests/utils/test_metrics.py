@@ -0,0 +1,78 @@
+import socket
+
+import pytest
+
+import utils.metrics as metrics_module
+from utils.metrics import instrumented, merge_summaries, metrics, prometheus_lines, send_statsd
+
+
+def test_instrumented_task_reports_and_resets(tmp_path, monkeypatch, task_instance):
+    monkeypatch.setattr(metrics_module, 'METRICS_DIR', str(tmp_path))
+
+    @instrumented('extract')
+    def extract_data(**context):
+        metrics.incr('pdf_bytes_fetched', 2048)
+        for seconds in (0.1, 0.2, 0.4):
+            metrics.observe('pdf_download_seconds', seconds)
+        return 'done'
+
+    assert extract_data(ti=task_instance) == 'done'
+
+    summary = task_instance.pushed['metrics']
+    assert summary['task'] == 'extract_data' and summary['map_index'] == 3
+    assert 'extract' in summary['stages']
+    assert summary['counters'] == {'pdf_bytes_fetched': 2048}
+    latency = summary['latencies']['pdf_download_seconds']
+    assert latency == {'count': 3, 'total': 0.7, 'p50': 0.2, 'p95': 0.2, 'max': 0.4}
+    assert metrics.summary()['counters'] == {}
+
+    textfile = (tmp_path / 'etl_extract_data_3.prom').read_text().splitlines()
+    assert textfile == prometheus_lines(summary)
+    assert 'etl_counter{task="extract_data",map_index="3",name="pdf_bytes_fetched"} 2048' in textfile
+
+
+def test_send_statsd():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server:
+        server.bind(('127.0.0.1', 0))
+        server.settimeout(5)
+        summary = {'task': 'load_data', 'stages': {'load': 1.5}, 'counters': {'load_rows': 300},
+                   'gauges': {'load_rows_per_second': 200.0}, 'latencies': {}}
+
+        send_statsd(summary, '127.0.0.1', server.getsockname()[1])
+
+        received = [server.recv(1024).decode() for _ in range(3)]
+    assert received == ['etl.load_data.stage.load:1500|ms', 'etl.load_data.load_rows:300|c',
+                        'etl.load_data.load_rows_per_second:200.0|g']
+
+
+def test_merge_summaries_finds_slowest_stage():
+    run = merge_summaries([
+        {'task': 'extract_data', 'stages': {'extract': 10.0, 'pdf_download': 8.0}, 'counters': {'extract_rows': 5}},
+        {'task': 'extract_data', 'stages': {'extract': 4.0, 'pdf_download': 3.5}, 'counters': {'extract_rows': 2}},
+        {'task': 'load_data', 'stages': {'load': 2.0}, 'counters': {}},
+    ])
+
+    assert run['stages'] == {'extract': 14.0, 'pdf_download': 11.5, 'load': 2.0}
+    assert run['counters'] == {'extract_rows': 7}
+    assert run['slowest_stage'] == 'extract'
+
+
+''' FIXTURES '''
+
+
+class MockTaskInstance:
+    task_id = 'extract_data'
+    map_index = 3
+
+    def __init__(self):
+        self.pushed = {}
+
+    def xcom_push(self, key, value):
+        self.pushed[key] = value
+
+
+@pytest.fixture
+def task_instance():
+    # Other tests record into the process wide metrics too
+    metrics.reset()
+    return MockTaskInstance()
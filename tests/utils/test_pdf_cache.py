@@ -0,0 +1,52 @@
+import hashlib
+import os
+import time
+
+from utils.pdf_cache import PdfCache
+
+
+def test_pdf_cache_hits_and_misses(tmp_path):
+    cache = PdfCache(str(tmp_path), max_bytes=1024)
+    content = b'%PDF-1.4 note 101407'
+
+    assert cache.get('file-1') is None
+    cache.put('file-1', content, {'md5Checksum': hashlib.md5(content).hexdigest(), 'headRevisionId': 'rev-1'})
+
+    assert cache.get('file-1') == content
+    assert cache.report() == {'hits': 1, 'misses': 1, 'bytes_saved': len(content)}
+
+
+def test_pdf_cache_skips_corrupted_downloads(tmp_path):
+    cache = PdfCache(str(tmp_path), max_bytes=1024)
+
+    cache.put('file-1', b'truncated', {'md5Checksum': hashlib.md5(b'complete').hexdigest()})
+
+    assert cache.get('file-1') is None
+
+
+def test_pdf_cache_evicts_least_recently_used(tmp_path):
+    cache = PdfCache(str(tmp_path), max_bytes=250)
+
+    for index in range(3):
+        cache.put(f'file-{index}', bytes([index]) * 100)
+        # Spread the modification times so the LRU order is deterministic
+        blob = os.path.join(tmp_path, 'blobs', f'{hashlib.sha256(bytes([index]) * 100).hexdigest()}.pdf')
+        os.utime(blob, (time.time() - 100 + index, time.time() - 100 + index))
+
+    assert cache.get('file-0') is None
+    assert cache.get('file-1') is not None
+    assert cache.get('file-2') is not None
+
+
+def test_pdf_cache_lists_blobs_only_when_over_the_limit(tmp_path, monkeypatch):
+    cache = PdfCache(str(tmp_path), max_bytes=1000)
+    scandir = os.scandir
+    listings = []
+    monkeypatch.setattr(os, 'scandir', lambda path: listings.append(path) or scandir(path))
+
+    for index in range(12):
+        cache.put(f'file-{index}', bytes([index]) * 100)
+
+    # Once to learn the size, once when the 11th blob crosses the limit
+    assert len(listings) == 2
+    assert cache.total_bytes == len(os.listdir(tmp_path / 'blobs')) * 100 <= 1000
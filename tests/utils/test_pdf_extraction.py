@@ -0,0 +1,80 @@
+import io
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from benchmarks.sample_pdfs import make_delivery_note_pdf
+import utils.pdf_extraction as pdf_extraction
+from utils.pdf_extraction import extract_raw_tables, extract_tables_from_pdfs, register_backend
+
+
+def test_extract_tables_from_pdfs_in_processes(sample_pdfs):
+    serial = extract_tables_from_pdfs([io.BytesIO(pdf) for pdf in sample_pdfs], processes=1)
+    parallel = extract_tables_from_pdfs([io.BytesIO(pdf) for pdf in sample_pdfs], processes=2)
+
+    assert parallel == serial
+    assert serial[0][0][0] == ['Código', 'Descripción', 'PVP', 'Cantidad', 'Total', 'Causa de\ndevolucion']
+    assert len(serial[0][0]) == 1 + 5
+
+
+def test_extract_tables_from_pdfs_time_limit(sample_pdfs):
+    results = extract_tables_from_pdfs([io.BytesIO(pdf) for pdf in sample_pdfs], processes=2, time_limit=0.001)
+
+    assert results == [None, None, None]
+
+
+def test_extract_tables_from_pdfs_time_limit_in_process(sample_pdfs, monkeypatch):
+    monkeypatch.setattr(pdf_extraction, 'extract_raw_tables', lambda pdf_file: time.sleep(5))
+    handler = signal.getsignal(signal.SIGALRM)
+    start = time.monotonic()
+
+    assert extract_tables_from_pdfs([io.BytesIO(sample_pdfs[0])], processes=1, time_limit=0.2) == [None]
+    assert time.monotonic() - start < 2
+    assert signal.getsignal(signal.SIGALRM) is handler
+
+
+def test_extract_tables_from_pdfs_time_limit_outside_main_thread(sample_pdfs):
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        results = executor.submit(extract_tables_from_pdfs, [io.BytesIO(sample_pdfs[0])], processes=1,
+                                  time_limit=0.001).result()
+
+    assert results == [None]
+
+
+@pytest.mark.parametrize('backend', ['template', 'text_layout'])
+def test_layout_backends_match_generic_detection(backend):
+    pdfs = [make_delivery_note_pdf(note_number, items=70, rows_per_page=30, seed=note_number)
+            for note_number in (101407, 101408)]
+
+    for pdf in pdfs:
+        generic = extract_raw_tables(io.BytesIO(pdf), backend='pdfplumber')
+        tables = extract_raw_tables(io.BytesIO(pdf), backend=backend)
+        assert len(tables) == 3
+        assert tables == generic
+
+
+@pytest.mark.parametrize('backend', ['template', 'text_layout'])
+def test_layout_backends_fall_back_without_header(sample_pdfs, monkeypatch, backend):
+    monkeypatch.setattr(pdf_extraction, 'TEMPLATE_HEADER_WORDS', ('Artículo', 'Importe'))
+
+    generic = extract_raw_tables(io.BytesIO(sample_pdfs[0]), backend='pdfplumber')
+    assert extract_raw_tables(io.BytesIO(sample_pdfs[0]), backend=backend) == generic
+
+
+def test_register_backend(sample_pdfs, monkeypatch):
+    monkeypatch.setattr(pdf_extraction, 'PDF_BACKENDS', dict(pdf_extraction.PDF_BACKENDS))
+    register_backend('fake', lambda pdf_file: [[['Código'], ['608']]])
+
+    assert extract_raw_tables(io.BytesIO(sample_pdfs[0]), backend='fake') == [[['Código'], ['608']]]
+    with pytest.raises(ValueError, match='Unknown PDF extraction backend'):
+        extract_raw_tables(io.BytesIO(sample_pdfs[0]), backend='missing')
+
+
+''' FIXTURES '''
+
+
+@pytest.fixture
+def sample_pdfs():
+    return [make_delivery_note_pdf(note_number, items=5) for note_number in (101407, 101408, 101409)]
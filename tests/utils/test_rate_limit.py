@@ -0,0 +1,33 @@
+import pytest
+
+from utils.rate_limit import TokenBucket
+
+
+def test_token_bucket_allows_bursts_then_throttles(fake_clock):
+    bucket = TokenBucket(rate=2, period=60, clock=fake_clock.now, sleep=fake_clock.sleep)
+
+    assert [bucket.acquire() for _ in range(4)] == [0, 0, 30, 30]
+    assert fake_clock.time == 60
+
+    # Idle time refills the bucket, up to its capacity
+    fake_clock.sleep(600)
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, 30]
+
+
+''' FIXTURES '''
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def now(self):
+        return self.time
+
+    def sleep(self, seconds):
+        self.time += seconds
+
+
+@pytest.fixture
+def fake_clock():
+    return FakeClock()
@@ -0,0 +1,46 @@
+import io
+
+import pandas as pd
+
+import utils.google_drive as google_drive
+from benchmarks.sample_pdfs import make_delivery_note_pdf
+from utils.google_drive import parse_pdfs
+from utils.pdf_extraction import PDF_COLUMN_MAPPING
+from utils.table_cache import TableCache
+
+
+def test_table_cache_round_trip(tmp_path):
+    cache = TableCache(str(tmp_path))
+    tables = [
+        pd.DataFrame({'code': ['608'], 'quantity': ['1,5']}),
+        pd.DataFrame({'code': ['123456'], 'quantity': ['2']}),
+    ]
+
+    assert cache.get('abc') is None
+    cache.put('abc', tables)
+
+    assert cache.get('abc').to_dict('list') == {'code': ['608', '123456'], 'quantity': ['1,5', '2']}
+
+
+def test_table_cache_is_invalidated_by_extractor_changes(tmp_path):
+    TableCache(str(tmp_path), extractor_version='1').put('abc', [pd.DataFrame({'code': ['608']})])
+
+    assert TableCache(str(tmp_path), extractor_version='2').get('abc') is None
+    changed_mapping = {**PDF_COLUMN_MAPPING, 'Código': 'product_code'}
+    assert TableCache(str(tmp_path), extractor_version='1', column_mapping=changed_mapping).get('abc') is None
+
+
+def test_parse_pdfs_reuses_cached_tables(tmp_path, monkeypatch):
+    cache = TableCache(str(tmp_path))
+    pdf = make_delivery_note_pdf(101407, items=3)
+
+    first = parse_pdfs([io.BytesIO(pdf)], table_cache=cache)
+
+    def fail_extraction(pdf_files, processes):
+        assert pdf_files == []
+        return []
+
+    monkeypatch.setattr(google_drive, 'extract_tables_from_pdfs', fail_extraction)
+    second = parse_pdfs([io.BytesIO(pdf)], table_cache=cache)
+
+    pd.testing.assert_frame_equal(pd.concat(first[0], ignore_index=True), second[0][0])
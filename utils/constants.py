@@ -5,6 +5,12 @@ DIR_PATH: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 dotenv_path: str = os.path.join(DIR_PATH, '.env')
 load_dotenv(dotenv_path)
 
+
+def __getenv(name: str, default: str = None):
+    """Returns a variable, or its default when it is unset or left blank as in .env.example"""
+    return os.getenv(name) or default
+
+
 DB_HOST = os.getenv('DB_HOST')
 DB_PORT = os.getenv('DB_PORT')
 DB_USER = os.getenv('DB_USER')
@@ -15,5 +21,45 @@ WORKSHEET_NAME = os.getenv("WORKSHEET_NAME")
 PDF_COLUMN = 'pdf_url'
 NOTE_COLUMN = 'note_number'
 CREDENTIALS_FILE = os.getenv("CREDENTIALS_FILE")
-TEMP_DIR = '/tmp/airflow_data'
+TEMP_DIR = __getenv("TEMP_DIR", "/tmp/airflow_data")
 DEFAULT_DATES = os.getenv("DEFAULT_DATES")
+DRIVE_MAX_WORKERS = int(__getenv("DRIVE_MAX_WORKERS", "8"))
+DRIVE_TIMEOUT = float(__getenv("DRIVE_TIMEOUT", "60"))
+DRIVE_MAX_RETRIES = int(__getenv("DRIVE_MAX_RETRIES", "5"))
+PDF_PARSE_PROCESSES = int(__getenv("PDF_PARSE_PROCESSES", "1"))
+PDF_PARSE_TIME_LIMIT = float(__getenv("PDF_PARSE_TIME_LIMIT", "120"))
+CACHE_DIR = __getenv("CACHE_DIR", "/tmp/airflow_cache")
+PDF_CACHE_ENABLED = __getenv("PDF_CACHE_ENABLED", "true").lower() == "true"
+PDF_CACHE_DIR = os.path.join(CACHE_DIR, 'pdfs')
+PDF_CACHE_MAX_BYTES = int(__getenv("PDF_CACHE_MAX_BYTES", str(1024 ** 3)))
+TABLE_CACHE_ENABLED = __getenv("TABLE_CACHE_ENABLED", "true").lower() == "true"
+TABLE_CACHE_DIR = os.path.join(CACHE_DIR, 'tables')
+STATE_DIR = __getenv("STATE_DIR", "/tmp/airflow_state")
+INCREMENTAL_EXTRACT = __getenv("INCREMENTAL_EXTRACT", "false").lower() == "true"
+LOAD_METHOD = __getenv("LOAD_METHOD", "insert")
+COPY_CHUNK_ROWS = int(__getenv("COPY_CHUNK_ROWS", "50000"))
+DB_POOL_SIZE = int(__getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(__getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_RECYCLE = int(__getenv("DB_POOL_RECYCLE", "1800"))
+DB_CONNECT_TIMEOUT = int(__getenv("DB_CONNECT_TIMEOUT", "10"))
+DB_STATEMENT_TIMEOUT_MS = int(__getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+STREAMING_TRANSFORM = __getenv("STREAMING_TRANSFORM", "false").lower() == "true"
+TRANSFORM_BATCH_ROWS = int(__getenv("TRANSFORM_BATCH_ROWS", "50000"))
+COMPACT_DTYPES = __getenv("COMPACT_DTYPES", "false").lower() == "true"
+INTERMEDIATE_FORMAT = __getenv("INTERMEDIATE_FORMAT", "feather")
+EXTRACT_SHARD_SIZE = int(__getenv("EXTRACT_SHARD_SIZE", "0"))
+PIPELINED_EXTRACT = __getenv("PIPELINED_EXTRACT", "false").lower() == "true"
+PIPELINE_QUEUE_SIZE = int(__getenv("PIPELINE_QUEUE_SIZE", "16"))
+PDF_EXTRACTION_BACKEND = __getenv("PDF_EXTRACTION_BACKEND", "pdfplumber")
+SHEET_READ_MODE = __getenv("SHEET_READ_MODE", "targeted")
+SHEETS_READS_PER_MINUTE = int(__getenv("SHEETS_READS_PER_MINUTE", "60"))
+BACKFILL_CHUNK_DAYS = int(__getenv("BACKFILL_CHUNK_DAYS", "7"))
+BACKFILL_WORKERS = int(__getenv("BACKFILL_WORKERS", "2"))
+BACKFILL_STATE_TTL_DAYS = float(__getenv("BACKFILL_STATE_TTL_DAYS", "7"))
+LOADED_NOTES_INDEX_ENABLED = __getenv("LOADED_NOTES_INDEX_ENABLED", "false").lower() == "true"
+LOADED_NOTES_INDEX_PATH = os.path.join(CACHE_DIR, 'loaded_notes.sqlite')
+FORCE_REPROCESS = __getenv("FORCE_REPROCESS", "false").lower() == "true"
+METRICS_DIR = __getenv("METRICS_DIR", "")
+STATSD_HOST = __getenv("STATSD_HOST", "")
+STATSD_PORT = int(__getenv("STATSD_PORT", "8125"))
+STATSD_PREFIX = __getenv("STATSD_PREFIX", "etl")
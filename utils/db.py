@@ -1,9 +1,15 @@
-import socket
+import io
+import threading
 import urllib.parse
-from sqlalchemy import create_engine
+
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
 
-from utils.constants import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+from utils.constants import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME, COPY_CHUNK_ROWS, DB_POOL_SIZE, \
+    DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_CONNECT_TIMEOUT, DB_STATEMENT_TIMEOUT_MS
+from utils.intermediate_store import iter_batches, read_schema
 
 dbname: str = DB_NAME
 user: str = DB_USER
@@ -11,11 +17,27 @@ password: str = urllib.parse.quote_plus(str(DB_PASSWORD))
 host: str = DB_HOST
 port: str = DB_PORT
 
+# Set by every transform run, a row differing only in these is not rewritten by a merge
+MERGE_IGNORED_COLUMNS = ('extracted_date',)
+
+_engine = None
+_engine_lock = threading.Lock()
+
 
-def create_postgres_connection() -> Engine | Exception:
+def create_postgres_connection(pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_MAX_OVERFLOW,
+                               statement_timeout_ms: int = DB_STATEMENT_TIMEOUT_MS) -> Engine | Exception:
     """
     Creates and returns a SQLAlchemy engine for connecting to PostgreSQL.
 
+    The engine keeps a pool of connections that are validated before use (pre-ping), recycled
+    after `DB_POOL_RECYCLE` seconds and kept alive with TCP keepalives. Prefer `get_engine`, which
+    shares a single engine across the process.
+
+    Args:
+        pool_size (int, optional): Number of connections kept open in the pool
+        max_overflow (int, optional): Extra connections allowed when the pool is exhausted
+        statement_timeout_ms (int, optional): Server side statement timeout, 0 disables it
+
     Returns:
         Engine: A SQLAlchemy Engine object connected to the PostgreSQL database.
     """
@@ -27,15 +49,251 @@ def create_postgres_connection() -> Engine | Exception:
         connection_string = \
             f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{dbname}"
 
-        # Test network connectivity
-        try:
-            socket.create_connection((DB_HOST, DB_PORT), timeout=5)
-            print(f"Network connection to {DB_HOST}:{DB_PORT} successful")
-        except socket.error as e:
-            print(f"Network connection failed: {e}")
+        connect_args = {
+            'connect_timeout': DB_CONNECT_TIMEOUT,
+            'keepalives': 1,
+            'keepalives_idle': 30,
+            'keepalives_interval': 10,
+            'keepalives_count': 5,
+        }
+        if statement_timeout_ms:
+            connect_args['options'] = f'-c statement_timeout={statement_timeout_ms}'
 
-        engine = create_engine(connection_string)
+        engine = create_engine(
+            connection_string,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_pre_ping=True,
+            pool_recycle=DB_POOL_RECYCLE,
+            connect_args=connect_args,
+        )
         return engine
     except Exception as e:
         print(f"Error creating PostgreSQL connection: {e}")
         raise e
+
+
+def get_engine() -> Engine:
+    """
+    Returns the engine shared by every load step of the current process, creating it and checking
+    the database is reachable on first use.
+
+    Returns:
+        Engine: The shared SQLAlchemy Engine
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            engine = create_postgres_connection()
+            check_connection(engine)
+            _engine = engine
+    return _engine
+
+
+def check_connection(engine: Engine) -> None:
+    """
+    Runs a trivial query to check the database is reachable and accepting logins.
+
+    Args:
+        engine (Engine): SQLAlchemy engine to check
+
+    Raises:
+        SQLAlchemyError: If the database cannot be reached
+    """
+    with engine.connect() as connection:
+        connection.execute(text('SELECT 1'))
+    print(f"Connection to {DB_HOST}:{DB_PORT} successful")
+
+
+def copy_parquet_to_table(engine: Engine, parquet_path: str, table_name: str, schema: str,
+                          chunk_rows: int = COPY_CHUNK_ROWS) -> int:
+    """
+    Bulk loads a parquet or Feather file into a table with `COPY ... FROM STDIN`.
+
+    The file is streamed in chunks of `chunk_rows` rows, so it is never fully loaded in memory,
+    and every chunk is sent inside a single transaction: either all rows are loaded or none.
+    The table is created from the file schema when it does not exist.
+
+    Args:
+        engine (Engine): SQLAlchemy engine of the target database
+        parquet_path (str): Path of the parquet or Feather file to load
+        table_name (str): Name of the target table
+        schema (str): Schema of the target table
+        chunk_rows (int, optional): Number of rows sent per COPY chunk
+
+    Returns:
+        int: Number of rows loaded
+    """
+    columns = __ensure_table(engine, read_schema(parquet_path), table_name, schema)
+    quote = engine.dialect.identifier_preparer.quote
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        rows = __copy_batches(cursor, parquet_path, columns, f"{quote(schema)}.{quote(table_name)}", quote, chunk_rows)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    return rows
+
+
+def upsert_parquet_to_table(engine: Engine, parquet_path: str, table_name: str, schema: str, keys: list,
+                            chunk_rows: int = COPY_CHUNK_ROWS) -> int:
+    """
+    Idempotently loads a parquet or Feather file into a table through a staging table.
+
+    The target gets a unique index on `keys`, created on first use. The rows are bulk copied into
+    a temporary staging table, private to this connection, and merged into the target with a
+    single `INSERT ... ON CONFLICT (keys) DO UPDATE`, all in one transaction. New rows are
+    inserted and rows already loaded are updated with the values of the file, so loading the same
+    file twice does not duplicate anything and concurrent loads of the same keys cannot both insert.
+
+    Args:
+        engine (Engine): SQLAlchemy engine of the target database
+        parquet_path (str): Path of the parquet or Feather file to load
+        table_name (str): Name of the target table
+        schema (str): Schema of the target table
+        keys (List[str]): Columns identifying a row
+        chunk_rows (int, optional): Number of rows sent per COPY chunk
+
+    Returns:
+        int: Number of rows inserted or updated in the target table
+    """
+    columns = __ensure_table(engine, read_schema(parquet_path), table_name, schema)
+    quote = engine.dialect.identifier_preparer.quote
+    target = f"{quote(schema)}.{quote(table_name)}"
+    staging = quote(f"stage_{table_name}")
+    # From PostgreSQL 15 on, rows with NULL keys also match each other
+    nulls_not_distinct = (engine.dialect.server_version_info or (0,)) >= (15,)
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(unique_index_sql(target, f"{table_name}_merge_key", keys, quote, nulls_not_distinct))
+        cursor.execute(f"CREATE TEMP TABLE {staging} (LIKE {target})")
+        staged = __copy_batches(cursor, parquet_path, columns, staging, quote, chunk_rows)
+        cursor.execute(merge_sql(target, staging, columns, keys, quote))
+        merged = cursor.rowcount
+        cursor.execute(f"DROP TABLE {staging}")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    print(f"{table_name}: {staged} rows staged, {merged} rows inserted or updated")
+    return merged
+
+
+def unique_index_sql(target: str, index_name: str, keys: list, quote, nulls_not_distinct: bool = False) -> str:
+    """
+    Builds the statement creating the unique index the merge of upsert_parquet_to_table relies on.
+
+    Creating it fails if the table already holds rows with the same keys, e.g. loaded with the
+    insert or copy methods, which have to be removed first.
+
+    Args:
+        target (str): Quoted, schema qualified name of the table
+        index_name (str): Name of the index, unquoted
+        keys (List[str]): Columns identifying a row
+        quote (Callable[[str], str]): Identifier quoting of the dialect
+        nulls_not_distinct (bool, optional): Treat NULL keys as equal, PostgreSQL 15 or later
+
+    Returns:
+        str: The `CREATE UNIQUE INDEX IF NOT EXISTS` statement
+    """
+    return (f"CREATE UNIQUE INDEX IF NOT EXISTS {quote(index_name)} ON {target} "
+            f"({', '.join(quote(key) for key in keys)})" + (" NULLS NOT DISTINCT" if nulls_not_distinct else ""))
+
+
+def merge_sql(target: str, staging: str, columns: list, keys: list, quote,
+              ignored: tuple = MERGE_IGNORED_COLUMNS) -> str:
+    """
+    Builds the statement merging the staging table into the target, keyed by the unique index on `keys`.
+
+    When the file holds several rows with the same keys the last one staged wins, a single
+    statement cannot insert and then update the same row. Loaded rows are only rewritten when a
+    column other than the `ignored` ones changed, so merging the same file again writes nothing.
+
+    Args:
+        target (str): Quoted, schema qualified name of the table
+        staging (str): Quoted name of the staging table
+        columns (List[str]): Columns to load
+        keys (List[str]): Columns identifying a row
+        quote (Callable[[str], str]): Identifier quoting of the dialect
+        ignored (Tuple[str]): Columns updated along with the others but that alone do not make a
+            row changed
+
+    Returns:
+        str: The `INSERT ... ON CONFLICT ... DO UPDATE` statement
+    """
+    column_list = ', '.join(quote(column) for column in columns)
+    key_list = ', '.join(quote(key) for key in keys)
+    updates = [f"{quote(column)} = EXCLUDED.{quote(column)}" for column in columns if column not in keys]
+    compared = [quote(column) for column in columns if column not in keys and column not in ignored]
+    if compared:
+        action = (f"DO UPDATE SET {', '.join(updates)} "
+                  f"WHERE ({', '.join(f'loaded.{column}' for column in compared)}) "
+                  f"IS DISTINCT FROM ({', '.join(f'EXCLUDED.{column}' for column in compared)})")
+    else:
+        action = "DO NOTHING"
+    return (f"INSERT INTO {target} AS loaded ({column_list}) "
+            f"SELECT DISTINCT ON ({key_list}) {column_list} FROM {staging} ORDER BY {key_list}, ctid DESC "
+            f"ON CONFLICT ({key_list}) {action}")
+
+
+def __ensure_table(engine: Engine, file_schema: pa.Schema, table_name: str, schema: str) -> list:
+    """
+    Creates the table from the file schema when it does not exist, with the same column types
+    to_sql would use.
+
+    Returns:
+        List[str]: Columns to load, without the pandas index
+    """
+    # Drop the pandas index, it is never loaded (index=False in to_sql)
+    columns = [name for name in file_schema.names if not name.startswith('__index_level_')]
+
+    empty_df = file_schema.empty_table().select(columns).to_pandas()
+    empty_df.to_sql(table_name, engine, schema=schema, if_exists="append", index=False)
+    return columns
+
+
+def __copy_batches(cursor, path: str, columns: list, qualified_table: str, quote, chunk_rows: int) -> int:
+    """
+    Streams the parquet or Feather file into a table with COPY FROM STDIN, one chunk of rows at a time.
+
+    Returns:
+        int: Number of rows copied
+    """
+    copy_sql = (f"COPY {qualified_table} ({', '.join(quote(column) for column in columns)}) "
+                "FROM STDIN WITH (FORMAT csv)")
+    rows = 0
+    for batch in iter_batches(path, chunk_rows, columns):
+        cursor.copy_expert(copy_sql, io.BytesIO(batch_to_csv(batch)))
+        rows += batch.num_rows
+    return rows
+
+
+def batch_to_csv(batch: pa.RecordBatch) -> bytes:
+    """
+    Serializes a record batch as headerless CSV in the format expected by `COPY ... WITH (FORMAT csv)`.
+
+    Nulls are written unquoted and strings quoted, so COPY keeps NULL and empty strings apart.
+
+    Args:
+        batch (pa.RecordBatch): Rows to serialize
+
+    Returns:
+        bytes: CSV content
+    """
+    arrays = [column.dictionary_decode() if pa.types.is_dictionary(column.type) else column
+              for column in batch.columns]
+    table = pa.Table.from_arrays(arrays, names=batch.schema.names)
+    buffer = io.BytesIO()
+    pa_csv.write_csv(table, buffer, write_options=pa_csv.WriteOptions(include_header=False))
+    return buffer.getvalue()
@@ -0,0 +1,23 @@
+import importlib
+
+
+def deferred_callable(path: str):
+    """Returns a task callable that imports its function only when the task runs.
+
+    DAG files use it so that parsing them does not import pandas, gspread, SQLAlchemy and the
+    rest of what the task functions depend on.
+
+    Args:
+        path (str): Function as `module:function`, e.g. 'functions.load_data:load_data'
+
+    Returns:
+        Callable: Calls the function with the same arguments, Airflow passes it the whole context
+    """
+    module_name, function_name = path.split(':')
+
+    def call(*args, **context):
+        function = getattr(importlib.import_module(module_name), function_name)
+        return function(*args, **context)
+
+    call.__name__ = call.__qualname__ = function_name
+    return call
@@ -0,0 +1,40 @@
+import pandas as pd
+
+# Low cardinality columns, named as in SHEET_COLUMN_MAPPING and PDF_COLUMN_MAPPING
+CATEGORY_COLUMNS = ('product_family', 'user', 'should_be_paid', 'was_uploaded', 'devolution_type', 'devolution_id')
+
+
+def compact_dtypes(df: pd.DataFrame, stage: str, category_columns: tuple = CATEGORY_COLUMNS) -> pd.DataFrame:
+    """Convert a DataFrame to compact dtypes and print its memory usage before and after.
+
+    Low cardinality text columns become categoricals, which parquet stores dictionary encoded,
+    the remaining text columns become Arrow backed strings and integers are downcast to the
+    narrowest type that holds their values.
+
+    Args:
+        df (pd.DataFrame): DataFrame to convert
+        stage (str): Name printed along with the memory usage
+        category_columns (tuple, optional): Columns converted to categoricals when present
+
+    Returns:
+        pd.DataFrame: The converted DataFrame
+    """
+    before = memory_usage(df)
+    df = df.copy()
+    for column in df.columns:
+        series = df[column]
+        if column in category_columns and series.dtype == object:
+            df[column] = series.astype('category')
+        elif pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty') and series.dtype == object:
+            df[column] = series.astype('string[pyarrow]')
+        elif pd.api.types.is_integer_dtype(series.dtype):
+            df[column] = pd.to_numeric(series, downcast='integer')
+
+    print(f"Memory {stage}: {before / 2**20:.2f} MiB -> {memory_usage(df) / 2**20:.2f} MiB ({len(df)} rows)")
+    return df
+
+
+def memory_usage(df: pd.DataFrame) -> int:
+    """Returns the memory used by a DataFrame in bytes, including the content of object columns
+    """
+    return int(df.memory_usage(deep=True).sum())
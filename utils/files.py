@@ -0,0 +1,25 @@
+import os
+import tempfile
+
+
+def atomic_write(path: str, data: bytes) -> None:
+    """Write a file so readers never see it half written.
+
+    The content is written to a temporary file in the same directory and then renamed over
+    the destination, which is atomic on POSIX filesystems.
+
+    Args:
+        path (str): Destination file path
+        data (bytes): Content to write
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
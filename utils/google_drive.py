@@ -1,16 +1,89 @@
+import hashlib
+import queue
+import random
+import socket
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
 import gspread
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import requests
-import pdfplumber
 from io import BytesIO
 import io
-from oauth2client.service_account import ServiceAccountCredentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
+from googleapiclient.errors import HttpError
+from google.auth.transport.requests import AuthorizedSession, Request
 from google.oauth2.service_account import Credentials
-from utils.constants import CREDENTIALS_FILE, NOTE_COLUMN, SHEET_NAME, WORKSHEET_NAME, PDF_COLUMN
-
-
+from utils.constants import CREDENTIALS_FILE, NOTE_COLUMN, SHEET_NAME, WORKSHEET_NAME, PDF_COLUMN, \
+    DRIVE_MAX_WORKERS, DRIVE_TIMEOUT, DRIVE_MAX_RETRIES, PDF_PARSE_PROCESSES, PIPELINE_QUEUE_SIZE, SHEET_READ_MODE
+from utils.intermediate_store import open_writer, write_frame
+from utils.pdf_cache import PdfCache, get_pdf_cache
+from utils.pdf_extraction import extract_raw_tables, extract_tables_from_pdfs, process_pool, raw_tables_to_dataframes, \
+    submit_pdf
+from utils.metrics import metrics
+from utils.rate_limit import get_sheets_rate_limiter
+from utils.table_cache import TableCache, get_table_cache
+
+
+# Drive is only used to find the sheet by name and download the PDFs, so it gets read only access
+SHEET_SCOPE = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive.readonly']
+
+DRIVE_FILES_URL = 'https://www.googleapis.com/drive/v3/files/{file_id}'
+
+# Tokens are refreshed this long before they expire, so no request goes out with a token about to expire
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+# Drive answers with these status codes when it is throttling or temporarily unavailable
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Columns of the PDF tables written by the pipelined extraction, the mapped columns plus the
+# ones transform_data renames or drops. Other columns are left out. Also the columns of the empty
+# frame make_df_from_pdfs returns when no PDF has tables
+PIPELINE_TABLE_SCHEMA = pa.schema(
+    [(column, pa.string()) for column in ('code', 'description', 'pvp', 'quantity', 'total_amount',
+                                          'devolution_type', 'Causa de\ndevolución', 'Articulo en\nfalta',
+                                          'Incluido\nAlbaran', 'ComCalid')]
+    + [('devolution_id', pa.int64())]
+)
+
+# Ranges requested in a single batch_get call, keeps the request URL well below its length limit
+MAX_RANGES_PER_REQUEST = 100
+
+# Marks the end of the items of a pipeline stage
+_DONE = object()
+
+# Google clients shared by every call of the process, see get_authorized_session
+_credentials = None
+_session = None
+_sheets_client = None
+_client_lock = threading.Lock()
+
+# Map original sheet column names to new column names
+SHEET_COLUMN_MAPPING = {
+    'Marca temporal': 'original_timestamp',
+    'FAMILIA PRODUCTOS': 'product_family',
+    'FECHA NOTA': 'note_date',
+    'NOTA': 'note_number',
+    'MONTO': 'note_amount',
+    'RECONOCIMIENTO': 'should_be_paid',
+    'USUARIO': 'user',
+    'PDF NOTA': PDF_COLUMN,
+    'OSERVACIONES': 'additional_info',
+    'FECHA': 'not_used_date',
+    'IDDEVOLUCION': 'not_used_column',
+    'DETALLES JT': 'details_jt',
+    'FORM PC': 'was_uploaded',
+    'MES': 'month',
+    'ANO': 'year',
+    'MES CONFIRMADA': 'confirmed_date'
+}
+
+
+@metrics.timed('sheet_read')
 def get_google_sheet_data(sheet_name, worksheet_name, filter_value='25/08/2024', filter_column="FECHA NOTA"):
     """Access Google Sheet and retrieve data as a DataFrame
 
@@ -23,56 +96,305 @@ def get_google_sheet_data(sheet_name, worksheet_name, filter_value='25/08/2024',
     Returns:
         pd.DataFrame: DataFrame containing the worksheet data
     """
-    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-
     print('value searched:')
     print(filter_value)
-    credentials = ServiceAccountCredentials.from_json_keyfile_name(CREDENTIALS_FILE, scope)
+    worksheet = __open_worksheet(sheet_name, worksheet_name)
 
-    client = gspread.authorize(credentials)
+    if filter_column and filter_value:
+        if SHEET_READ_MODE == 'targeted':
+            df = read_matching_rows(worksheet, [filter_value], filter_column)
+        else:
+            get_sheets_rate_limiter().acquire()
+            df = rows_from_grid(worksheet.get_all_values(), [filter_value], filter_column)
+        return df.rename(columns=SHEET_COLUMN_MAPPING)
 
-    sheet = client.open(sheet_name)
+    get_sheets_rate_limiter().acquire()
+    data = worksheet.get_all_records()
+    filtered_rows = data[1:]
 
-    worksheet = sheet.worksheet(worksheet_name)
+    # Create DataFrame with original column names
+    df = pd.DataFrame(filtered_rows, columns=data[0])
 
-    data = worksheet.get_all_records()
+    # Rename columns using the mapping
+    return df.rename(columns=SHEET_COLUMN_MAPPING)
 
-    filtered_rows = data
 
-    if filter_column and filter_value:
-        filtered_rows = [row for row in data if row.get(filter_column) == filter_value]
+@metrics.timed('sheet_read')
+def get_google_sheet_data_by_dates(sheet_name, worksheet_name, filter_values, filter_column="FECHA NOTA"):
+    """Fetch the worksheet once and split it into one DataFrame per date
+
+    Unlike calling `get_google_sheet_data` once per date, the worksheet is read a single time
+    and partitioned in memory with one vectorized pass. With SHEET_READ_MODE 'targeted' only the
+    rows of the dates are read, see read_matching_rows.
+
+    Args:
+        sheet_name (str): Name of the Google Sheets file
+        worksheet_name (str): Name of the worksheet
+        filter_values (List[str]): Dates to keep, in DD/MM/YYYY format
+        filter_column (str, optional): Column holding the dates
+
+    Returns:
+        tuple[dict[str, pd.DataFrame], dict[str, int]]: DataFrames keyed by date (empty
+            DataFrames for dates without rows) and the number of rows found for each date
+    """
+    print('values searched:')
+    print(filter_values)
+    worksheet = __open_worksheet(sheet_name, worksheet_name)
+
+    if SHEET_READ_MODE == 'targeted':
+        return partition_by_dates(read_matching_rows(worksheet, filter_values, filter_column),
+                                  filter_values, filter_column)
+
+    get_sheets_rate_limiter().acquire()
+    df = rows_from_grid(worksheet.get_all_values(), filter_values, filter_column)
+
+    return partition_by_dates(df, filter_values, filter_column)
+
+
+def rows_from_grid(grid, filter_values, filter_column="FECHA NOTA") -> pd.DataFrame:
+    """Filter the raw cell grid of a worksheet without building a dict per row
+
+    The grid is turned into one Arrow string array per column and filtered with a vectorized
+    mask. Only the matching rows are numericised, as get_all_records would have done.
+
+    Args:
+        grid (List[List[str]]): Rows returned by get_all_values, the header first
+        filter_values (List[str]): Values to keep, e.g. dates in DD/MM/YYYY format
+        filter_column (str, optional): Column holding the values
+
+    Returns:
+        pd.DataFrame: Matching rows with the original column names, in sheet order
+    """
+    if not grid:
+        return pd.DataFrame()
+
+    header = grid[0]
+    if filter_column not in header:
+        return pd.DataFrame(columns=header)
+
+    width = len(header)
+    table = pa.table([pa.array([row[index] if index < len(row) else '' for row in grid[1:]], pa.string())
+                      for index in range(width)], names=[str(index) for index in range(width)])
+
+    mask = pc.is_in(table.column(header.index(filter_column)), value_set=pa.array(filter_values, pa.string()))
+    matches = table.filter(mask)
+
+    rows = [gspread.utils.numericise_all(list(row)) for row in zip(*matches.to_pydict().values())]
+    return pd.DataFrame(rows, columns=header)
+
+
+def read_matching_rows(worksheet, filter_values, filter_column="FECHA NOTA",
+                       max_ranges: int = MAX_RANGES_PER_REQUEST) -> pd.DataFrame:
+    """Read only the worksheet rows whose filter column holds one of the given values
+
+    The header row and the filter column are read first, then the matching rows are requested
+    as contiguous ranges with batch_get. API calls and cells transferred grow with the matching
+    rows instead of the size of the sheet. Every call goes through the Sheets rate limiter.
+
+    Args:
+        worksheet (gspread.Worksheet): Opened worksheet
+        filter_values (List[str]): Values to keep, e.g. dates in DD/MM/YYYY format
+        filter_column (str, optional): Column holding the values
+        max_ranges (int, optional): Ranges requested per batch_get call
+
+    Returns:
+        pd.DataFrame: Matching rows with the original column names, in sheet order and
+            numericised as get_all_records does
+    """
+    limiter = get_sheets_rate_limiter()
+
+    limiter.acquire()
+    header = worksheet.row_values(1)
+    api_calls = 1
+    if filter_column not in header:
+        print(f"Column {filter_column} not found in the worksheet header")
+        return pd.DataFrame(columns=header)
+
+    limiter.acquire()
+    column = worksheet.col_values(header.index(filter_column) + 1)
+    api_calls += 1
+
+    wanted = set(filter_values)
+    row_numbers = [number for number, value in enumerate(column[1:], start=2) if value in wanted]
+    ranges = __contiguous_ranges(row_numbers, gspread.utils.rowcol_to_a1(1, len(header))[:-1])
+
+    rows = []
+    for start in range(0, len(ranges), max_ranges):
+        limiter.acquire()
+        for value_range in worksheet.batch_get(ranges[start:start + max_ranges]):
+            rows.extend(value_range)
+        api_calls += 1
+
+    cells = len(header) + len(column) + sum(len(row) for row in rows)
+    metrics.incr('sheets_api_calls', api_calls)
+    metrics.incr('sheets_cells', cells)
+    print(f"Sheets reads: {api_calls} API calls, {cells} cells, "
+          f"{len(rows)} of {max(len(column) - 1, 0)} rows in {len(ranges)} ranges")
+
+    rows = [gspread.utils.numericise_all(row + [''] * (len(header) - len(row))) for row in rows]
+    return pd.DataFrame(rows, columns=header)
+
+
+def __contiguous_ranges(row_numbers, last_column: str) -> list:
+    """
+    Group sorted sheet row numbers in A1 ranges of consecutive rows, e.g. [2, 3, 4, 7] gives
+    ['A2:D4', 'A7:D7'] for a header ending in column D.
+    """
+    ranges = []
+    for number in row_numbers:
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return [f'A{first}:{last_column}{last}' for first, last in ranges]
+
+
+def partition_by_dates(df: pd.DataFrame, filter_values, filter_column="FECHA NOTA"):
+    """Split a worksheet DataFrame into one renamed DataFrame per date
+
+    Args:
+        df (pd.DataFrame): Worksheet rows with the original column names
+        filter_values (List[str]): Dates to keep, in DD/MM/YYYY format
+        filter_column (str, optional): Column holding the dates
+
+    Returns:
+        tuple[dict[str, pd.DataFrame], dict[str, int]]: DataFrames keyed by date and the
+            number of rows found for each date
+    """
+    matches = df[df[filter_column].isin(filter_values)] if filter_column in df.columns else df.iloc[0:0]
+    groups = dict(tuple(matches.groupby(filter_column, sort=False)))
+
+    frames_by_date = {}
+    rows_per_date = {}
+    for date in filter_values:
+        date_df = groups.get(date, df.iloc[0:0])
+        frames_by_date[date] = date_df.reset_index(drop=True).rename(columns=SHEET_COLUMN_MAPPING)
+        rows_per_date[date] = len(date_df)
+
+    return frames_by_date, rows_per_date
+
+
+@metrics.timed('sheet_read')
+def get_google_sheet_rows_since(sheet_name, worksheet_name, watermark: dict, timestamp_column="Marca temporal"):
+    """Fetch only the worksheet rows appended after a watermark
+
+    The form is append-only, so the rows past the last loaded row are read with a single
+    range request instead of downloading the whole worksheet.
+
+    Args:
+        sheet_name (str): Name of the Google Sheets file
+        worksheet_name (str): Name of the worksheet
+        watermark (dict): `row` (last loaded sheet row, the header being row 1) and `timestamp`
+            ("Marca temporal" of that row)
+        timestamp_column (str, optional): Column holding the form submission timestamp
+
+    Returns:
+        tuple[pd.DataFrame, dict]: The new rows and the watermark to commit once they are loaded
+    """
+    worksheet = __open_worksheet(sheet_name, worksheet_name)
+    limiter = get_sheets_rate_limiter()
+
+    limiter.acquire()
+    header = worksheet.row_values(1)
+    last_row = watermark['row']
+    last_column = gspread.utils.rowcol_to_a1(1, len(header))[:-1]
+
+    # Read the watermark row again to check the sheet was not edited above it
+    limiter.acquire()
+    rows = worksheet.get(f'A{last_row}:{last_column}')
+    rows = [gspread.utils.numericise_all(row + [''] * (len(header) - len(row))) for row in rows]
+    if last_row > 1:
+        watermark_row = dict(zip(header, rows.pop(0))) if rows else {}
+        if watermark_row.get(timestamp_column) != watermark['timestamp']:
+            raise ValueError(f"Row {last_row} no longer matches the watermark {watermark}, "
+                             "the sheet was edited above it and the watermark has to be reset")
     else:
-        filtered_rows = data[1:]
-
-    # Create a dictionary to map original column names to new column names
-    column_mapping = {
-        'Marca temporal': 'original_timestamp',
-        'FAMILIA PRODUCTOS': 'product_family',
-        'FECHA NOTA': 'note_date',
-        'NOTA': 'note_number',
-        'MONTO': 'note_amount',
-        'RECONOCIMIENTO': 'should_be_paid',
-        'USUARIO': 'user',
-        'PDF NOTA': PDF_COLUMN,
-        'OSERVACIONES': 'additional_info',
-        'FECHA': 'not_used_date',
-        'IDDEVOLUCION': 'not_used_column',
-        'DETALLES JT': 'details_jt',
-        'FORM PC': 'was_uploaded',
-        'MES': 'month',
-        'ANO': 'year',
-        'MES CONFIRMADA': 'confirmed_date'
-    }
+        rows = rows[1:]
 
-    # Create DataFrame with original column names
-    df = pd.DataFrame(filtered_rows, columns=data[0])
+    print(f"New rows since row {last_row}: {len(rows)}")
+    df = pd.DataFrame(rows, columns=header)
 
-    # Rename columns using the mapping
-    df = df.rename(columns=column_mapping)
+    new_watermark = dict(watermark)
+    if rows:
+        new_watermark = {'row': last_row + len(rows), 'timestamp': rows[-1][header.index(timestamp_column)]}
+
+    return df.rename(columns=SHEET_COLUMN_MAPPING), new_watermark
+
+
+def __open_worksheet(sheet_name, worksheet_name):
+    """Open a worksheet with the shared Sheets client
+
+    Finding the file and reading its worksheets are a request each, both count against the
+    Sheets rate limit.
+
+    Args:
+        sheet_name (str): Name of the Google Sheets file
+        worksheet_name (str): Name of the worksheet
+
+    Returns:
+        gspread.Worksheet: The opened worksheet
+    """
+    get_sheets_rate_limiter().acquire()
+    sheet = get_sheets_client().open(sheet_name)
+
+    get_sheets_rate_limiter().acquire()
+    return sheet.worksheet(worksheet_name)
+
+
+def get_credentials() -> Credentials:
+    """Returns the service account credentials shared by every Google client of the process
+
+    The key file is read once. The access token is refreshed when it is within
+    TOKEN_REFRESH_MARGIN of expiring, by a single thread while the others wait for it.
+
+    Returns:
+        Credentials: Credentials with a valid token
+    """
+    global _credentials
+    with _client_lock:
+        if _credentials is None:
+            try:
+                _credentials = Credentials.from_service_account_file(CREDENTIALS_FILE, scopes=SHEET_SCOPE)
+            except Exception:
+                raise ValueError("No credentials provided")
+
+        # expiry is a naive UTC datetime
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        if not _credentials.token or _credentials.expiry is None or _credentials.expiry - now < TOKEN_REFRESH_MARGIN:
+            _credentials.refresh(Request())
+        return _credentials
 
-    # Select only the columns we want in the final DataFrame
-    # df = df[list(column_mapping.values())]
-    return df
+
+def get_authorized_session() -> AuthorizedSession:
+    """Returns the HTTP session shared by the Sheets and Drive requests of the process
+
+    Connections are kept alive and pooled, with room for DRIVE_MAX_WORKERS concurrent downloads.
+
+    Returns:
+        AuthorizedSession: Session adding the shared credentials to every request
+    """
+    global _session
+    credentials = get_credentials()
+    with _client_lock:
+        if _session is None:
+            _session = AuthorizedSession(credentials)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(DRIVE_MAX_WORKERS, 10))
+            _session.mount('https://', adapter)
+        return _session
+
+
+def get_sheets_client() -> gspread.Client:
+    """Returns the gspread client shared by every Sheets read of the process
+
+    Returns:
+        gspread.Client: Client using the shared credentials and session
+    """
+    global _sheets_client
+    session = get_authorized_session()
+    with _client_lock:
+        if _sheets_client is None:
+            _sheets_client = gspread.Client(_credentials, session=session)
+        return _sheets_client
 
 
 def download_pdf_from_url(pdf_url):
@@ -100,53 +422,143 @@ def extract_table_with_pdfplumber(pdf_file):
     Returns:
         List[pd.DataFrame]: List of DataFrames containing the extracted tables
     """
-    tables_data = []
-
-    column_mapping = {
-        'Código': 'code',
-        'Descripción': 'description',
-        'PVP': 'pvp',
-        'Cantidad': 'quantity',
-        'Total': 'total_amount',
-        'Causa de\ndevolucion': 'devolution_type'
-    }
     try:
-        with pdfplumber.open(pdf_file) as pdf:
-            for page in pdf.pages:
-                tables = page.extract_tables()
-                for table in tables:
-                    df = pd.DataFrame(table[1:], columns=table[0])
-                    df = df.rename(columns=column_mapping)
-                    tables_data.append(df)
-        return tables_data
+        return raw_tables_to_dataframes(extract_raw_tables(pdf_file))
     except Exception as e:
         print(f"Error al procesar el PDF: {str(e)}")
         return None
 
 
-def download_pdf_from_drive(file_id: str):
-    """Downloads a file from Google Drive
+def download_pdf_from_drive(file_id: str, timeout: float = DRIVE_TIMEOUT):
+    """Downloads a file from Google Drive with a single media request on the shared session
+
+    Args:
+        file_id (str): Google Drive file ID
+        timeout (float, optional): Socket timeout in seconds for each request
+
+    Returns:
+        io.BytesIO: Downloaded file
+    """
+    response = get_authorized_session().get(DRIVE_FILES_URL.format(file_id=file_id), params={'alt': 'media'},
+                                            timeout=timeout)
+    response.raise_for_status()
+    metrics.incr('pdf_bytes_fetched', len(response.content))
+    return io.BytesIO(response.content)
+
+
+def get_drive_file_metadata(file_id: str, timeout: float = DRIVE_TIMEOUT) -> dict:
+    """Gets the checksum and revision of a Google Drive file
+
+    Args:
+        file_id (str): Google Drive file ID
+        timeout (float, optional): Socket timeout in seconds for the request
+
+    Returns:
+        dict: `md5Checksum` and `headRevisionId` of the file
+    """
+    response = get_authorized_session().get(DRIVE_FILES_URL.format(file_id=file_id),
+                                            params={'fields': 'md5Checksum,headRevisionId'}, timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def download_pdfs_from_drive(file_ids: list, max_workers: int = DRIVE_MAX_WORKERS, timeout: float = DRIVE_TIMEOUT,
+                             max_retries: int = DRIVE_MAX_RETRIES, cache: PdfCache = None) -> list:
+    """Downloads several files from Google Drive using a bounded pool of threads
+
+    Args:
+        file_ids (List[str]): Google Drive file IDs
+        max_workers (int, optional): Maximum number of concurrent downloads, 1 downloads serially
+        timeout (float, optional): Socket timeout in seconds for each request
+        max_retries (int, optional): Retries for throttled (429), failed (5xx) or timed out downloads
+        cache (PdfCache, optional): Local cache checked before going to Drive
+
+    Returns:
+        List[io.BytesIO]: Downloaded files, in the same order as `file_ids`
+    """
+    def download(file_id):
+        return download_pdf_cached(file_id, cache=cache, timeout=timeout, max_retries=max_retries)
+
+    if max_workers <= 1 or len(file_ids) <= 1:
+        return [download(file_id) for file_id in file_ids]
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(file_ids))) as executor:
+        return list(executor.map(download, file_ids))
+
+
+def download_pdf_cached(file_id: str, cache: PdfCache = None, timeout: float = DRIVE_TIMEOUT,
+                        max_retries: int = DRIVE_MAX_RETRIES):
+    """Returns a Drive file from the local cache, downloading and caching it on a miss
 
     Args:
-        df (pd.DataFrame): DataFrame containing the file ID
+        file_id (str): Google Drive file ID
+        cache (PdfCache, optional): Local cache, None always downloads
+        timeout (float, optional): Socket timeout in seconds for each request
+        max_retries (int, optional): Retries for throttled (429), failed (5xx) or timed out downloads
 
     Returns:
         io.BytesIO: Downloaded file
     """
+    if cache is None:
+        return download_pdf_with_retries(file_id, timeout=timeout, max_retries=max_retries)
+
+    content = cache.get(file_id)
+    if content is not None:
+        return io.BytesIO(content)
+
+    pdf_file = download_pdf_with_retries(file_id, timeout=timeout, max_retries=max_retries)
     try:
-        credentials = Credentials.from_service_account_file(CREDENTIALS_FILE,
-                                                            scopes=['https://www.googleapis.com/auth/drive.readonly'])
-    except Exception:
-        raise ValueError("No credentials provided")
+        metadata = get_drive_file_metadata(file_id, timeout=timeout)
+    except Exception as e:
+        print(f"Could not get metadata for {file_id}: {e}")
+        metadata = None
+    cache.put(file_id, pdf_file.getvalue(), metadata)
+    return pdf_file
+
+
+def download_pdf_with_retries(file_id: str, timeout: float = DRIVE_TIMEOUT, max_retries: int = DRIVE_MAX_RETRIES,
+                              backoff: float = 1.0):
+    """Downloads a file from Google Drive, retrying with exponential backoff on transient errors
+
+    Args:
+        file_id (str): Google Drive file ID
+        timeout (float, optional): Socket timeout in seconds for each request
+        max_retries (int, optional): Retries for throttled (429), failed (5xx) or timed out downloads
+        backoff (float, optional): Base delay in seconds, doubled after every failed attempt
 
-    drive_service = build('drive', 'v3', credentials=credentials)
-    request = drive_service.files().get_media(fileId=file_id)
-    file = io.BytesIO()
-    downloader = MediaIoBaseDownload(file, request)
-    done = False
-    while done is False:
-        status, done = downloader.next_chunk()
-    return file
+    Returns:
+        io.BytesIO: Downloaded file
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            start = time.perf_counter()
+            pdf_file = download_pdf_from_drive(file_id, timeout=timeout)
+            metrics.observe('pdf_download_seconds', time.perf_counter() - start)
+            return pdf_file
+        except Exception as e:
+            if attempt == max_retries or not is_retryable_error(e):
+                raise
+            delay = backoff * 2 ** attempt + random.uniform(0, backoff)
+            print(f"Retrying download of {file_id} in {delay:.1f}s after error: {e}")
+            metrics.incr('pdf_download_retries')
+            time.sleep(delay)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Checks whether a Drive request error is transient and worth retrying
+
+    Args:
+        error (Exception): Error raised by the request
+
+    Returns:
+        bool: True for throttling, server errors, timeouts and dropped connections
+    """
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUS_CODES
+    if isinstance(error, requests.HTTPError) and error.response is not None:
+        return error.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(error, (socket.timeout, TimeoutError, ConnectionError, requests.ConnectionError,
+                              requests.Timeout))
 
 
 def extract_file_id_from_url(url):
@@ -165,18 +577,57 @@ def get_original_data():
     return get_google_sheet_data(SHEET_NAME, WORKSHEET_NAME)
 
 
-def make_df_from_pdfs(data: pd.DataFrame):
-    all_tables = []
+def parse_pdfs(pdf_files: list, processes: int = PDF_PARSE_PROCESSES, table_cache: TableCache = None) -> list:
+    """Extracts the tables of several PDFs, reusing the tables already parsed for the same content
+
+    Args:
+        pdf_files (List[BytesIO]): PDF files as BytesIO objects
+        processes (int, optional): Number of worker processes used to parse the PDFs
+        table_cache (TableCache, optional): Cache of parsed tables keyed by PDF content
+
+    Returns:
+        List[List[pd.DataFrame] | None]: Tables of each PDF, in the same order as `pdf_files`.
+            None for PDFs without tables or that could not be parsed.
+    """
+    tables_per_pdf = [None] * len(pdf_files)
+    content_hashes = [hashlib.sha256(pdf_file.getvalue()).hexdigest() if table_cache else None
+                      for pdf_file in pdf_files]
+
+    pending = []
+    for position, content_hash in enumerate(content_hashes):
+        cached = table_cache.get(content_hash) if table_cache else None
+        if cached is None:
+            pending.append(position)
+        elif not cached.empty:
+            tables_per_pdf[position] = [cached]
+
+    raw_tables_per_pdf = extract_tables_from_pdfs([pdf_files[position] for position in pending], processes=processes)
+
+    for position, raw_tables in zip(pending, raw_tables_per_pdf):
+        # PDFs that failed are not cached, so they are parsed again on the next run
+        if raw_tables is None:
+            continue
+        tables = raw_tables_to_dataframes(raw_tables)
+        if table_cache:
+            table_cache.put(content_hashes[position], tables)
+        tables_per_pdf[position] = tables
+
+    return tables_per_pdf
 
-    for index, row in data.iterrows():
-        pdf_url = row[PDF_COLUMN]
 
-        file_id = extract_file_id_from_url(pdf_url)
+def make_df_from_pdfs(data: pd.DataFrame, max_workers: int = DRIVE_MAX_WORKERS, processes: int = PDF_PARSE_PROCESSES):
+    all_tables = []
+
+    file_ids = [extract_file_id_from_url(pdf_url) for pdf_url in data[PDF_COLUMN]]
 
-        pdf_file = download_pdf_from_drive(file_id)
+    # Downloads run concurrently but come back in row order, so the foreign key still lines up
+    with metrics.timer('pdf_download'):
+        pdf_files = download_pdfs_from_drive(file_ids, max_workers=max_workers, cache=get_pdf_cache())
 
-        tables = extract_table_with_pdfplumber(pdf_file)
+    with metrics.timer('pdf_parse'):
+        tables_per_pdf = parse_pdfs(pdf_files, processes=processes, table_cache=get_table_cache())
 
+    for (index, row), tables in zip(data.iterrows(), tables_per_pdf):
         if tables:
             for table in tables:
                 # add foreign key to original table
@@ -191,4 +642,207 @@ def make_df_from_pdfs(data: pd.DataFrame):
 
         return result_df
     else:
-        return pd.DataFrame()  # Return an empty DataFrame if no tables were found
+        # No tables, e.g. every note was already loaded, still keep the columns transform_data expects
+        return PIPELINE_TABLE_SCHEMA.empty_table().to_pandas()
+
+
+@metrics.timed('pdf_pipeline')
+def stream_df_from_pdfs(data: pd.DataFrame, output_path: str, max_workers: int = DRIVE_MAX_WORKERS,
+                        processes: int = PDF_PARSE_PROCESSES, queue_size: int = PIPELINE_QUEUE_SIZE,
+                        timeout: float = DRIVE_TIMEOUT, max_retries: int = DRIVE_MAX_RETRIES) -> int:
+    """Downloads, parses and writes the tables of the PDFs of `data` as a pipeline
+
+    A downloader stage and a parser stage run in their own threads, connected to the collector
+    (the calling thread) by queues of `queue_size` items. When a stage falls behind, the queue in
+    front of it fills up and the stage before it waits, so only the PDFs in flight are held in
+    memory. The collector appends the tables of every PDF to `output_path` as soon as they and the
+    ones of the PDFs before them are parsed, keeping the row order of make_df_from_pdfs.
+
+    The parser sends the PDFs to a pool of at least one worker process, so every parse is bounded
+    by PDF_PARSE_TIME_LIMIT. The pool is created here with the forkserver start method, forking a
+    process that runs download threads could leave the child waiting on a lock one of them held.
+
+    Args:
+        data (pd.DataFrame): Sheet rows with the PDF_COLUMN and NOTE_COLUMN columns
+        output_path (str): File to write, parquet or Feather depending on its extension
+        max_workers (int, optional): Maximum number of concurrent downloads
+        processes (int, optional): Number of worker processes used to parse the PDFs
+        queue_size (int, optional): Capacity of the queues between stages
+        timeout (float, optional): Socket timeout in seconds for each request
+        max_retries (int, optional): Retries for throttled (429), failed (5xx) or timed out downloads
+
+    Returns:
+        int: Number of table rows written, with the columns of PIPELINE_TABLE_SCHEMA
+    """
+    file_ids = [extract_file_id_from_url(pdf_url) for pdf_url in data[PDF_COLUMN]]
+    downloaded = queue.Queue(maxsize=queue_size)
+    parsed = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    executor = process_pool(max(processes, 1))
+
+    stages = [
+        threading.Thread(target=__download_stage, daemon=True,
+                         args=(file_ids, downloaded, stop, max_workers, get_pdf_cache(), timeout, max_retries)),
+        threading.Thread(target=__parse_stage, daemon=True,
+                         args=(downloaded, parsed, stop, executor, max(processes, 1), get_table_cache())),
+    ]
+    for stage in stages:
+        stage.start()
+
+    try:
+        return __collect_stage(parsed, list(data[NOTE_COLUMN]), output_path)
+    finally:
+        stop.set()
+        for stage in stages:
+            stage.join()
+        executor.shutdown(cancel_futures=True)
+
+
+def __download_stage(file_ids: list, output: queue.Queue, stop: threading.Event, max_workers: int,
+                     cache: PdfCache, timeout: float, max_retries: int) -> None:
+    """
+    Downloads the files with up to `max_workers` threads and queues `(position, BytesIO)` items,
+    `(position, exception)` for the files that failed.
+    """
+    slots = threading.Semaphore(max(max_workers, 1))
+
+    def download(position, file_id):
+        try:
+            try:
+                item = download_pdf_cached(file_id, cache=cache, timeout=timeout, max_retries=max_retries)
+            except Exception as e:
+                item = e
+            __put(output, (position, item), stop)
+        finally:
+            slots.release()
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            for position, file_id in enumerate(file_ids):
+                # Wait for a free download slot, a slot is held until its file is queued, so a full
+                # queue stops new downloads and the executor never has more than max_workers tasks
+                while not slots.acquire(timeout=0.1):
+                    if stop.is_set():
+                        return
+                executor.submit(download, position, file_id)
+        __put(output, _DONE, stop)
+    except Exception as e:
+        __put(output, (None, e), stop)
+
+
+def __parse_stage(source: queue.Queue, output: queue.Queue, stop: threading.Event, executor: ProcessPoolExecutor,
+                  processes: int, table_cache: TableCache) -> None:
+    """
+    Parses the downloaded files in the `processes` workers of `executor` and queues `(position, tables)` items.
+    """
+    in_flight = deque()
+
+    def finish(position, content_hash, result):
+        raw_tables, seconds = result
+        metrics.observe('pdf_parse_seconds', seconds)
+        tables = raw_tables_to_dataframes(raw_tables) if raw_tables is not None else None
+        if table_cache and raw_tables is not None:
+            table_cache.put(content_hash, tables)
+        __put(output, (position, tables), stop)
+
+    try:
+        while not stop.is_set():
+            item = __get(source, stop)
+            if item is _DONE or item is None:
+                break
+            position, pdf_file = item
+            if isinstance(pdf_file, Exception):
+                __put(output, item, stop)
+                continue
+
+            content_hash = hashlib.sha256(pdf_file.getvalue()).hexdigest() if table_cache else None
+            cached = table_cache.get(content_hash) if table_cache else None
+            if cached is not None:
+                __put(output, (position, [cached] if not cached.empty else None), stop)
+            else:
+                in_flight.append((position, content_hash, submit_pdf(executor, pdf_file)))
+                # Keep every worker busy with one PDF queued behind it, but no more
+                if len(in_flight) >= 2 * processes:
+                    position, content_hash, future = in_flight.popleft()
+                    finish(position, content_hash, future.result())
+
+        while in_flight and not stop.is_set():
+            position, content_hash, future = in_flight.popleft()
+            finish(position, content_hash, future.result())
+        __put(output, _DONE, stop)
+    except Exception as e:
+        __put(output, (None, e), stop)
+
+
+def __collect_stage(source: queue.Queue, note_numbers: list, output_path: str) -> int:
+    """
+    Writes the parsed tables in row order, holding the ones that arrive early in a reorder buffer.
+    """
+    start = time.monotonic()
+    pending = {}
+    next_position = 0
+    writer = None
+    rows = 0
+    try:
+        while next_position < len(note_numbers):
+            item = source.get()
+            if item is _DONE:
+                raise RuntimeError(f"PDF pipeline stopped after {next_position} of {len(note_numbers)} PDFs")
+            position, tables = item
+            if isinstance(tables, Exception):
+                raise tables
+            pending[position] = tables
+
+            while next_position in pending:
+                tables = pending.pop(next_position)
+                if tables:
+                    table = __conform_tables(tables, note_numbers[next_position])
+                    if writer is None:
+                        writer, schema = open_writer(output_path, PIPELINE_TABLE_SCHEMA)
+                        print(f"First PDF rows written after {time.monotonic() - start:.1f}s")
+                    writer.write_table(table.cast(schema))
+                    rows += table.num_rows
+                else:
+                    print(f"No tables found in PDF for index {next_position}")
+                next_position += 1
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if writer is None:
+        write_frame(PIPELINE_TABLE_SCHEMA.empty_table().to_pandas(), output_path)
+    print(f"{rows} PDF table rows written in {time.monotonic() - start:.1f}s")
+    return rows
+
+
+def __conform_tables(tables: list, note_number) -> pa.Table:
+    """
+    Concatenates the tables of a PDF and adds the foreign key, with the columns of PIPELINE_TABLE_SCHEMA.
+    """
+    df = pd.concat(tables, ignore_index=True)
+    dropped = [column for column in df.columns if column not in PIPELINE_TABLE_SCHEMA.names]
+    if dropped:
+        print(f"Columns left out of the PDF tables of note {note_number}: {dropped}")
+
+    df = df.reindex(columns=PIPELINE_TABLE_SCHEMA.names[:-1])
+    df = df.where(df.isna(), df.astype(str)).astype(object).where(df.notna(), None)
+    df['devolution_id'] = pd.Series([pd.to_numeric(note_number, errors='coerce')] * len(df), dtype='Int64')
+    return pa.Table.from_pandas(df, schema=PIPELINE_TABLE_SCHEMA, preserve_index=False)
+
+
+def __put(output: queue.Queue, item, stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            output.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def __get(source: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return None
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from utils.constants import TEMP_DIR, INTERMEDIATE_FORMAT
+from utils.files import atomic_write
+
+FILE_EXTENSIONS = {'feather': 'feather', 'parquet': 'parquet'}
+
+
+def run_directory(run_id: str, shard: str = None) -> str:
+    """Returns the directory holding the intermediate files of a DAG run
+
+    Args:
+        run_id (str): Airflow run id, None for runs outside Airflow
+        shard (str, optional): Sub directory of the run, for tasks that split it in several parts
+
+    Returns:
+        str: Path of the directory, below TEMP_DIR
+    """
+    directory = os.path.join(TEMP_DIR, __sanitize(run_id or 'manual'))
+    if shard is not None:
+        directory = os.path.join(directory, __sanitize(str(shard)))
+    return directory
+
+
+def write_stage(stage: str, frames: dict, run_id: str, shard: str = None,
+                file_format: str = INTERMEDIATE_FORMAT) -> tuple:
+    """Writes the DataFrames produced by a task and the manifest describing them
+
+    Args:
+        stage (str): Name of the stage, e.g. 'extract'
+        frames (dict[str, pd.DataFrame]): DataFrames keyed by file name, without extension
+        run_id (str): Airflow run id
+        shard (str, optional): Shard of the run
+        file_format (str, optional): 'feather' (uncompressed Arrow IPC, read memory mapped) or 'parquet'
+
+    Returns:
+        tuple[str, ...]: Paths of the written files, in the order of `frames`
+    """
+    directory = run_directory(run_id, shard)
+    os.makedirs(directory, exist_ok=True)
+
+    paths = {}
+    for name, df in frames.items():
+        paths[name] = stage_file_path(directory, name, file_format)
+        write_frame(df, paths[name])
+
+    write_manifest(stage, paths)
+    return tuple(paths.values())
+
+
+def stage_file_path(directory: str, name: str, file_format: str = INTERMEDIATE_FORMAT) -> str:
+    """Returns the path of an intermediate file
+
+    Args:
+        directory (str): Directory of the run, see run_directory
+        name (str): File name, without extension
+        file_format (str, optional): 'feather' or 'parquet'
+
+    Returns:
+        str: Path of the file
+    """
+    if file_format not in FILE_EXTENSIONS:
+        raise ValueError(f"Unknown intermediate format: {file_format}")
+    return os.path.join(directory, f'{name}.{FILE_EXTENSIONS[file_format]}')
+
+
+def write_frame(df: pd.DataFrame, path: str) -> None:
+    """Writes a DataFrame in the format given by the file extension
+
+    Args:
+        df (pd.DataFrame): DataFrame to write
+        path (str): Destination, ending in .parquet or .feather
+    """
+    if path.endswith('.parquet'):
+        df.to_parquet(path)
+    else:
+        feather.write_feather(pa.Table.from_pandas(df), path, compression='uncompressed')
+
+
+def read_frame(path: str) -> pd.DataFrame:
+    """Reads an intermediate file, memory mapping Feather files instead of copying them
+
+    Args:
+        path (str): File written by write_frame
+
+    Returns:
+        pd.DataFrame: The stored DataFrame
+    """
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    return __read_ipc_table(path).to_pandas()
+
+
+def read_schema(path: str) -> pa.Schema:
+    """Reads the Arrow schema of an intermediate file without reading its rows
+
+    Args:
+        path (str): File written by write_frame
+
+    Returns:
+        pa.Schema: Schema of the file
+    """
+    if path.endswith('.parquet'):
+        return pq.read_schema(path)
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).schema
+
+
+def iter_batches(path: str, batch_rows: int, columns: list = None):
+    """Yields the rows of an intermediate file as record batches of at most `batch_rows` rows
+
+    Args:
+        path (str): File written by write_frame
+        batch_rows (int): Maximum number of rows per batch
+        columns (List[str], optional): Columns to read, all of them by default
+
+    Yields:
+        pa.RecordBatch: The next batch of rows
+    """
+    if path.endswith('.parquet'):
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_rows, columns=columns)
+        return
+
+    table = __read_ipc_table(path)
+    if columns is not None:
+        table = table.select(columns)
+    yield from table.to_batches(max_chunksize=batch_rows)
+
+
+def open_writer(path: str, schema: pa.Schema):
+    """Opens a writer that appends tables to an intermediate file
+
+    Feather files can not replace a dictionary once written, so dictionary columns are decoded
+    to their values for them.
+
+    Args:
+        path (str): Destination, ending in .parquet or .feather
+        schema (pa.Schema): Schema of the file
+
+    Returns:
+        tuple[writer, pa.Schema]: Writer with `write_table` and `close` methods, and the schema
+            the tables must be cast to before writing them
+    """
+    if path.endswith('.parquet'):
+        return pq.ParquetWriter(path, schema), schema
+
+    fields = [field.with_type(field.type.value_type) if pa.types.is_dictionary(field.type) else field
+              for field in schema]
+    schema = pa.schema(fields, metadata=schema.metadata)
+    return pa.ipc.new_file(path, schema), schema
+
+
+def write_manifest(stage: str, paths: dict) -> dict:
+    """Describes the files of a stage in `<stage>.manifest.json`, next to them
+
+    Args:
+        stage (str): Name of the stage
+        paths (dict[str, str]): Paths of the files keyed by name
+
+    Returns:
+        dict: The manifest
+    """
+    manifest = {
+        'stage': stage,
+        'created_at': datetime.now().isoformat(),
+        'files': {name: __describe_file(path) for name, path in paths.items()},
+    }
+    directory = os.path.dirname(next(iter(paths.values())))
+    atomic_write(__manifest_path(directory, stage), json.dumps(manifest, indent=2).encode())
+    return manifest
+
+
+def read_manifest(directory: str, stage: str):
+    """Reads the manifest of a stage without opening its data files
+
+    Args:
+        directory (str): Directory of the files of the stage
+        stage (str): Name of the stage
+
+    Returns:
+        dict | None: The manifest, or None if the stage did not write one
+    """
+    try:
+        with open(__manifest_path(directory, stage)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def clean_run(run_id: str) -> None:
+    """Deletes the intermediate files of a single DAG run, leaving other runs untouched
+
+    Args:
+        run_id (str): Airflow run id
+    """
+    directory = run_directory(run_id)
+    if os.path.isdir(directory):
+        shutil.rmtree(directory, ignore_errors=True)
+        print(f"Removed intermediate files of run {run_id}: {directory}")
+
+
+def __describe_file(path: str) -> dict:
+    schema = read_schema(path)
+    if path.endswith('.parquet'):
+        rows = pq.ParquetFile(path).metadata.num_rows
+    else:
+        rows = __read_ipc_table(path).num_rows
+    fingerprint = schema.remove_metadata().to_string()
+    return {
+        'path': path,
+        'rows': rows,
+        'schema_hash': hashlib.sha256(fingerprint.encode()).hexdigest()[:16],
+    }
+
+
+def __read_ipc_table(path: str) -> pa.Table:
+    # The table keeps the memory map open, its buffers point into the file instead of being copied
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+
+def __manifest_path(directory: str, stage: str) -> str:
+    return os.path.join(directory, f'{stage}.manifest.json')
+
+
+def __sanitize(name: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', name)
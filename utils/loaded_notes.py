@@ -0,0 +1,90 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from utils.constants import LOADED_NOTES_INDEX_ENABLED, LOADED_NOTES_INDEX_PATH, DB_USER
+
+_index = None
+
+
+class LoadedNotesIndex:
+    """Local SQLite index of the notes whose PDF line items are already in `pdf_devolutions`.
+
+    A refresh replaces the index with the distinct `devolution_id` values of the table, so notes
+    loaded in any order, or deleted since, are always accounted for. Refreshes closer together
+    than `max_age` seconds reuse the index, so the table is read once per task and not per date.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.refreshed_at = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with closing(self.__connect()) as connection, connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS notes (note_number INTEGER PRIMARY KEY)')
+
+    def refresh(self, engine: Engine, schema: str = f"{DB_USER}_schema", max_age: float = 300) -> int:
+        """Reads the loaded notes from the database, unless the index was refreshed recently
+
+        Args:
+            engine (Engine): Engine of the database holding `pdf_devolutions`
+            schema (str, optional): Schema of the table, None for an unqualified name
+            max_age (float, optional): Seconds a refresh made by this process stays valid
+
+        Returns:
+            int: Number of notes in the index
+        """
+        table = f'{schema}.pdf_devolutions' if schema else 'pdf_devolutions'
+        with self.lock:
+            if self.refreshed_at is None or time.monotonic() - self.refreshed_at >= max_age:
+                with engine.connect() as connection:
+                    rows = connection.execute(text(f'SELECT DISTINCT devolution_id FROM {table}')).fetchall()
+
+                with closing(self.__connect()) as connection, connection:
+                    connection.execute('DELETE FROM notes')
+                    connection.executemany('INSERT OR IGNORE INTO notes VALUES (?)',
+                                           [(int(row[0]),) for row in rows if row[0] is not None])
+                self.refreshed_at = time.monotonic()
+
+            with closing(self.__connect()) as connection:
+                return connection.execute('SELECT COUNT(*) FROM notes').fetchone()[0]
+
+    def loaded(self, note_numbers) -> set:
+        """Tells which of the given notes are already loaded
+
+        Args:
+            note_numbers (Iterable[int]): Note numbers to look up
+
+        Returns:
+            set[int]: The ones found in the index
+        """
+        numbers = {int(number) for number in note_numbers}
+        found = set()
+        with closing(self.__connect()) as connection:
+            connection.execute('CREATE TEMP TABLE wanted (note_number INTEGER PRIMARY KEY)')
+            connection.executemany('INSERT OR IGNORE INTO wanted VALUES (?)', [(number,) for number in numbers])
+            for (number,) in connection.execute('SELECT note_number FROM notes JOIN wanted USING (note_number)'):
+                found.add(number)
+        return found
+
+    def __connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+
+def get_loaded_notes_index():
+    """Returns the process wide loaded notes index
+
+    Returns:
+        LoadedNotesIndex | None: The index, or None when it is disabled
+    """
+    global _index
+    if not LOADED_NOTES_INDEX_ENABLED:
+        return None
+    if _index is None:
+        _index = LoadedNotesIndex(LOADED_NOTES_INDEX_PATH)
+    return _index
@@ -0,0 +1,258 @@
+import functools
+import json
+import os
+import re
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+from utils.constants import METRICS_DIR, STATSD_HOST, STATSD_PORT, STATSD_PREFIX
+from utils.files import atomic_write
+
+
+class Metrics:
+    """Timings and counters recorded by the current task.
+
+    Stages accumulate wall time, counters accumulate amounts (rows, bytes, API calls), gauges keep
+    the last value set and latencies keep every observation so percentiles can be reported.
+    Every method is thread safe, so download threads can record into the same instance.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.stages = {}
+            self.counters = {}
+            self.gauges = {}
+            self.latencies = {}
+
+    @contextmanager
+    def timer(self, stage: str):
+        """Adds the wall time of the block to a stage, even if the block raises
+
+        Args:
+            stage (str): Name of the stage, e.g. 'sheet_read'
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stages[stage] = self.stages.get(stage, 0.0) + elapsed
+
+    def timed(self, stage: str):
+        """Decorates a function to add the wall time of every call to a stage
+
+        Args:
+            stage (str): Name of the stage
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def incr(self, name: str, value: float = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float) -> None:
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Records one latency, e.g. the download of a single PDF
+
+        Args:
+            name (str): Name of the latency
+            seconds (float): Observed duration
+        """
+        with self.lock:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def summary(self) -> dict:
+        """Returns the recorded values as a JSON serializable document
+
+        Returns:
+            dict: `stages` and `gauges` in seconds or units, `counters` and, for every latency, its
+                `count`, `total`, `p50`, `p95` and `max`
+        """
+        with self.lock:
+            return {
+                'stages': {stage: round(seconds, 3) for stage, seconds in self.stages.items()},
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'latencies': {name: self.__describe(values) for name, values in self.latencies.items()},
+            }
+
+    @staticmethod
+    def __describe(values: list) -> dict:
+        ordered = sorted(values)
+        return {
+            'count': len(ordered),
+            'total': round(sum(ordered), 3),
+            'p50': round(ordered[int(0.50 * (len(ordered) - 1))], 3),
+            'p95': round(ordered[int(0.95 * (len(ordered) - 1))], 3),
+            'max': round(ordered[-1], 3),
+        }
+
+
+metrics = Metrics()
+
+
+def instrumented(stage: str):
+    """Decorates a task callable to time it as `stage` and report the task metrics when it ends
+
+    Args:
+        stage (str): Name of the stage timing the whole callable
+
+    Returns:
+        Callable: The decorator, the decorated function keeps the signature Airflow inspects
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **context):
+            try:
+                with metrics.timer(stage):
+                    return function(*args, **context)
+            finally:
+                report_metrics(context, default_task=function.__name__)
+        return wrapper
+    return decorator
+
+
+def report_metrics(context: dict, default_task: str = 'task') -> dict:
+    """Emits the metrics of the task and starts a new set of them
+
+    The summary is printed as one JSON line and pushed to XCom under the 'metrics' key. It is also
+    written as a Prometheus textfile in METRICS_DIR and sent to a StatsD daemon at STATSD_HOST,
+    when they are set.
+
+    Args:
+        context (dict): Airflow context dictionary
+        default_task (str, optional): Task name used when there is no task instance
+
+    Returns:
+        dict: The summary, with the `task` and `map_index` it belongs to
+    """
+    ti = context.get('ti')
+    task = getattr(ti, 'task_id', None) or default_task
+    map_index = getattr(ti, 'map_index', -1)
+    if not isinstance(map_index, int):
+        map_index = -1
+
+    summary = dict(metrics.summary(), task=task, map_index=map_index)
+    metrics.reset()
+
+    print(f"Metrics: {json.dumps(summary, sort_keys=True)}")
+    if ti:
+        ti.xcom_push(key='metrics', value=summary)
+    try:
+        if METRICS_DIR:
+            write_prometheus_textfile(summary, METRICS_DIR)
+        if STATSD_HOST:
+            send_statsd(summary, STATSD_HOST, STATSD_PORT)
+    except OSError as e:
+        print(f"Could not export metrics: {e}")
+    return summary
+
+
+def merge_summaries(summaries: list) -> dict:
+    """Adds up the summaries of several tasks or mapped task instances into a run summary
+
+    Args:
+        summaries (List[dict]): Summaries returned by report_metrics
+
+    Returns:
+        dict: `stages` and `counters` summed over every summary, the `tasks` included and the
+            `slowest_stage`
+    """
+    run = {'stages': {}, 'counters': {}, 'tasks': []}
+    for summary in summaries:
+        run['tasks'].append(summary.get('task'))
+        for key in ('stages', 'counters'):
+            for name, value in summary.get(key, {}).items():
+                run[key][name] = round(run[key].get(name, 0) + value, 3)
+    run['slowest_stage'] = max(run['stages'], key=run['stages'].get) if run['stages'] else None
+    return run
+
+
+def prometheus_lines(summary: dict) -> list:
+    """Formats a summary in the Prometheus exposition format
+
+    Args:
+        summary (dict): Summary returned by report_metrics
+
+    Returns:
+        List[str]: Lines of the textfile, including the TYPE comments
+    """
+    labels = f'task="{summary["task"]}",map_index="{summary["map_index"]}"'
+    lines = ['# TYPE etl_stage_seconds gauge']
+    lines += [f'etl_stage_seconds{{{labels},stage="{stage}"}} {seconds}'
+              for stage, seconds in summary['stages'].items()]
+    lines.append('# TYPE etl_counter gauge')
+    lines += [f'etl_counter{{{labels},name="{name}"}} {value}' for name, value in summary['counters'].items()]
+    lines += [f'etl_counter{{{labels},name="{name}"}} {value}' for name, value in summary['gauges'].items()]
+    lines.append('# TYPE etl_latency_seconds summary')
+    for name, latency in summary['latencies'].items():
+        for quantile in ('p50', 'p95'):
+            lines.append(f'etl_latency_seconds{{{labels},name="{name}",quantile="0.{quantile[1:]}"}} '
+                         f'{latency[quantile]}')
+        lines.append(f'etl_latency_seconds_sum{{{labels},name="{name}"}} {latency["total"]}')
+        lines.append(f'etl_latency_seconds_count{{{labels},name="{name}"}} {latency["count"]}')
+    return lines
+
+
+def write_prometheus_textfile(summary: dict, directory: str) -> str:
+    """Writes the summary where the node exporter textfile collector picks it up
+
+    Args:
+        summary (dict): Summary returned by report_metrics
+        directory (str): Directory watched by the collector
+
+    Returns:
+        str: Path of the written file, one per task and map index
+    """
+    name = re.sub(r'[^A-Za-z0-9_]', '_', f"etl_{summary['task']}_{summary['map_index']}")
+    path = os.path.join(directory, f'{name}.prom')
+    atomic_write(path, ('\n'.join(prometheus_lines(summary)) + '\n').encode())
+    return path
+
+
+def statsd_lines(summary: dict, prefix: str = STATSD_PREFIX) -> list:
+    """Formats a summary as StatsD metrics: timers in milliseconds, counters and gauges
+
+    Args:
+        summary (dict): Summary returned by report_metrics
+        prefix (str, optional): Prefix of every metric name
+
+    Returns:
+        List[str]: One StatsD line per value
+    """
+    base = f"{prefix}.{summary['task']}"
+    lines = [f'{base}.stage.{stage}:{seconds * 1000:.0f}|ms' for stage, seconds in summary['stages'].items()]
+    lines += [f'{base}.{name}:{value}|c' for name, value in summary['counters'].items()]
+    lines += [f'{base}.{name}:{value}|g' for name, value in summary['gauges'].items()]
+    for name, latency in summary['latencies'].items():
+        lines += [f'{base}.{name}.{quantile}:{latency[quantile] * 1000:.0f}|ms' for quantile in ('p50', 'p95', 'max')]
+    return lines
+
+
+def send_statsd(summary: dict, host: str, port: int) -> None:
+    """Sends the summary to a StatsD daemon over UDP, one datagram per value
+
+    Args:
+        summary (dict): Summary returned by report_metrics
+        host (str): Host of the daemon
+        port (int): UDP port of the daemon
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        for line in statsd_lines(summary):
+            sock.sendto(line.encode(), (host, port))
@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import threading
+import urllib.parse
+
+from utils.constants import PDF_CACHE_DIR, PDF_CACHE_ENABLED, PDF_CACHE_MAX_BYTES
+from utils.files import atomic_write
+
+_cache = None
+
+
+class PdfCache:
+    """Persistent on-disk cache of downloaded Drive PDFs.
+
+    PDF contents are stored once under their SHA-256 (`blobs/`), and every Drive file id points
+    to its content through a small JSON reference (`refs/`) that also keeps the Drive checksum
+    and revision. Writes are atomic, so several tasks can share the same directory, and the
+    least recently used blobs are evicted once the cache grows past `max_bytes`.
+
+    The size of the blobs is listed once, then kept up to date as blobs are written, so a put
+    only lists the directory again when the cache crosses `max_bytes`. Eviction then goes down to
+    `EVICT_TO` of it, so the next listing is only needed after that much more is written. Each
+    process counts its own writes only, so processes sharing the directory may overshoot the cap
+    until one of them crosses it.
+    """
+
+    # Share of max_bytes kept by an eviction
+    EVICT_TO = 0.9
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.total_bytes = None
+        self._lock = threading.Lock()
+
+    def get(self, file_id: str):
+        """Returns the cached content of a Drive file
+
+        Args:
+            file_id (str): Google Drive file ID
+
+        Returns:
+            bytes | None: Content of the file, or None if it is not cached
+        """
+        content = self.__read(file_id)
+        with self._lock:
+            if content is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.bytes_saved += len(content)
+        return content
+
+    def put(self, file_id: str, content: bytes, metadata: dict = None) -> None:
+        """Stores the content of a Drive file
+
+        Args:
+            file_id (str): Google Drive file ID
+            content (bytes): Content of the file
+            metadata (dict, optional): Drive metadata of the file (`md5Checksum`, `headRevisionId`)
+        """
+        metadata = metadata or {}
+        md5_checksum = metadata.get('md5Checksum')
+        if md5_checksum and hashlib.md5(content).hexdigest() != md5_checksum:
+            print(f"Checksum mismatch for {file_id}, not caching it")
+            return
+
+        sha256 = hashlib.sha256(content).hexdigest()
+        blob_path = self.__blob_path(sha256)
+        if not os.path.exists(blob_path):
+            atomic_write(blob_path, content)
+            with self._lock:
+                if self.total_bytes is not None:
+                    self.total_bytes += len(content)
+
+        ref = {
+            'sha256': sha256,
+            'size': len(content),
+            'md5Checksum': md5_checksum,
+            'headRevisionId': metadata.get('headRevisionId'),
+        }
+        atomic_write(self.__ref_path(file_id), json.dumps(ref).encode())
+
+        with self._lock:
+            over_limit = self.total_bytes is None or self.total_bytes > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self) -> None:
+        """Lists the blobs and, when they take more than `max_bytes`, removes the least recently used
+        ones until they fit in `EVICT_TO` of it
+        """
+        blobs_dir = os.path.join(self.directory, 'blobs')
+        if not os.path.isdir(blobs_dir):
+            with self._lock:
+                self.total_bytes = 0
+            return
+
+        entries = []
+        for entry in os.scandir(blobs_dir):
+            if entry.is_file() and not entry.name.startswith('.tmp-'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes * self.EVICT_TO:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+        with self._lock:
+            self.total_bytes = total
+
+    def report(self) -> dict:
+        """Prints and returns the hit, miss and bytes saved counters
+
+        Returns:
+            dict: Cache counters
+        """
+        stats = {'hits': self.hits, 'misses': self.misses, 'bytes_saved': self.bytes_saved}
+        print(f"PDF cache: {self.hits} hits, {self.misses} misses, {self.bytes_saved} bytes saved")
+        return stats
+
+    def __read(self, file_id: str):
+        try:
+            with open(self.__ref_path(file_id)) as f:
+                ref = json.load(f)
+            blob_path = self.__blob_path(ref['sha256'])
+            with open(blob_path, 'rb') as f:
+                content = f.read()
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+        if hashlib.sha256(content).hexdigest() != ref['sha256']:
+            return None
+
+        # Refresh the modification time, it is what the LRU eviction sorts by
+        try:
+            os.utime(blob_path)
+        except FileNotFoundError:
+            pass
+        return content
+
+    def __ref_path(self, file_id: str) -> str:
+        return os.path.join(self.directory, 'refs', f"{urllib.parse.quote(file_id, safe='')}.json")
+
+    def __blob_path(self, sha256: str) -> str:
+        return os.path.join(self.directory, 'blobs', f'{sha256}.pdf')
+
+
+def get_pdf_cache():
+    """Returns the process wide PDF cache
+
+    Returns:
+        PdfCache | None: The cache, or None when it is disabled
+    """
+    global _cache
+    if not PDF_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = PdfCache(PDF_CACHE_DIR, PDF_CACHE_MAX_BYTES)
+    return _cache
@@ -0,0 +1,458 @@
+import bisect
+import io
+import multiprocessing
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pdfplumber
+import pypdfium2
+
+from utils.constants import PDF_PARSE_PROCESSES, PDF_PARSE_TIME_LIMIT, PDF_EXTRACTION_BACKEND
+from utils.metrics import metrics
+
+# Bump whenever a change in the extraction can change its output, it invalidates the parsed table cache
+PDF_EXTRACTOR_VERSION = '1'
+
+PDF_COLUMN_MAPPING = {
+    'Código': 'code',
+    'Descripción': 'description',
+    'PVP': 'pvp',
+    'Cantidad': 'quantity',
+    'Total': 'total_amount',
+    'Causa de\ndevolucion': 'devolution_type'
+}
+
+# Header words of the supplier delivery note table, a page without all of them has no line items
+TEMPLATE_HEADER_WORDS = ('Código', 'Descripción', 'PVP', 'Cantidad', 'Total')
+
+# Column boundaries learned from the first page of every layout, keyed by the header word positions
+_templates = {}
+
+
+class PdfTimeoutError(BaseException):
+    """Raised inside a worker process when a PDF takes longer than the time limit.
+
+    It derives from BaseException so the broad `except Exception` blocks inside the PDF
+    libraries cannot swallow it.
+    """
+
+
+def extract_raw_tables(pdf_file, backend: str = PDF_EXTRACTION_BACKEND) -> list:
+    """Extracts the tables of every page of a PDF as plain rows
+
+    Args:
+        pdf_file (BytesIO): PDF file as a BytesIO object
+        backend (str, optional): Name of the extraction backend, one of PDF_BACKENDS
+
+    Returns:
+        List[List[List[str]]]: One list of rows per table, the first row being the header
+    """
+    try:
+        extract = PDF_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown PDF extraction backend: {backend}")
+    return extract(pdf_file)
+
+
+def register_backend(name: str, extract) -> None:
+    """Makes a table extraction backend available to extract_raw_tables and PDF_EXTRACTION_BACKEND
+
+    Args:
+        name (str): Name of the backend
+        extract (Callable[[BytesIO], List[List[List[str]]]]): Function returning the raw tables of a
+            PDF, with the header as the first row of each table, like extract_raw_tables
+    """
+    PDF_BACKENDS[name] = extract
+
+
+def extract_raw_tables_with_pdfplumber(pdf_file) -> list:
+    """Extracts the tables of a PDF with the generic pdfplumber table detection on every page
+
+    Args:
+        pdf_file (BytesIO): PDF file as a BytesIO object
+
+    Returns:
+        List[List[List[str]]]: One list of rows per table, the first row being the header
+    """
+    tables = []
+    with pdfplumber.open(pdf_file) as pdf:
+        for page in pdf.pages:
+            tables.extend(page.extract_tables())
+    return tables
+
+
+def extract_raw_tables_with_template(pdf_file) -> list:
+    """Extracts the tables of a delivery note PDF using the known supplier layout
+
+    Pages without the header words are skipped. The column boundaries are learned with the
+    generic detection on the first page of a layout and reused for the next pages (and PDFs),
+    which then only need their words bucketed into rows and columns. A page that does not fit
+    the template goes through the generic detection, and so does the whole PDF when no page
+    has the header.
+
+    Args:
+        pdf_file (BytesIO): PDF file as a BytesIO object
+
+    Returns:
+        List[List[List[str]]]: One list of rows per table, the first row being the header
+    """
+    tables = []
+    found_header = False
+    with pdfplumber.open(pdf_file) as pdf:
+        for page in pdf.pages:
+            words = page.extract_words()
+            header = __find_header_words(words)
+            if header is None:
+                continue
+            found_header = True
+
+            key = tuple(round(word['x0']) for word in header)
+            table = __extract_template_table(page, words, header, _templates[key]) if key in _templates else None
+            if table is None:
+                page_tables = page.find_tables()
+                tables.extend(page_table.extract() for page_table in page_tables)
+                __learn_template(key, page_tables)
+            else:
+                tables.append(table)
+
+        # Not the supplier layout, the pages are already parsed so only the table detection is left
+        if not found_header:
+            return [table for page in pdf.pages for table in page.extract_tables()]
+    return tables
+
+
+def __find_header_words(words: list):
+    """
+    Returns the first word of each header column, in TEMPLATE_HEADER_WORDS order, or None when
+    the page does not have all of them.
+    """
+    header = {}
+    for word in words:
+        if word['text'] in TEMPLATE_HEADER_WORDS and word['text'] not in header:
+            header[word['text']] = word
+    if len(header) < len(TEMPLATE_HEADER_WORDS):
+        return None
+    return [header[text] for text in TEMPLATE_HEADER_WORDS]
+
+
+def __learn_template(key: tuple, page_tables: list) -> None:
+    """
+    Remembers the column boundaries of the table found by the generic detection that starts
+    with the header.
+    """
+    for page_table in page_tables:
+        rows = page_table.extract()
+        if rows and rows[0] and rows[0][0] == TEMPLATE_HEADER_WORDS[0]:
+            columns = sorted({round(cell[0], 1) for cell in page_table.cells} | {round(page_table.bbox[2], 1)})
+            if len(columns) - 1 == len(rows[0]):
+                _templates[key] = columns
+            return
+
+
+def __extract_template_table(page, words: list, header: list, columns: list):
+    """
+    Builds the table of a page from its words, with the template column boundaries and the row
+    boundaries drawn on the page. Returns None when the page does not fit the template.
+    """
+    left, right = columns[0], columns[-1]
+    row_lines = __row_boundaries(page, left, right)
+    header_middle = (header[0]['top'] + header[0]['bottom']) / 2
+    first_row = bisect.bisect_right(row_lines, header_middle) - 1
+    if first_row < 0 or first_row >= len(row_lines) - 1:
+        return None
+    row_lines = row_lines[first_row:]
+
+    cells = {}
+    for word in words:
+        x_middle = (word['x0'] + word['x1']) / 2
+        y_middle = (word['top'] + word['bottom']) / 2
+        if not (left < x_middle < right and row_lines[0] < y_middle < row_lines[-1]):
+            continue
+        position = (bisect.bisect_right(row_lines, y_middle) - 1, bisect.bisect_right(columns, x_middle) - 1)
+        cells.setdefault(position, []).append(word)
+
+    table = [[__cell_text(cells.get((row, column), [])) for column in range(len(columns) - 1)]
+             for row in range(len(row_lines) - 1)]
+    if table[0][0] != TEMPLATE_HEADER_WORDS[0]:
+        return None
+    return table
+
+
+def __row_boundaries(page, left: float, right: float) -> list:
+    """
+    Returns the sorted y positions of the horizontal rules and cell borders between `left` and `right`.
+    """
+    positions = set()
+    for rect in page.rects:
+        if rect['x0'] < right and rect['x1'] > left:
+            positions.update((round(rect['top'], 1), round(rect['bottom'], 1)))
+    for line in page.lines:
+        if line['x0'] < right and line['x1'] > left and abs(line['top'] - line['bottom']) < 1:
+            positions.add(round(line['top'], 1))
+
+    boundaries = []
+    for position in sorted(positions):
+        if not boundaries or position - boundaries[-1] > 1:
+            boundaries.append(position)
+    return boundaries
+
+
+def __cell_text(words: list) -> str:
+    """
+    Joins the words of a cell like pdfplumber does, with spaces within a line and newlines between lines.
+    """
+    lines = []
+    for word in sorted(words, key=lambda word: (round(word['top']), word['x0'])):
+        if lines and abs(word['top'] - lines[-1][-1]['top']) <= 3:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+    return '\n'.join(' '.join(word['text'] for word in line) for line in lines)
+
+
+def raw_tables_to_dataframes(tables: list) -> list:
+    """Builds DataFrames from raw table rows, using the first row of each table as header
+
+    Args:
+        tables (List[List[List[str]]]): Raw tables as returned by `extract_raw_tables`
+
+    Returns:
+        List[pd.DataFrame]: List of DataFrames with mapped column names
+    """
+    tables_data = []
+    for table in tables:
+        df = pd.DataFrame(table[1:], columns=table[0])
+        df = df.rename(columns=PDF_COLUMN_MAPPING)
+        tables_data.append(df)
+    return tables_data
+
+
+def extract_raw_tables_with_text_layout(pdf_file) -> list:
+    """Extracts the tables of a delivery note PDF from the position of its text, with pdfium
+
+    Ruling lines are ignored. The columns start where the words of the first header line
+    start, and every line with text in the first column starts a new row, the lines below it
+    being appended to its cells. This only fits fixed column layouts like the supplier notes,
+    PDFs without the header words go through the pdfplumber backend.
+
+    Args:
+        pdf_file (BytesIO): PDF file as a BytesIO object
+
+    Returns:
+        List[List[List[str]]]: One list of rows per table, the first row being the header
+    """
+    tables = []
+    pdf = pypdfium2.PdfDocument(pdf_file.getvalue())
+    try:
+        for page in pdf:
+            words = __pdfium_words(page)
+            header = __find_header_words(words)
+            if header is not None:
+                tables.append(__text_layout_table(words, header))
+    finally:
+        pdf.close()
+
+    if not tables:
+        return extract_raw_tables_with_pdfplumber(pdf_file)
+    return tables
+
+
+def __pdfium_words(page) -> list:
+    """
+    Groups the characters of a page in words, with pdfplumber like coordinates (top from the page top).
+    """
+    height = page.get_height()
+    text_page = page.get_textpage()
+    text = text_page.get_text_range()
+    words = []
+    word = None
+    for index, char in enumerate(text):
+        if char.isspace():
+            word = None
+            continue
+        left, bottom, right, top = text_page.get_charbox(index, loose=True)
+        top, bottom = height - top, height - bottom
+        if word is None or abs(top - word['top']) > 2 or left - word['x1'] > 1.5:
+            word = {'text': '', 'x0': left, 'x1': right, 'top': top, 'bottom': bottom}
+            words.append(word)
+        word['text'] += char
+        word['x1'] = right
+    text_page.close()
+    return words
+
+
+def __text_layout_table(words: list, header: list) -> list:
+    """
+    Builds the table below the header from the lines of words.
+    """
+    lines = []
+    for word in sorted((word for word in words if word['top'] >= header[0]['top'] - 2),
+                       key=lambda word: (round(word['top']), word['x0'])):
+        if lines and abs(word['top'] - lines[-1][0]['top']) <= 3:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+
+    # Words of the first header line more than a few points apart start a new column
+    columns = []
+    for word in sorted(lines[0], key=lambda word: word['x0']):
+        if not columns or word['x0'] - columns[-1][1] > 5:
+            columns.append([word['x0'], word['x1']])
+        else:
+            columns[-1][1] = word['x1']
+    starts = [start - 1 for start, _ in columns]
+
+    rows = []
+    for line in lines:
+        cells = [[] for _ in starts]
+        for word in line:
+            cells[max(bisect.bisect_right(starts, word['x0']) - 1, 0)].append(word['text'])
+        if cells[0] or not rows:
+            rows.append([' '.join(cell) for cell in cells])
+        else:
+            rows[-1] = [f"{previous}\n{' '.join(cell)}" if cell else previous
+                        for previous, cell in zip(rows[-1], cells)]
+    return rows
+
+
+def extract_tables_from_pdfs(pdf_files: list, processes: int = PDF_PARSE_PROCESSES,
+                             time_limit: float = PDF_PARSE_TIME_LIMIT) -> list:
+    """Extracts the tables of several PDFs, optionally spreading them over worker processes
+
+    Workers receive the PDF bytes and send back plain rows, so nothing heavier than lists of
+    strings crosses the process boundary. The time limit of an in-process parse needs the main
+    thread, so when called from another thread (e.g. a backfill chunk) with a time limit the
+    PDFs go through a worker process even with `processes` set to 1.
+
+    Args:
+        pdf_files (List[BytesIO]): PDF files as BytesIO objects
+        processes (int, optional): Number of worker processes, 1 parses in the current process
+        time_limit (float, optional): Seconds a worker may spend on a single PDF
+
+    Returns:
+        List[List[List[List[str]]] | None]: Raw tables for each PDF, in the same order as `pdf_files`.
+            None for PDFs that failed or ran out of time.
+    """
+    in_process = processes <= 1 or len(pdf_files) <= 1
+    if in_process and time_limit and threading.current_thread() is not threading.main_thread():
+        in_process = False
+    if in_process or not pdf_files:
+        results = []
+        for pdf_file in pdf_files:
+            tables, seconds = _timed_extract_worker(pdf_file.getvalue(), time_limit)
+            results.append(tables)
+            metrics.observe('pdf_parse_seconds', seconds)
+        return results
+
+    payloads = [pdf_file.getvalue() for pdf_file in pdf_files]
+    with process_pool(min(max(processes, 1), len(payloads))) as executor:
+        results = list(executor.map(_timed_extract_worker, payloads, [time_limit] * len(payloads)))
+    for _, seconds in results:
+        metrics.observe('pdf_parse_seconds', seconds)
+    return [tables for tables, _ in results]
+
+
+def process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Creates a process pool for the PDF workers that is safe to start from any thread
+
+    Forking a process with other threads running can copy a lock another thread holds, so the
+    workers are started by a forkserver, or spawned where there is none.
+
+    Args:
+        max_workers (int): Number of worker processes
+
+    Returns:
+        ProcessPoolExecutor: Pool to use as a context manager or shut down by the caller
+    """
+    start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(start_method))
+
+
+def submit_pdf(executor: ProcessPoolExecutor, pdf_file, time_limit: float = PDF_PARSE_TIME_LIMIT):
+    """Queues one PDF on a process pool owned by the caller, for callers that parse PDFs as they arrive
+
+    Args:
+        executor (ProcessPoolExecutor): Pool running the parse
+        pdf_file (BytesIO): PDF file
+        time_limit (float, optional): Seconds the worker may spend on the PDF
+
+    Returns:
+        Future: Resolves to the raw tables of the PDF, or None if it failed or ran out of time, and
+            the seconds the parse took
+    """
+    return executor.submit(_timed_extract_worker, pdf_file.getvalue(), time_limit)
+
+
+def _timed_extract_worker(pdf_bytes: bytes, time_limit: float) -> tuple:
+    """Process pool entry point returning the parse time along with the tables, see _extract_worker
+    """
+    start = time.perf_counter()
+    tables = _extract_worker(pdf_bytes, time_limit)
+    return tables, time.perf_counter() - start
+
+
+def _extract_worker(pdf_bytes: bytes, time_limit: float):
+    """Process pool entry point, parses one PDF under a time limit
+
+    Also used for the in-process parse. The limit is a SIGALRM timer, so it only applies in the
+    main thread, extract_tables_from_pdfs sends the parses of other threads to a worker process.
+    A timer already set, e.g. the Airflow execution_timeout, is restored afterwards and fires no
+    later than it would have.
+
+    Args:
+        pdf_bytes (bytes): Content of the PDF
+        time_limit (float): Seconds allowed before the parse is interrupted
+
+    Returns:
+        List[List[List[str]]] | None: Raw tables, or None if the PDF failed or ran out of time
+    """
+    start = time.monotonic()
+    use_alarm = bool(time_limit) and hasattr(signal, 'setitimer') and \
+        threading.current_thread() is threading.main_thread()
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, __raise_timeout)
+        previous_delay, previous_interval = signal.setitimer(signal.ITIMER_REAL, time_limit)
+        if previous_delay and previous_delay < time_limit:
+            signal.setitimer(signal.ITIMER_REAL, previous_delay)
+    try:
+        tables = __extract_raw_tables_safely(io.BytesIO(pdf_bytes))
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+            if previous_delay:
+                remaining = previous_delay - (time.monotonic() - start)
+                signal.setitimer(signal.ITIMER_REAL, max(remaining, 0.001), previous_interval)
+
+    if time_limit and time.monotonic() - start > time_limit:
+        print("Tiempo agotado al procesar el PDF")
+        return None
+    return tables
+
+
+def __extract_raw_tables_safely(pdf_file):
+    """Extracts raw tables, returning None instead of raising when the PDF cannot be parsed
+    """
+    try:
+        return extract_raw_tables(pdf_file)
+    except PdfTimeoutError as e:
+        print(f"Tiempo agotado al procesar el PDF: {str(e)}")
+        return None
+    except Exception as e:
+        print(f"Error al procesar el PDF: {str(e)}")
+        return None
+
+
+def __raise_timeout(signum, frame):
+    raise PdfTimeoutError("PDF parsing exceeded the time limit")
+
+
+# Table extraction backends by name, see register_backend
+PDF_BACKENDS = {
+    'pdfplumber': extract_raw_tables_with_pdfplumber,
+    'template': extract_raw_tables_with_template,
+    'text_layout': extract_raw_tables_with_text_layout,
+}
@@ -0,0 +1,68 @@
+import threading
+import time
+
+from utils.constants import SHEETS_READS_PER_MINUTE
+
+
+class TokenBucket:
+    """Throttles requests to a quota of `rate` requests every `period` seconds
+
+    The bucket starts full, so short bursts go through at once, and refills continuously.
+    It is thread safe, callers block in `acquire` until a token is available.
+    """
+
+    def __init__(self, rate: float, period: float = 60.0, capacity: float = None,
+                 clock=time.monotonic, sleep=time.sleep):
+        """
+        Args:
+            rate (float): Requests allowed per period
+            period (float, optional): Length of the quota window, in seconds
+            capacity (float, optional): Largest burst, `rate` by default
+            clock (callable, optional): Monotonic clock, in seconds
+            sleep (callable, optional): Function waiting the given seconds
+        """
+        self.capacity = capacity or rate
+        self.refill_per_second = rate / period
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated_at = clock()
+        self.waited = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> float:
+        """Takes tokens from the bucket, waiting for them to refill if needed
+
+        Args:
+            tokens (float, optional): Number of requests about to be made
+
+        Returns:
+            float: Seconds waited
+        """
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+            self.updated_at = now
+            self.tokens -= tokens
+            wait = max(0.0, -self.tokens / self.refill_per_second)
+            self.waited += wait
+
+        # Tokens are taken before waiting, so concurrent callers queue behind each other
+        if wait:
+            self.sleep(wait)
+        return wait
+
+
+_sheets_rate_limiter = None
+
+
+def get_sheets_rate_limiter() -> TokenBucket:
+    """Returns the token bucket shared by every Sheets read of the process
+
+    Returns:
+        TokenBucket: Bucket sized to SHEETS_READS_PER_MINUTE
+    """
+    global _sheets_rate_limiter
+    if _sheets_rate_limiter is None:
+        _sheets_rate_limiter = TokenBucket(SHEETS_READS_PER_MINUTE)
+    return _sheets_rate_limiter
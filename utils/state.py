@@ -0,0 +1,88 @@
+import json
+import os
+import time
+
+from utils.constants import STATE_DIR
+from utils.files import atomic_write
+
+WATERMARK_STATE = 'sheet_watermark'
+
+
+def read_state(name: str, default: dict = None) -> dict:
+    """Read a JSON document from the local state store.
+
+    Args:
+        name (str): Name of the state document
+        default (dict, optional): Value returned when the document does not exist yet
+
+    Returns:
+        dict: The stored document
+    """
+    try:
+        with open(__state_path(name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return dict(default or {})
+
+
+def write_state(name: str, state: dict) -> None:
+    """Atomically replace a JSON document in the local state store.
+
+    Args:
+        name (str): Name of the state document
+        state (dict): Document to store
+    """
+    atomic_write(__state_path(name), json.dumps(state, indent=2, default=str).encode())
+
+
+def delete_state(name: str) -> None:
+    """Remove a JSON document from the local state store, if it exists.
+
+    Args:
+        name (str): Name of the state document
+    """
+    try:
+        os.remove(__state_path(name))
+    except FileNotFoundError:
+        pass
+
+
+def stale_states(prefix: str, max_age_seconds: float) -> list:
+    """List the state documents of a kind that were not written for a while.
+
+    Args:
+        prefix (str): Start of the names of the documents, e.g. 'backfill_'
+        max_age_seconds (float): Age of the last write past which a document is stale
+
+    Returns:
+        List[str]: Names of the stale documents
+    """
+    if not os.path.isdir(STATE_DIR):
+        return []
+    now = time.time()
+    return [entry.name[:-len('.json')] for entry in os.scandir(STATE_DIR)
+            if entry.name.startswith(prefix) and entry.name.endswith('.json')
+            and now - entry.stat().st_mtime > max_age_seconds]
+
+
+def read_watermark() -> dict:
+    """Read the last sheet row that was loaded.
+
+    Returns:
+        dict: `row` (sheet row number, the header being row 1) and `timestamp` ("Marca temporal" of that row)
+    """
+    return read_state(WATERMARK_STATE, default={'row': 1, 'timestamp': None})
+
+
+def commit_watermark(watermark: dict) -> None:
+    """Advance the sheet watermark, only called once the rows up to it are loaded.
+
+    Args:
+        watermark (dict): `row` and `timestamp` of the last loaded sheet row
+    """
+    write_state(WATERMARK_STATE, watermark)
+    print(f"Watermark advanced to row {watermark['row']} ({watermark['timestamp']})")
+
+
+def __state_path(name: str) -> str:
+    return os.path.join(STATE_DIR, f'{name}.json')
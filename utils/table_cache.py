@@ -0,0 +1,102 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+
+import pandas as pd
+
+from utils.constants import TABLE_CACHE_DIR, TABLE_CACHE_ENABLED, PDF_EXTRACTION_BACKEND
+from utils.files import atomic_write
+from utils.pdf_extraction import PDF_COLUMN_MAPPING, PDF_EXTRACTOR_VERSION
+
+_cache = None
+
+
+class TableCache:
+    """Persistent cache of the tables parsed from each PDF.
+
+    Entries are parquet fragments keyed by the SHA-256 of the PDF content, stored under a
+    namespace derived from the extractor version, the extraction backend and the column mapping.
+    Changing any of them moves the cache to a new namespace, so stale tables are never returned.
+    """
+
+    def __init__(self, directory: str, extractor_version: str = PDF_EXTRACTOR_VERSION,
+                 column_mapping: dict = PDF_COLUMN_MAPPING, backend: str = PDF_EXTRACTION_BACKEND):
+        fingerprint = json.dumps({'version': extractor_version, 'mapping': column_mapping, 'backend': backend},
+                                 sort_keys=True)
+        self.root = directory
+        self.namespace = hashlib.sha256(fingerprint.encode()).hexdigest()[:16]
+        self.directory = os.path.join(directory, self.namespace)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, content_hash: str):
+        """Returns the tables cached for a PDF
+
+        Args:
+            content_hash (str): SHA-256 of the PDF content
+
+        Returns:
+            pd.DataFrame | None: Tables of the PDF concatenated in one DataFrame (empty if the PDF
+                has no tables), or None if the PDF was never parsed
+        """
+        try:
+            df = pd.read_parquet(self.__fragment_path(content_hash))
+        except (FileNotFoundError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return df
+
+    def put(self, content_hash: str, tables: list) -> None:
+        """Stores the tables parsed from a PDF
+
+        Args:
+            content_hash (str): SHA-256 of the PDF content
+            tables (List[pd.DataFrame]): Tables extracted from the PDF
+        """
+        df = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame()
+        buffer = io.BytesIO()
+        try:
+            df.to_parquet(buffer, index=False)
+        except Exception as e:
+            print(f"Could not cache tables for PDF {content_hash}: {e}")
+            return
+        atomic_write(self.__fragment_path(content_hash), buffer.getvalue())
+
+    def prune_stale_namespaces(self) -> None:
+        """Deletes the fragments written by other extractor versions or column mappings
+        """
+        if not os.path.isdir(self.root):
+            return
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and entry.name != self.namespace:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def report(self) -> dict:
+        """Prints and returns the hit and miss counters
+
+        Returns:
+            dict: Cache counters
+        """
+        print(f"Parsed table cache: {self.hits} hits, {self.misses} misses")
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def __fragment_path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, f'{content_hash}.parquet')
+
+
+def get_table_cache():
+    """Returns the process wide parsed table cache
+
+    Returns:
+        TableCache | None: The cache, or None when it is disabled
+    """
+    global _cache
+    if not TABLE_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = TableCache(TABLE_CACHE_DIR)
+        _cache.prune_stale_namespaces()
+    return _cache